@@ -0,0 +1,50 @@
+import threading
+import time
+from typing import Optional
+
+import requests
+
+
+class AuthCheck:
+    """
+    Whether the app is enabled, asked of the license server at `url` and
+    cached for `ttl` seconds, so a page load doesn't wait on the internet.
+    While the server can't be reached the last answer stands for up to
+    `grace` seconds. stub "allow" / "deny" answers without asking anyone,
+    for offline testing.
+    """
+
+    def __init__(self, url: str, ttl: float = 300, grace: float = 86400, stub: str = "", timeout: float = 5):
+        self.url = url
+        self.ttl = ttl
+        self.grace = grace
+        self.stub = stub.strip().lower()
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._allowed: Optional[bool] = None
+        self._checked = 0.0     # when the server last answered
+        self._tried = 0.0       # when it was last asked
+
+    def _ask(self) -> bool:
+        res = requests.get(self.url, timeout=self.timeout)
+        return bool(res.json()["authenticated"])
+
+    def allowed(self) -> bool:
+        if self.stub:
+            return self.stub == "allow"
+        now = time.monotonic()
+        if self._allowed is not None and now - self._tried < self.ttl:
+            return self._allowed
+        # one request refreshes, the ones arriving meanwhile wait for its answer
+        with self._lock:
+            if self._allowed is not None and time.monotonic() - self._tried < self.ttl:
+                return self._allowed
+            self._tried = time.monotonic()
+            try:
+                self._allowed = self._ask()
+                self._checked = self._tried
+            except Exception as e:
+                print(f"Auth check failed: {e!r}")
+                if self._allowed is None or self._tried - self._checked > self.grace:
+                    self._allowed = False
+            return self._allowed
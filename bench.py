@@ -0,0 +1,364 @@
+# End-to-end benchmark of the poller, the historian, the live hub and the
+# reports, offline against a local stand-in for the plant:
+#
+#   python bench.py                                   # 4 devices x 50 registers
+#   python bench.py -n 16 -m 200 --interval 0.1 --clients 200
+#   python bench.py --ranges 1 24 168 720 --span 720  # report time vs range
+#
+# A pymodbus simulator runs in its own process with N slave ids behind one
+# TCP port (a gateway with N meters), M holding registers each, changing
+# every --change seconds. The samples go to a throwaway Postgres database
+# (created next to the local one and dropped afterwards, --keep keeps it),
+# so COPY, the rollups and the report queries are the real ones.
+#
+#   poll:      PollEngine over the simulator for -d seconds: cycles/s
+#              against the target, p50/p99 cycle latency (poll start to
+#              sample handed to the historian and the live feed)
+#   ws:        livehub.py fed by that poller, with loadtest.py's dashboard
+#              clients connected during the poll stage
+#   historian: --span hours of samples every --step seconds per device,
+#              written through Historian: rows/s of COPY, rollup merge time
+#   report:    serve.py answering /downloadlog (csv and excel) for each of
+#              --ranges hours, ending at the newest sample
+#
+# Every result is appended to --out as a JSON line with the commit and the
+# parameters, and compared with the last result of the same test and
+# parameters found there, so a regression shows up as a change between
+# two commits.
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import aiohttp
+import asyncpg
+from pymodbus.client import AsyncModbusTcpClient
+
+import db
+from genstate import GENS_SCHEMA, GenStateCache
+from historian import Historian
+from livefeed import FRAMES, LiveFeed, LivePublisher
+from loadtest import percentile, report
+from pollengine import Device, PollEngine
+from readings import SampleWriter, ensure_sample_table
+from readplanner import Signal, plan_groups
+from rollups import RollupAccumulator, ensure_rollup_tables, pick_tier
+from transport import GOOD, ModbusTransport, client_timeout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASE_ADDRESS = 4000
+
+# the headline number of each test, and whether bigger is better
+HEADLINES = {
+    "poll": [("cycles_per_s", True), ("p99_ms", False)],
+    "ws": [("frames_per_s", True), ("spread_p99_ms", False)],
+    "historian": [("rows_per_s", True)],
+    "report": [("seconds", False)],
+}
+# what has to match for two results to be compared
+PARAMETERS = ("test", "devices", "registers", "interval", "clients", "hours", "file", "step")
+
+
+def bench_signals(registers: int) -> List[Signal]:
+    return [Signal(BASE_ADDRESS + i, f"Register {i}", "uint16", 0.1, "V") for i in range(registers)]
+
+
+def simulator(port: int, devices: int, registers: int, change: float) -> None:
+    """the plant: `devices` slave ids of `registers` wandering values, in its own process"""
+    from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+    from pymodbus.server import StartAsyncTcpServer
+
+    async def run():
+        size = BASE_ADDRESS + registers + 2
+        slaves = {i: ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0] * size)) for i in range(1, devices + 1)}
+
+        async def wander():
+            while True:
+                for slave in slaves.values():
+                    slave.setValues(3, BASE_ADDRESS, [random.randrange(2200, 2400) for _ in range(registers)])
+                await asyncio.sleep(change)
+
+        asyncio.ensure_future(wander())
+        await StartAsyncTcpServer(context=ModbusServerContext(slaves=slaves, single=False), address=("127.0.0.1", port))
+
+    asyncio.run(run())
+
+
+async def wait_port(port: int, timeout: float = 30) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Nothing is listening on :{port}")
+            await asyncio.sleep(0.1)
+
+
+def start(script: str, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.join(HERE, script)], cwd=HERE,
+                            env={**os.environ, **env}, stdout=subprocess.DEVNULL)
+
+
+async def maintenance(sql: str) -> None:
+    # the same server and role as db.local_pool
+    conn = await asyncpg.connect(host="localhost", port="5432", user="devgadbadr",
+                                 password=os.getenv("DB_PASSWORD_LOCAL"), database="postgres")
+    try:
+        await conn.execute(sql)
+    finally:
+        await conn.close()
+
+
+async def poll_stage(args, pool: asyncpg.Pool, signals: List[Signal], socket: str) -> List[dict]:
+    feed = LiveFeed(signals)
+    publisher = LivePublisher(feed, socket)
+    historian = Historian(pool, SampleWriter(signals), resolution=0, rollups=RollupAccumulator(signals))
+    latencies: List[float] = []
+    started: Dict[str, float] = {}
+    qualities: Dict[str, int] = {}
+
+    async def on_sample(device: Device, values: dict):
+        payload = {"device": device.name, **values}
+        publisher.publish(payload)
+        historian.add(device.name, datetime.now(timezone.utc), payload)
+        latencies.append(time.perf_counter() - started[device.name])
+        qualities[values["quality"]] = qualities.get(values["quality"], 0) + 1
+
+    plans = plan_groups(signals)
+    engine = PollEngine(plans, on_sample)
+    poll = engine.poll
+
+    async def timed_poll(device: Device, pollclass: str):
+        started[device.name] = time.perf_counter()
+        return await poll(device, pollclass)
+
+    engine.poll = timed_poll
+    client = AsyncModbusTcpClient("127.0.0.1", port=args.modbus_port, timeout=client_timeout(args.timeout),
+                                  retries=0, reconnect_delay=0)
+    await client.connect()
+    engine.add_link(("127.0.0.1", args.modbus_port), ModbusTransport(client, name="simulator", request_timeout=args.timeout))
+    for i in range(1, args.devices + 1):
+        engine.add_device(Device(f"bench{i}", slave=i, interval=args.interval, host="127.0.0.1", port=args.modbus_port))
+
+    ws = None
+    if args.clients:
+        out = tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False).name
+        # the clients connect during the warm-up and are measured over the same seconds
+        ws = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, "loadtest.py"), "ws", f"ws://127.0.0.1:{args.hub_port}/live",
+            "-n", str(args.clients), "-d", str(args.duration), "--ramp", str(args.warmup), "--out", out,
+            stdout=subprocess.DEVNULL,
+        )
+    tasks = [asyncio.ensure_future(t) for t in (engine.run(), historian.run(), publisher.run())]
+    await asyncio.sleep(args.warmup)
+    latencies.clear()
+    qualities.clear()
+    written, frames = historian.written, FRAMES.labels("delta").value
+    begin = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - begin
+    cycles = len(latencies)
+    result = {
+        "test": "poll", "devices": args.devices, "registers": args.registers, "interval": args.interval,
+        "requests_per_cycle": sum(len(p) for p in plans.values()), "seconds": elapsed,
+        "cycles": cycles, "cycles_per_s": cycles / elapsed, "target_per_s": args.devices / args.interval,
+        "p50_ms": (percentile(latencies, 0.50) or 0) * 1e3,
+        "p99_ms": (percentile(latencies, 0.99) or 0) * 1e3,
+        "not_good": cycles - qualities.get(GOOD, 0),
+        "deltas_sent": FRAMES.labels("delta").value - frames,
+    }
+    if ws is not None:
+        await ws.wait()
+        with open(out) as f:
+            lines = f.read().splitlines()
+        os.unlink(out)
+    for t in tasks:
+        t.cancel()
+    # the historian stores what it still holds on the way out
+    await asyncio.gather(*tasks, return_exceptions=True)
+    result["rows_written"] = historian.written - written
+    client.close()
+    results = [result]
+    if ws is not None and lines:
+        results.append({**json.loads(lines[-1]), "devices": args.devices, "registers": args.registers,
+                        "interval": args.interval})
+    return results
+
+
+async def historian_stage(args, pool: asyncpg.Pool, signals: List[Signal], end: datetime) -> dict:
+    historian = Historian(pool, SampleWriter(signals), resolution=0, batch_size=args.batch,
+                          rollups=RollupAccumulator(signals))
+    # a few value sets, cycled: building them isn't what's measured
+    values = [{"quality": GOOD, **{s.name: random.randrange(2200, 2400) / 10 for s in signals}} for _ in range(64)]
+    copy, rollups = db.DB_SECONDS.labels("copy"), db.DB_SECONDS.labels("rollups")
+    copied, merged = copy.sum, rollups.sum
+    count = int(args.span * 3600 / args.step)
+    rows = 0
+    begin = time.perf_counter()
+    for i in range(count):
+        ts = end - timedelta(seconds=(count - i) * args.step)
+        for d in range(1, args.devices + 1):
+            historian.add(f"bench{d}", ts, values[(i + d) % len(values)])
+            rows += 1
+            if rows % args.batch == 0:
+                await historian.flush()
+    await historian.flush()
+    elapsed = time.perf_counter() - begin
+    copied = copy.sum - copied
+    return {
+        "test": "historian", "devices": args.devices, "registers": args.registers, "step": args.step,
+        "rows": rows, "seconds": elapsed, "rows_per_s": rows / copied if copied else 0.0,
+        "copy_s": copied, "rollups_s": rollups.sum - merged, "end_to_end_rows_per_s": rows / elapsed,
+    }
+
+
+async def report_stage(args, end: datetime) -> List[dict]:
+    results = []
+    url = f"http://127.0.0.1:{args.web_port}/downloadlog"
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        for hours in args.ranges:
+            for file in ("csv", "excel"):
+                body = {"from": (end - timedelta(hours=hours)).isoformat(), "to": end.isoformat(), "file": file}
+                begin = time.perf_counter()
+                async with session.post(url, json=body) as resp:
+                    size = len(await resp.read())
+                results.append({
+                    "test": "report", "devices": args.devices, "registers": args.registers, "hours": hours,
+                    "file": file, "tier": pick_tier(hours * 3600) or "raw", "status": resp.status,
+                    "bytes": size, "seconds": time.perf_counter() - begin,
+                })
+    return results
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous(out: str, result: dict) -> Optional[dict]:
+    """the last stored result of the same test with the same parameters"""
+    if not os.path.exists(out):
+        return None
+    last = None
+    with open(out) as f:
+        for line in f:
+            old = json.loads(line)
+            if all(old.get(k) == result.get(k) for k in PARAMETERS):
+                last = old
+    return last
+
+
+def compare(result: dict, old: Optional[dict], threshold: float) -> None:
+    if old is None:
+        return
+    for key, higher in HEADLINES.get(result["test"], ()):
+        a, b = old.get(key), result.get(key)
+        if not a or b is None:
+            continue
+        change = (b - a) / a * 100
+        worse = change < 0 if higher else change > 0
+        flag = "  <- worse" if worse and abs(change) >= threshold else ""
+        print(f"{'vs ' + str(old.get('commit')):>16}: {key} {round(a, 3)} -> {round(b, 3)} ({change:+.1f}%){flag}")
+
+
+async def run(args) -> List[dict]:
+    name = args.db
+    os.environ["DB_NAME_LOCAL"] = name
+    await maintenance(f'DROP DATABASE IF EXISTS "{name}"')
+    await maintenance(f'CREATE DATABASE "{name}"')
+    socket = os.path.join(tempfile.gettempdir(), f"scadaonpi-bench-{os.getpid()}.sock")
+    reports = tempfile.mkdtemp(prefix="scadaonpi-bench-")
+    sim = multiprocessing.Process(target=simulator, daemon=True,
+                                  args=(args.modbus_port, args.devices, args.registers, args.change))
+    sim.start()
+    hub = start("livehub.py", {"LIVEHUB_SOCKET": socket, "LIVEHUB_PORT": str(args.hub_port)})
+    web = None
+    pool = await db.local_pool()
+    try:
+        signals = bench_signals(args.registers)
+        async with pool.acquire() as conn:
+            await ensure_sample_table(conn, signals)
+            await ensure_rollup_tables(conn)
+            await conn.execute(GENS_SCHEMA)
+        # gen_runs, which the reports read
+        await GenStateCache.load(pool)
+        await wait_port(args.modbus_port)
+        await wait_port(args.hub_port)
+        # the written samples end where the polled ones begin, so their keys don't collide
+        end = datetime.now(timezone.utc)
+        print(f"Polling {args.devices} devices x {args.registers} registers every {args.interval}s")
+        results = await poll_stage(args, pool, signals, socket)
+        print(f"Writing {args.span}h of samples every {args.step}s")
+        results.append(await historian_stage(args, pool, signals, end))
+        web = start("serve.py", {"WEB_PORT": str(args.web_port), "REPORTS_DIR": reports, "AUTH_STUB": "allow"})
+        await wait_port(args.web_port)
+        print(f"Reports over {', '.join(f'{h}h' for h in args.ranges)}")
+        results += await report_stage(args, end)
+        return results
+    finally:
+        await pool.close()
+        for proc in (hub, web):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        sim.terminate()
+        shutil.rmtree(reports, ignore_errors=True)
+        if os.path.exists(socket):
+            os.unlink(socket)
+        if not args.keep:
+            await maintenance(f'DROP DATABASE IF EXISTS "{name}"')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the poller, historian, live hub and reports against a simulator")
+    parser.add_argument("-n", "--devices", type=int, default=4, help="simulated meters, one slave id each")
+    parser.add_argument("-m", "--registers", type=int, default=50, help="holding registers polled per meter")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between polls of a meter")
+    parser.add_argument("--timeout", type=float, default=1, help="seconds per Modbus request")
+    parser.add_argument("--change", type=float, default=0.5, help="seconds between new simulator values")
+    parser.add_argument("-d", "--duration", type=float, default=20, help="seconds of polling to measure")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of polling before measuring")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="dashboards on the live hub, 0 for none")
+    parser.add_argument("--span", type=float, default=168, help="hours of samples to write for the reports")
+    parser.add_argument("--step", type=float, default=10, help="seconds between written samples")
+    parser.add_argument("--batch", type=int, default=500, help="historian rows per COPY")
+    parser.add_argument("--ranges", type=float, nargs="+", default=[1, 24, 168], help="report ranges in hours")
+    parser.add_argument("--db", default="scadaonpi_bench", help="throwaway database, dropped first")
+    parser.add_argument("--keep", action="store_true", help="leave the database for a look afterwards")
+    parser.add_argument("--modbus-port", type=int, default=5021)
+    parser.add_argument("--hub-port", type=int, default=3101)
+    parser.add_argument("--web-port", type=int, default=3100)
+    parser.add_argument("--threshold", type=float, default=20, help="percent change flagged as worse")
+    parser.add_argument("--out", default=os.path.join(HERE, "bench-results.jsonl"),
+                        help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    results = asyncio.run(run(args))
+    run_info = {"commit": commit(), "at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    for result in results:
+        result = {**run_info, **result}
+        print()
+        old = previous(args.out, result)
+        report(result, args.out)
+        compare(result, old, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
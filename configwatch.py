@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+import asyncpg
+
+from db import CONFIG_CHANNEL, fetch_map_version, fetch_settings, fetch_signals
+
+log = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """
+    Tells a poller when the register map or the serial settings change, so
+    it can switch over in place instead of being restarted.
+
+    The settings are in the local database, where the web app sends a
+    NOTIFY on CONFIG_CHANNEL after saving them; the watcher keeps one
+    pooled connection LISTENing for it. The map is in the remote database
+    and is only asked for its digest every `interval` seconds, the rows are
+    fetched when that changes. Both are checked on every notification, on
+    the interval, and whenever the listening connection is opened again,
+    so a change made while it was down is still picked up.
+
+    map_version / settings: what the poller started with (fetch_map_version,
+    fetch_settings). on_map gets the new tpm rows, on_settings the new
+    settings row. When a callback raises, the change counts as not
+    applied and is tried again at the next check.
+    """
+
+    def __init__(
+        self,
+        local: asyncpg.Pool,
+        remote: asyncpg.Pool,
+        on_map: Callable[[List[asyncpg.Record]], Awaitable[None]],
+        on_settings: Optional[Callable[[asyncpg.Record], Awaitable[None]]] = None,
+        interval: float = 30,
+        map_version: Optional[str] = None,
+        settings: Optional[asyncpg.Record] = None,
+    ):
+        self.local = local
+        self.remote = remote
+        self.on_map = on_map
+        self.on_settings = on_settings
+        self.interval = interval
+        self.map_version = map_version
+        self.settings = None if settings is None else dict(settings)
+        self._wake = asyncio.Event()
+
+    async def check(self) -> None:
+        version = await fetch_map_version(self.remote)
+        if version != self.map_version:
+            log.info("Register map changed, reloading it")
+            await self.on_map(await fetch_signals(self.remote))
+            self.map_version = version
+        if self.on_settings is not None:
+            settings = await fetch_settings(self.local)
+            if dict(settings) != self.settings:
+                log.info("Settings changed, applying them")
+                await self.on_settings(settings)
+                self.settings = dict(settings)
+
+    def _notified(self, conn, pid, channel, payload) -> None:
+        self._wake.set()
+
+    async def _watch(self, conn: asyncpg.Connection) -> None:
+        await conn.add_listener(CONFIG_CHANNEL, self._notified)
+        self._wake.set()
+        while not conn.is_closed():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            # notifications arriving during the check set it again for another round
+            self._wake.clear()
+            try:
+                await self.check()
+            except Exception as e:
+                log.warning("Config check failed, trying again later: %r", e)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with self.local.acquire() as conn:
+                    try:
+                        await self._watch(conn)
+                    finally:
+                        if not conn.is_closed():
+                            await conn.remove_listener(CONFIG_CHANNEL, self._notified)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                log.warning("Config listener lost: %r", e)
+            await asyncio.sleep(self.interval)
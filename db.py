@@ -0,0 +1,147 @@
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import asyncpg
+
+from metrics import Histogram
+
+# asyncpg prepares every statement the first time a pooled connection runs
+# it and keeps it in that connection's statement cache, so the hot
+# statements (gens transitions, tpmsample inserts, settings reads) are
+# planned once per connection. 0 keeps them for the connection's lifetime
+# instead of re-preparing every 5 minutes.
+STATEMENT_LIFETIME = 0
+
+
+async def local_pool(**kwargs) -> asyncpg.Pool:
+    """Pool on the Pi's own database: samples, gens, settings, rollups."""
+    return await asyncpg.create_pool(
+        host="localhost",
+        port="5432",
+        database=os.getenv("DB_NAME_LOCAL"),
+        password=os.getenv("DB_PASSWORD_LOCAL"),
+        user="devgadbadr",
+        min_size=1,
+        max_size=int(os.getenv("DB_POOL_MAX", "10")),
+        max_cached_statement_lifetime=STATEMENT_LIFETIME,
+        **kwargs,
+    )
+
+
+async def remote_pool(**kwargs) -> asyncpg.Pool:
+    """Pool on the remote database holding the tpm register map; no idle connections."""
+    return await asyncpg.create_pool(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_NAME"),
+        password=os.getenv("DB_PASSWORD"),
+        user=os.getenv("DB_USER"),
+        min_size=0,
+        max_size=2,
+        max_cached_statement_lifetime=STATEMENT_LIFETIME,
+        **kwargs,
+    )
+
+
+# the pollers' hot statements: historian COPY batches (and their INSERT
+# fallback), rollup merges, generator transitions
+DB_SECONDS = Histogram("scada_db_seconds", "Poller statements on the local database", ("statement",))
+
+# what a statement on a pool raises while the database is down or restarting
+STORE_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+# NOTIFY on this channel makes the pollers look for settings and register
+# map changes at once instead of at their next check, see configwatch.py
+CONFIG_CHANNEL = "scadaonpi_config"
+
+
+async def fetch_signals(pool: asyncpg.Pool) -> List[asyncpg.Record]:
+    return await pool.fetch("select * from tpm")
+
+
+async def fetch_map_version(pool: asyncpg.Pool) -> str:
+    """digest of the whole tpm table, so a change can be seen without fetching it"""
+    return await pool.fetchval("select md5(coalesce(string_agg(tpm::text, '|' order by address), '')) from tpm")
+
+
+async def fetch_settings(pool: asyncpg.Pool) -> asyncpg.Record:
+    return await pool.fetchrow("select * from settings where id = 1")
+
+
+class WaitingPool:
+    """
+    psycopg2 pool wrapper that makes a request wait up to `timeout`
+    seconds for a free connection, where the pool itself would fail at
+    once when every connection is borrowed. Under gevent (serve.py) the
+    wait only parks the request's greenlet.
+    """
+
+    def __init__(self, pool, size: int, timeout: float):
+        self._pool = pool
+        self._slots = threading.BoundedSemaphore(size)
+        self.timeout = timeout
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            from psycopg2.pool import PoolError
+            raise PoolError(f"No database connection free after {self.timeout}s")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close: bool = False) -> None:
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        self._pool.closeall()
+
+
+def web_pool(maxconn: int = 0) -> WaitingPool:
+    """
+    Thread-safe psycopg2 pool for the Flask app; every request borrows its
+    own connection instead of sharing one cursor.
+    """
+    from psycopg2.pool import ThreadedConnectionPool
+    maxconn = maxconn or int(os.getenv("DB_POOL_MAX", "10"))
+    return WaitingPool(
+        ThreadedConnectionPool(
+            1,
+            maxconn,
+            host="localhost",
+            port="5432",
+            database=os.getenv("DB_NAME_LOCAL"),
+            password=os.getenv("DB_PASSWORD_LOCAL"),
+            user="devgadbadr",
+        ),
+        maxconn,
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    )
+
+
+@contextmanager
+def pooled_cursor(pool, name: Optional[str] = None, itersize: int = 2000) -> Iterator:
+    """
+    Cursor on a borrowed connection, returned to `pool` afterwards.
+    name: open a server-side cursor instead, which streams the result
+      `itersize` rows at a time; it runs inside a read transaction
+    """
+    conn = pool.getconn()
+    try:
+        conn.autocommit = name is None
+        with conn.cursor(name=name) as cur:
+            if name is not None:
+                cur.itersize = itersize
+            yield cur
+    finally:
+        if name is not None and not conn.closed:
+            conn.rollback()
+        # a connection that broke mid-request is closed instead of reused
+        pool.putconn(conn, close=bool(conn.closed))
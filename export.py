@@ -0,0 +1,89 @@
+import csv
+import io
+import itertools
+from typing import Iterable, Iterator, List, Sequence
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+CHUNK_ROWS = 2000
+
+
+def chunks(cursor, size: int = CHUNK_ROWS) -> Iterator[list]:
+    """fetchmany() until the cursor is exhausted"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def column_widths(header: Sequence[str], rows: Iterable[Sequence], cap: int = 40) -> List[int]:
+    widths = [len(str(h)) for h in header]
+    for row in rows:
+        for i, v in enumerate(row):
+            if v is not None:
+                widths[i] = max(widths[i], len(str(v)))
+    return [min(w + 2, cap) for w in widths]
+
+
+def write_xlsx(path: str, title: str, header: Sequence[str], row_chunks: Iterator[list]) -> int:
+    """
+    Write-only workbook: rows go straight to the file, so memory stays at
+    one chunk. Column widths are sized from the first chunk, since they
+    have to be set before the first row is written.
+    returns: number of data rows
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    first = next(row_chunks, [])
+    for idx, width in enumerate(column_widths(header, first), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+    ws.append(list(header))
+    count = 0
+    for chunk in itertools.chain([first], row_chunks):
+        for row in chunk:
+            ws.append(row)
+        count += len(chunk)
+    wb.save(path)
+    return count
+
+
+def csv_lines(header: Sequence[str], row_chunks: Iterator[list]) -> Iterator[str]:
+    """CSV text, one piece per chunk, for a streamed response"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for chunk in row_chunks:
+        writer.writerows(chunk)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def write_parquet(path: str, header: Sequence[str], row_chunks: Iterator[list]) -> int:
+    """
+    Parquet file with one row group per chunk; needs pyarrow, which is
+    optional (ImportError saying so otherwise). Layout is the report's: timestamp, device, gen1..gen3,
+    then float readings.
+    returns: number of data rows
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export needs pyarrow installed (pip install pyarrow)") from e
+
+    types = [pa.timestamp("us", tz="UTC"), pa.string()] + [pa.bool_()] * 3
+    types += [pa.float64()] * (len(header) - len(types))
+    schema = pa.schema(list(zip(header, types)))
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in row_chunks:
+            columns = [list(col) for col in zip(*chunk)]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=t) for col, t in zip(columns, types)], schema=schema
+            ))
+            count += len(chunk)
+    return count
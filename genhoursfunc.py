@@ -1,6 +1,25 @@
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Any
 
+def _to_bool(v) -> bool:
+    if isinstance(v, bool):
+        return v
+    s = str(v).strip().lower()
+    return s in ("1", "true", "on", "yes")
+
+def _parse_ts(v) -> datetime:
+    if isinstance(v, datetime):
+        dt = v
+    else:
+        # allow both "YYYY-MM-DD HH:MM:SS[.fff][+TZ]" or ISO
+        s = str(v).replace("T", " ")
+        dt = datetime.fromisoformat(s)
+    # make sure we have tz-aware to do safe arithmetic
+    if dt.tzinfo is None:
+        # assume local time as UTC if tz missing (safer for diffs)
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
 def calculate_generator_hours(rows: List[Dict[str, Any]]) -> Dict[str, str]:
     """
     rows: list of dicts with keys: 'timestamp', 'gen', 'state'
@@ -10,32 +29,13 @@ def calculate_generator_hours(rows: List[Dict[str, Any]]) -> Dict[str, str]:
     returns: {'Generator 1': 'H:MM', ...}
     """
 
-    def to_bool(v) -> bool:
-        if isinstance(v, bool):
-            return v
-        s = str(v).strip().lower()
-        return s in ("1", "true", "on", "yes")
-
-    def parse_ts(v) -> datetime:
-        if isinstance(v, datetime):
-            dt = v
-        else:
-            # allow both "YYYY-MM-DD HH:MM:SS[.fff][+TZ]" or ISO
-            s = str(v).replace("T", " ")
-            dt = datetime.fromisoformat(s)
-        # make sure we have tz-aware to do safe arithmetic
-        if dt.tzinfo is None:
-            # assume local time as UTC if tz missing (safer for diffs)
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt
-
     # group by generator
     gen_events: Dict[str, List[Dict[str, Any]]] = {}
     for r in rows:
         g = r["gen"]
         gen_events.setdefault(g, []).append({
-            "t": parse_ts(r["timestamp"]),
-            "on": to_bool(r["state"]),
+            "t": _parse_ts(r["timestamp"]),
+            "on": _to_bool(r["state"]),
         })
 
     # sort each generator’s events by time
@@ -86,3 +86,72 @@ def calculate_generator_hours(rows: List[Dict[str, Any]]) -> Dict[str, str]:
         results[f"Generator {gen_number}"] = f"{h}:{m:02d}"
 
     return results
+
+def _format_hours(gen: str, total: timedelta) -> tuple:
+    # ('Generator 1', 'H:MM'), the same shape calculate_generator_hours returns
+    secs = int(total.total_seconds())
+    gen_number = gen.replace("gen", "").strip() or gen
+    return f"Generator {gen_number}", f"{secs // 3600}:{(secs % 3600) // 60:02d}"
+
+class GeneratorHoursAccumulator:
+    """
+    Running generator hours, updated in O(1) per gens event instead of
+    re-reading and re-sorting the whole history.
+
+    Same rules as calculate_generator_hours: an ON starts a run unless one
+    is already open, an OFF closes the open run, an OFF without a run is
+    ignored, and an open run counts until now. Each generator's events
+    must be applied in time order; one older than the last applied event
+    of the same generator is ignored. Different generators' events may
+    arrive in any order, their inputs are debounced separately.
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, timedelta] = {}
+        self.on_since: Dict[str, datetime | None] = {}
+        self.last_event: Dict[str, datetime] = {}
+
+    def apply(self, gen: str, state, ts) -> None:
+        t = _parse_ts(ts)
+        last = self.last_event.get(gen)
+        if last is not None and t < last:
+            return
+        self.last_event[gen] = t
+        self.totals.setdefault(gen, timedelta(0))
+        start = self.on_since.get(gen)
+
+        if _to_bool(state):
+            if start is None:
+                self.on_since[gen] = t
+        elif start is not None:
+            if t > start:
+                self.totals[gen] += t - start
+            self.on_since[gen] = None
+
+    def rebuild(self, rows: List[Dict[str, Any]]) -> None:
+        """rows: full gens history, same shape as calculate_generator_hours"""
+        self.__init__()
+        events = sorted(
+            ((_parse_ts(r["timestamp"]), r["gen"], r["state"]) for r in rows),
+            key=lambda e: e[0],
+        )
+        for t, gen, state in events:
+            self.apply(gen, state, t)
+
+    def seconds(self, now: datetime | None = None) -> Dict[str, float]:
+        """total seconds per gen, open runs counted until `now`"""
+        now = now or datetime.now(timezone.utc)
+        out = {}
+        for gen, total in self.totals.items():
+            start = self.on_since.get(gen)
+            if start is not None and now > start:
+                total = total + (now - start)
+            out[gen] = total.total_seconds()
+        return out
+
+    def hours(self, now: datetime | None = None) -> Dict[str, str]:
+        """returns: {'Generator 1': 'H:MM', ...}"""
+        return dict(
+            _format_hours(gen, timedelta(seconds=secs))
+            for gen, secs in sorted(self.seconds(now).items())
+        )
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from genhoursfunc import GeneratorHoursAccumulator
+from gpiocapture import EdgeCapture
+from db import DB_SECONDS, STORE_ERRORS
+
+log = logging.getLogger(__name__)
+
+# generator inputs are pulled up: the pin reads 1 while the generator is off
+OFF_LEVEL = 1
+
+# the generator events, one row per stored transition; the table predates
+# the schemas kept here, this is its shape for a fresh database
+GENS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gens (
+    id serial PRIMARY KEY,
+    status text,
+    timestamp timestamptz,
+    gen text,
+    state boolean
+);
+"""
+
+# one row per generator run, maintained together with every gens insert;
+# "end" is NULL while the run is still open
+GENRUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gen_runs (
+    id bigserial PRIMARY KEY,
+    gen text NOT NULL,
+    start timestamptz NOT NULL,
+    "end" timestamptz
+);
+CREATE INDEX IF NOT EXISTS gen_runs_period_idx ON gen_runs USING gist (tstzrange(start, "end"));
+CREATE UNIQUE INDEX IF NOT EXISTS gen_runs_open_idx ON gen_runs (gen) WHERE "end" IS NULL;
+"""
+
+# gens event and the matching gen_runs change in one atomic statement; an
+# OFF stamped before its run's start (a clock step, an event replayed late)
+# closes the run empty instead of making an invalid range
+RECORD_TRANSITION = """
+WITH event AS (
+    INSERT INTO gens (status, timestamp, gen, state) VALUES ($1, $2, $3, $4)
+), closed AS (
+    UPDATE gen_runs SET "end" = greatest($2, start)
+    WHERE gen = $3 AND "end" IS NULL AND NOT $4
+)
+INSERT INTO gen_runs (gen, start)
+SELECT $3, $2
+WHERE $4 AND NOT EXISTS (SELECT 1 FROM gen_runs WHERE gen = $3 AND "end" IS NULL)
+"""
+
+
+async def rebuild_gen_runs(conn) -> int:
+    """
+    Backfill gen_runs from the gens history, same rules as the hours
+    accumulator: ON opens a run unless one is open, OFF closes it.
+    returns: number of runs written
+    """
+    events = await conn.fetch("select timestamp, gen, state from gens order by timestamp")
+    runs = []
+    open_runs: Dict[str, datetime] = {}
+    for e in events:
+        gen, ts = e["gen"], e["timestamp"]
+        if e["state"]:
+            open_runs.setdefault(gen, ts)
+        elif gen in open_runs:
+            runs.append((gen, open_runs.pop(gen), ts))
+    runs.extend((gen, start, None) for gen, start in open_runs.items())
+    if runs:
+        await conn.copy_records_to_table("gen_runs", records=runs, columns=["gen", "start", "end"])
+    return len(runs)
+
+
+class GenStateCache:
+    """
+    Last known state of every generator, loaded from `gens` once and
+    then kept in memory; the table is only touched on a real transition.
+
+    Transitions are queued in `pending` and stored in order by flush(),
+    so one that can't be written while the database is away is kept and
+    written once it is back, before any later one.
+    """
+
+    def __init__(self, states: Optional[Dict[str, bool]] = None):
+        # as stored in `gens`
+        self.states: Dict[str, bool] = dict(states or {})
+        self.pending: Deque[Tuple[str, bool, datetime]] = deque()
+        # called with (gen, on, ts) after every stored transition
+        self.listeners: List[Callable[[str, bool, datetime], None]] = []
+
+    @classmethod
+    async def load(cls, conn) -> "GenStateCache":
+        await conn.execute(GENRUNS_SCHEMA)
+        if not await conn.fetchval("select exists (select 1 from gen_runs)"):
+            await rebuild_gen_runs(conn)
+        rows = await conn.fetch("""
+            SELECT DISTINCT ON (gen) gen, state
+            FROM gens
+            ORDER BY gen, timestamp DESC
+        """)
+        return cls({r["gen"]: r["state"] for r in rows})
+
+    def state(self, gen: str) -> Optional[bool]:
+        """the latest state of `gen`, stored or still pending"""
+        for g, on, _ in reversed(self.pending):
+            if g == gen:
+                return on
+        return self.states.get(gen)
+
+    def add(self, gen: str, on: bool, ts: datetime) -> bool:
+        """
+        Queue a transition unless `on` is already the latest state of `gen`.
+        returns: True if it was queued
+        """
+        if self.state(gen) == on:
+            return False
+        self.pending.append((gen, on, ts))
+        return True
+
+    async def flush(self, conn) -> int:
+        """
+        Insert the pending transitions as `gens` rows, opening and closing
+        their gen_runs intervals. On an error the unwritten ones stay
+        pending and it is raised.
+        returns: number of rows written
+        """
+        written = 0
+        while self.pending:
+            gen, on, ts = self.pending[0]
+            number = gen.replace("gen", "")
+            await conn.execute(RECORD_TRANSITION, f"gen {number} {'on' if on else 'off'}", ts, gen, on)
+            # only after the insert succeeded, so `states` never runs ahead of the table
+            self.pending.popleft()
+            self.states[gen] = on
+            written += 1
+            for listener in self.listeners:
+                listener(gen, on, ts)
+        return written
+
+    async def record(self, conn, gen: str, on: bool, ts: datetime) -> bool:
+        """
+        add() and flush() in one: raises if the transition can't be stored,
+        which then stays pending.
+        returns: True if it was a transition
+        """
+        queued = self.add(gen, on, ts)
+        await self.flush(conn)
+        return queued
+
+
+GENHOURS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gen_hours_summary (
+    gen text PRIMARY KEY,
+    total_seconds double precision NOT NULL,
+    on_since timestamptz,
+    last_event timestamptz,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS gens_timestamp_idx ON gens (timestamp);
+"""
+
+
+async def load_generator_hours(conn) -> GeneratorHoursAccumulator:
+    """
+    Restore the accumulator from its last checkpoint and replay the gens
+    events stored after it; without a checkpoint rebuild it from the
+    whole table once.
+    """
+    await conn.execute(GENHOURS_SCHEMA)
+    acc = GeneratorHoursAccumulator()
+    rows = await conn.fetch("select * from gen_hours_summary")
+    if rows:
+        for r in rows:
+            acc.totals[r["gen"]] = timedelta(seconds=r["total_seconds"])
+            acc.on_since[r["gen"]] = r["on_since"]
+            if r["last_event"] is not None:
+                acc.last_event[r["gen"]] = r["last_event"]
+        # from the generator checkpointed furthest back; apply() skips what each one has seen
+        events = await conn.fetch(
+            "select timestamp, gen, state from gens where timestamp >= $1 order by timestamp",
+            min(acc.last_event.values(), default=datetime.min.replace(tzinfo=timezone.utc)),
+        )
+        for e in events:
+            acc.apply(e["gen"], e["state"], e["timestamp"])
+    else:
+        events = await conn.fetch("select timestamp, gen, state from gens")
+        acc.rebuild([dict(e) for e in events])
+        await checkpoint_generator_hours(conn, acc)
+    return acc
+
+
+async def checkpoint_generator_hours(conn, acc: GeneratorHoursAccumulator) -> None:
+    # closed-run totals only; the open run is kept as on_since and resumed on load
+    await conn.executemany("""
+        INSERT INTO gen_hours_summary (gen, total_seconds, on_since, last_event, updated_at)
+        VALUES ($1, $2, $3, $4, now())
+        ON CONFLICT (gen) DO UPDATE SET
+            total_seconds = excluded.total_seconds,
+            on_since = excluded.on_since,
+            last_event = excluded.last_event,
+            updated_at = now()
+    """, [
+        (gen, total.total_seconds(), acc.on_since.get(gen), acc.last_event.get(gen))
+        for gen, total in acc.totals.items()
+    ])
+
+
+async def watch_generators(
+    conn,
+    capture: EdgeCapture,
+    gen_pins: Dict[str, Optional[int]],
+    gen_values: dict,
+    cache: Optional[GenStateCache] = None,
+    backoff: float = 1.0,
+    backoff_max: float = 60.0,
+) -> None:
+    """
+    gen_pins: {'gen1': 17, ...}; None for a generator with no input wired,
+      which is held at level 0 (on)
+    gen_values: updated in place with the raw level of each generator,
+      the way it is sent in the live payload
+    cache: last stored states, loaded from `gens` if not given
+    backoff / backoff_max: while the database can't be written, the
+      transitions stay queued and are tried again after `backoff`
+      seconds, doubling up to `backoff_max`
+
+    The edges are timestamped and queued as they come; storing them is a
+    task of its own, so a database outage only delays the rows.
+    """
+    if cache is None:
+        cache = await GenStateCache.load(conn)
+    await capture.start()
+    pin_gens = {pin: gen for gen, pin in gen_pins.items() if pin is not None}
+    wake = asyncio.Event()
+
+    async def store():
+        delay = backoff
+        while True:
+            await wake.wait()
+            wake.clear()
+            while cache.pending:
+                try:
+                    with DB_SECONDS.labels("gens").time():
+                        await cache.flush(conn)
+                    delay = backoff
+                except STORE_ERRORS as e:
+                    log.warning("%d generator transitions not stored, trying again in %ss: %r", len(cache.pending), delay, e)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, backoff_max)
+
+    def observe(gen: str, level: int, ts: datetime) -> None:
+        gen_values[gen] = level
+        if cache.add(gen, level != OFF_LEVEL, ts):
+            log.info("%s %s at %s", gen, "on" if level != OFF_LEVEL else "off", ts)
+            wake.set()
+
+    async def watch():
+        # catch up with whatever changed while the poller was not running
+        now = datetime.now(capture.tz)
+        for gen, pin in gen_pins.items():
+            observe(gen, capture.level(pin) if pin is not None else 0, now)
+        async for event in capture.events():
+            observe(pin_gens[event.pin], event.level, event.timestamp)
+
+    await asyncio.gather(store(), watch())
@@ -0,0 +1,137 @@
+import asyncio
+import os
+from datetime import datetime, timezone, tzinfo
+from typing import AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+EdgeCallback = Callable[[int], None]
+
+
+class PinEvent(NamedTuple):
+    pin: int
+    level: int              # settled level after the transition
+    timestamp: datetime     # time of the first edge of the transition
+
+
+class RPiGpioBackend:
+    """RPi.GPIO inputs with pull-ups; edge callbacks run on RPi.GPIO's thread."""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup(self, pin: int) -> None:
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+
+    def read(self, pin: int) -> int:
+        return self.GPIO.input(pin)
+
+    def watch(self, pin: int, callback: EdgeCallback) -> None:
+        # no bouncetime: it drops the edges that tell us where the level settled
+        self.GPIO.add_event_detect(pin, self.GPIO.BOTH, callback=callback)
+
+    def close(self) -> None:
+        self.GPIO.cleanup()
+
+
+class FakePinSource:
+    """
+    In-memory pins for running off-Pi.
+    set() may be called from any thread, like a real interrupt.
+    """
+
+    def __init__(self, levels: Optional[Dict[int, int]] = None):
+        self.levels: Dict[int, int] = dict(levels or {})
+        self.callbacks: Dict[int, List[EdgeCallback]] = {}
+
+    def setup(self, pin: int) -> None:
+        # pull-up: an unconnected input reads 1
+        self.levels.setdefault(pin, 1)
+
+    def read(self, pin: int) -> int:
+        return self.levels[pin]
+
+    def watch(self, pin: int, callback: EdgeCallback) -> None:
+        self.callbacks.setdefault(pin, []).append(callback)
+
+    def set(self, pin: int, level: int) -> None:
+        if self.levels.get(pin) == level:
+            return
+        self.levels[pin] = level
+        for callback in self.callbacks.get(pin, []):
+            callback(pin)
+
+    def close(self) -> None:
+        self.callbacks.clear()
+
+
+def gpio_backend(name: Optional[str] = None):
+    """GPIO_BACKEND: "rpi" (default) or "fake" for running without a Pi."""
+    name = (name or os.getenv("GPIO_BACKEND") or "rpi").lower()
+    if name == "rpi":
+        return RPiGpioBackend()
+    if name == "fake":
+        return FakePinSource()
+    raise ValueError(f"Unknown GPIO backend {name!r}")
+
+
+class EdgeCapture:
+    """
+    Edge-triggered pin capture bridged into asyncio.
+
+    Every edge is timestamped in the interrupt callback. A transition is
+    reported once the pin has been quiet for `debounce` seconds and its
+    level differs from the last reported one; the event carries the
+    timestamp of the first edge of the burst, not of the settle time.
+    """
+
+    def __init__(self, backend, pins: Iterable[int], debounce: float = 0.05, tz: tzinfo = timezone.utc):
+        self.backend = backend
+        self.pins = list(pins)
+        self.debounce = debounce
+        self.tz = tz
+        self._stable: Dict[int, int] = {}
+        self._first_edge: Dict[int, datetime] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._queue: "asyncio.Queue[PinEvent]" = asyncio.Queue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        for pin in self.pins:
+            self.backend.setup(pin)
+            self._stable[pin] = self.backend.read(pin)
+            self.backend.watch(pin, self._on_edge)
+
+    def level(self, pin: int) -> int:
+        return self._stable[pin]
+
+    def _on_edge(self, pin: int) -> None:
+        # GPIO thread: take the timestamp now, do everything else on the loop
+        ts = datetime.now(self.tz)
+        self._loop.call_soon_threadsafe(self._edge, pin, ts)
+
+    def _edge(self, pin: int, ts: datetime) -> None:
+        self._first_edge.setdefault(pin, ts)
+        timer = self._timers.get(pin)
+        if timer is not None:
+            timer.cancel()
+        self._timers[pin] = self._loop.call_later(self.debounce, self._settle, pin)
+
+    def _settle(self, pin: int) -> None:
+        self._timers.pop(pin, None)
+        ts = self._first_edge.pop(pin)
+        level = self.backend.read(pin)
+        if level != self._stable[pin]:
+            self._stable[pin] = level
+            self._queue.put_nowait(PinEvent(pin, level, ts))
+
+    async def events(self) -> AsyncIterator[PinEvent]:
+        while True:
+            yield await self._queue.get()
+
+    def close(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self.backend.close()
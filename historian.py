@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+import asyncpg
+
+from readplanner import Signal
+from readings import SampleWriter
+from rollups import RollupAccumulator, rebuild_rollups
+from spool import Spool
+from db import DB_SECONDS
+from metrics import Counter
+
+log = logging.getLogger(__name__)
+
+ROWS = Counter("scada_historian_rows_total", "tpmsample rows written, or dropped because they couldn't be", ("outcome",))
+
+
+class Historian:
+    """
+    Buffers polled samples and writes them to tpmsample in bulk with COPY
+    from a background task, so the poll loop never waits on a per-sample
+    INSERT.
+
+    resolution: keep at most one sample per device every `resolution`
+      seconds (0 keeps every sample)
+    batch_size / flush_interval: flush when this many rows are buffered,
+      or this many seconds after the last flush, whichever comes first
+    max_buffer: rows kept in memory while the database is unreachable;
+      the oldest are dropped beyond that
+    rollups: fed with every sample, before resolution thinning, and
+      merged into the rollup tables on each flush
+    spool: buffer rows on disk instead of in memory; they are drained
+      `batch_size` at a time and survive a restart of the poller. Each row
+      is spooled with its writer's layout, rows of another register map are
+      dropped, and the rollup buckets of rows left from before the restart
+      are rebuilt once they are stored
+    """
+
+    def __init__(
+        self,
+        conn,
+        writer: SampleWriter,
+        resolution: float = 0.0,
+        batch_size: int = 500,
+        flush_interval: float = 5.0,
+        max_buffer: int = 100_000,
+        rollups: Optional[RollupAccumulator] = None,
+        spool: Optional[Spool] = None,
+    ):
+        self.conn = conn
+        self.writer = writer
+        self.resolution = resolution
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.rollups = rollups
+        self.spool = spool
+        self._rows: List[tuple] = []
+        self._pending = 0
+        self._last_kept: Dict[str, datetime] = {}
+        self._full = asyncio.Event()
+        # one flush at a time, and none while the register map is switched
+        self._lock = asyncio.Lock()
+        # samples arriving while set_signals stores the old rows
+        self._held: Optional[List[tuple]] = None
+        self.written = 0
+        self.dropped = 0
+        # spooled rows older than this were left by a previous run; their
+        # samples never reached the rollups, which are rebuilt for them
+        self._replay_before = datetime.now(timezone.utc) if spool is not None and rollups is not None else None
+        self._replayed_since: Optional[datetime] = None
+
+    def add(self, device: str, ts: datetime, values: Dict[str, object]) -> bool:
+        """returns: False if the sample was thinned out by the resolution"""
+        if self._held is not None:
+            self._held.append((device, ts, values))
+            return True
+        if self.rollups is not None:
+            self.rollups.add(device, ts, values)
+        last = self._last_kept.get(device)
+        if last is not None and (ts - last).total_seconds() < self.resolution:
+            return False
+        self._last_kept[device] = ts
+        row = self.writer.row(device, ts, values)
+        if self.spool is not None:
+            self.spool.append((self.writer.layout, row))
+        else:
+            self._rows.append(row)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._full.set()
+        return True
+
+    async def flush(self) -> int:
+        async with self._lock:
+            written = await self._flush_rows()
+            if self.rollups is not None:
+                with DB_SECONDS.labels("rollups").time():
+                    await self.rollups.flush(self.conn)
+        return written
+
+    async def _flush_rows(self) -> int:
+        self._full.clear()
+        self._pending = 0
+        if self.spool is not None:
+            return await self._drain()
+        return await self._flush_memory()
+
+    async def set_signals(self, signals: Sequence[Signal]) -> None:
+        """
+        Switch to another register map; tpmsample needs its columns already
+        (readings.ensure_sample_table). The rows buffered so far are laid
+        out for the old map, so they are stored first and samples arriving
+        meanwhile are held back. If they can't be stored the old map stays
+        and the error is raised.
+        """
+        async with self._lock:
+            self._held = []
+            try:
+                await self._flush_rows()
+                self.writer = SampleWriter(signals)
+                if self.rollups is not None:
+                    self.rollups.set_signals(signals)
+            finally:
+                held, self._held = self._held, None
+                for sample in held:
+                    self.add(*sample)
+
+    async def _flush_memory(self) -> int:
+        rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        try:
+            await self._copy(rows)
+        except Exception:
+            # COPY is all-or-nothing: put the batch back in front and retry next time
+            self._rows = rows + self._rows
+            overflow = len(self._rows) - self.max_buffer
+            if overflow > 0:
+                del self._rows[:overflow]
+                self.dropped += overflow
+                ROWS.labels("dropped").inc(overflow)
+            raise
+        return len(rows)
+
+    async def _drain(self) -> int:
+        # one batch in flight at a time; the position only moves once it is stored
+        written = 0
+        while True:
+            records, position = self.spool.read(self.batch_size)
+            rows = self._current(records)
+            if rows:
+                await self._copy(rows)
+            self.spool.commit(position)
+            written += len(rows)
+            if len(records) < self.batch_size:
+                await self._rebuild_replayed()
+                return written
+
+    def _current(self, records: List[tuple]) -> List[tuple]:
+        # rows spooled under another map (a change while the poller was down)
+        # would land in the wrong columns, or fail the whole batch forever
+        rows = [row for layout, row in records if layout == self.writer.layout]
+        if len(rows) < len(records):
+            log.warning("Historian dropped %d spooled rows of another register map", len(records) - len(rows))
+            self.dropped += len(records) - len(rows)
+            ROWS.labels("dropped").inc(len(records) - len(rows))
+        if self._replay_before is not None:
+            # rows are (device, ts, ...), see SampleWriter.row
+            replayed = [row[1] for row in rows if row[1] < self._replay_before]
+            if replayed and (self._replayed_since is None or min(replayed) < self._replayed_since):
+                self._replayed_since = min(replayed)
+        return rows
+
+    async def _rebuild_replayed(self) -> None:
+        # runs once the spool is drained, before the first rollups flush of this run
+        if self._replay_before is None:
+            return
+        if self._replayed_since is not None:
+            with DB_SECONDS.labels("rollups").time():
+                await rebuild_rollups(self.conn, self.writer.signals, str(self.rollups.tz),
+                                      self._replayed_since, self._replay_before)
+            log.info("Rebuilt rollups from %s for rows replayed from the spool", self._replayed_since)
+        self._replay_before = self._replayed_since = None
+
+    async def _copy(self, rows: List[tuple]) -> None:
+        start = time.perf_counter()
+        try:
+            await self.conn.copy_records_to_table("tpmsample", records=rows, columns=self.writer.columns)
+            DB_SECONDS.labels("copy").observe(time.perf_counter() - start)
+        except asyncpg.UniqueViolationError:
+            # a batch replayed from the spool after a crash may be partly stored already
+            start = time.perf_counter()
+            await self.conn.executemany(self.writer.insert, rows)
+            DB_SECONDS.labels("insert").observe(time.perf_counter() - start)
+        self.written += len(rows)
+        ROWS.labels("written").inc(len(rows))
+
+    async def run(self) -> None:
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await self.flush()
+                except Exception as e:
+                    log.warning("Historian flush failed, rows kept for the next try: %r", e)
+        finally:
+            await self.flush()
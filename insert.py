@@ -1,27 +1,35 @@
+import argparse
 import asyncio
 import asyncpg
 from tpmrows import tpm_registers
 from dotenv import load_dotenv
-import os
+from db import remote_pool
 
 load_dotenv()
 
-async def makeConnection():
-    connection: asyncpg.Connection = await asyncpg.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        database=os.getenv("DB_NAME"),
-        password=os.getenv("DB_PASSWORD"),
-        user=os.getenv("DB_USER")
-    )
-    return connection
-
-async def main():
-    connection: asyncpg.Connection = await makeConnection()
-    params = [(True, r[1], r[2], r[3], r[4], str(r[5]), r[6]) for r in tpm_registers]
-    query ="insert into tpm (enabled, address, parameter, datatype, readwrite, multiplier, unit)" \
-    "values ($1,$2,$3,$4,$5,$6,$7) "\
-    "on conflict (address) do nothing "
+async def insertSignals(connection: asyncpg.Connection, reset: bool = False):
+    # fast / normal / slow, see readplanner.POLL_CLASSES
+    await connection.execute("alter table tpm add column if not exists pollclass text not null default 'normal'")
+    # smallest change pushed to live clients, see livefeed.LiveFeed
+    await connection.execute("alter table tpm add column if not exists deadband double precision not null default 0")
+    params = [(True, r[1], r[2], r[3], r[4], str(r[5]), r[6], r[7], r[8]) for r in tpm_registers]
+    # existing rows get the map's pollclass / deadband only while they still hold
+    # the column defaults, so values tuned on site survive; --reset overwrites them
+    conflict = "do update set pollclass = excluded.pollclass, deadband = excluded.deadband"
+    if not reset:
+        conflict += " where tpm.pollclass = 'normal' and tpm.deadband = 0"
+    query ="insert into tpm (enabled, address, parameter, datatype, readwrite, multiplier, unit, pollclass, deadband)" \
+    "values ($1,$2,$3,$4,$5,$6,$7,$8,$9) "\
+    f"on conflict (address) {conflict} "
     async with connection.transaction():
         await connection.executemany(query,params)
-asyncio.run(main())
\ No newline at end of file
+
+async def main(reset: bool):
+    pool: asyncpg.Pool = await remote_pool()
+    async with pool.acquire() as connection:
+        await insertSignals(connection, reset)
+    await pool.close()
+
+parser = argparse.ArgumentParser(description="Load the register map into the tpm table")
+parser.add_argument("--reset", action="store_true", help="overwrite tuned pollclass and deadband of existing rows")
+asyncio.run(main(parser.parse_args().reset))
\ No newline at end of file
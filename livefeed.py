@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Sequence
+
+from readplanner import Signal
+from readings import GENS
+from metrics import Counter, Histogram
+
+log = logging.getLogger(__name__)
+
+PUBLISH_SECONDS = Histogram("scada_live_publish_seconds", "Turning one sample into a live delta and queueing it")
+FRAMES = Counter("scada_live_frames_total", "Frames sent to the live hub", ("event",))
+RESYNCS = Counter("scada_live_resyncs_total", "Live snapshots sent instead of queued deltas", ("reason",))
+
+# generator running hours, as the 'genhours' dict of a live payload
+GEN_HOURS = ("Generator 1", "Generator 2", "Generator 3")
+
+
+class Channel(NamedTuple):
+    name: str
+    unit: str
+    kind: str           # "signal", "gen" (input level), "genhours" or "quality"
+    deadband: float = 0.0
+
+
+def channels(signals: Sequence[Signal]) -> List[Channel]:
+    """channel ids are list positions: the register-map signals by address, the generators, the sample quality"""
+    out = [Channel(s.name, s.unit, "signal", s.deadband) for s in sorted(signals, key=lambda s: s.address)]
+    out += [Channel(g, "", "gen") for g in GENS]
+    out += [Channel(g, "h", "genhours") for g in GEN_HOURS]
+    out.append(Channel("quality", "", "quality"))
+    return out
+
+
+def schema_id(chans: Sequence[Channel]) -> str:
+    """short id of the channel list; frames of another schema can't be applied"""
+    return format(zlib.crc32("\x1f".join(f"{c.name}\x1e{c.unit}" for c in chans).encode()), "08x")
+
+
+def _moved(old, new, deadband: float) -> bool:
+    if old is None or new is None:
+        return old is not new
+    if deadband > 0 and isinstance(old, (int, float)) and isinstance(new, (int, float)):
+        # readings are rounded decimals: 230.2 - 230.0 must count as 0.2
+        return abs(new - old) >= deadband - 1e-9
+    return new != old
+
+
+class LiveFeed:
+    """
+    Encodes the poller's live payloads for the dashboard.
+
+    A client first gets a snapshot, then only deltas: the channels that
+    moved past their deadband since the value it was last sent. Values go
+    by channel id instead of by name, so a frame is a few numbers:
+
+        snapshot: {"schema": id, "channels": [[name, unit, kind], ...],
+                   "devices": {device: [seq, [value per channel]]}}
+        delta:    [schema, device, seq, [channel ids], [values]]
+
+    seq counts the deltas of a device; a receiver that sees a gap asks
+    for a new snapshot. Comparing with the value sent, not the previous
+    reading, means slow drift still gets through once it adds up.
+    """
+
+    def __init__(self, signals: Sequence[Signal] = ()):
+        self.set_signals(signals)
+
+    def set_signals(self, signals: Sequence[Signal]) -> None:
+        """new register map: new schema, every device starts over from a snapshot"""
+        self.channels = channels(signals)
+        self.schema = schema_id(self.channels)
+        self._sent: Dict[str, list] = {}
+        self._seq: Dict[str, int] = {}
+
+    def _flatten(self, payload: dict) -> list:
+        hours = payload.get("genhours") or {}
+        return [hours.get(c.name) if c.kind == "genhours" else payload.get(c.name) for c in self.channels]
+
+    def update(self, payload: dict) -> Optional[list]:
+        """
+        payload: {"device": name, "genhours": {...}, gen1.., signal name: value}
+        returns: delta frame, None when nothing moved past its deadband
+        """
+        device = payload.get("device") or "tpm"
+        sent = self._sent.setdefault(device, [None] * len(self.channels))
+        ids = []
+        for i, (c, old, new) in enumerate(zip(self.channels, sent, self._flatten(payload))):
+            if _moved(old, new, c.deadband):
+                sent[i] = new
+                ids.append(i)
+        if not ids:
+            return None
+        seq = self._seq[device] = self._seq.get(device, 0) + 1
+        return [self.schema, device, seq, ids, [sent[i] for i in ids]]
+
+    def snapshot(self) -> dict:
+        return {
+            "schema": self.schema,
+            "channels": [[c.name, c.unit, c.kind] for c in self.channels],
+            "devices": {d: [self._seq.get(d, 0), list(v)] for d, v in self._sent.items()},
+        }
+
+
+class LiveState:
+    """
+    The web app's copy of what live clients should be showing, kept from
+    the pollers' snapshots and deltas so a new client can start from a
+    snapshot. Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.schema: Optional[str] = None
+        self.channels: list = []
+        self.devices: Dict[str, list] = {}
+
+    def load(self, snapshot: dict) -> None:
+        with self._lock:
+            if snapshot["schema"] != self.schema:
+                self.devices = {}
+            self.schema = snapshot["schema"]
+            self.channels = snapshot["channels"]
+            for device, (seq, values) in snapshot["devices"].items():
+                self.devices[device] = [seq, list(values)]
+
+    def apply(self, frame: list) -> bool:
+        """returns: False if the frame doesn't follow on, the sender has to resend a snapshot"""
+        schema, device, seq, ids, values = frame
+        with self._lock:
+            if schema != self.schema:
+                return False
+            state = self.devices.get(device)
+            if state is None:
+                if seq != 1:
+                    return False
+                state = self.devices[device] = [0, [None] * len(self.channels)]
+            elif seq != state[0] + 1:
+                return False
+            state[0] = seq
+            for i, v in zip(ids, values):
+                state[1][i] = v
+            return True
+
+    def snapshot(self) -> Optional[dict]:
+        with self._lock:
+            if self.schema is None:
+                return None
+            return {
+                "schema": self.schema,
+                "channels": self.channels,
+                "devices": {d: [seq, list(v)] for d, (seq, v) in self.devices.items()},
+            }
+
+
+def message(event: str, data=None) -> bytes:
+    """one line of the live protocol, the same on the hub's socket and its websockets"""
+    return (json.dumps([event, data], separators=(",", ":")) + "\n").encode()
+
+
+class LivePublisher:
+    """
+    Sends a LiveFeed's frames to the live hub over its Unix socket.
+
+    publish() never waits: frames queue up to `depth` and go out on the
+    run() task. Past that, or after a reconnect, or when the hub asks for
+    it, the queue is dropped and one snapshot goes out instead.
+    """
+
+    def __init__(self, feed: LiveFeed, path: str, depth: int = 256, retry: float = 2.0):
+        self.feed = feed
+        self.path = path
+        self.depth = depth
+        self.retry = retry
+        self.connected = False
+        self._frames: Deque[list] = deque()
+        self._stale = True
+        self._wake = asyncio.Event()
+        self._publish_seconds = PUBLISH_SECONDS.labels()
+
+    def publish(self, payload: dict) -> None:
+        start = time.perf_counter()
+        frame = self.feed.update(payload)
+        if frame is None or not self.connected:
+            # nothing to send, or the snapshot on (re)connect carries it
+            pass
+        elif len(self._frames) >= self.depth:
+            RESYNCS.labels("overflow").inc()
+            self.resync()
+        else:
+            self._frames.append(frame)
+            self._wake.set()
+        self._publish_seconds.observe(time.perf_counter() - start)
+
+    def resync(self) -> None:
+        self._frames.clear()
+        self._stale = True
+        self._wake.set()
+
+    async def _send(self, writer: asyncio.StreamWriter) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            if self._stale:
+                # taken together with the clear, so no queued frame repeats the snapshot
+                self._stale = False
+                self._frames.clear()
+                writer.write(message("live-snapshot", self.feed.snapshot()))
+                FRAMES.labels("snapshot").inc()
+            deltas = FRAMES.labels("delta")
+            while self._frames:
+                writer.write(message("live-delta", self._frames.popleft()))
+                deltas.inc()
+            await writer.drain()
+
+    async def _listen(self, reader: asyncio.StreamReader) -> None:
+        while line := await reader.readline():
+            if json.loads(line)[0] == "live-resync":
+                RESYNCS.labels("hub").inc()
+                self.resync()
+
+    async def run(self) -> None:
+        tries = 0
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                # said once, not every `retry` seconds while the hub is down
+                log.log(logging.WARNING if tries == 0 else logging.DEBUG, "Live hub not reachable at %s: %s", self.path, e)
+                tries += 1
+                await asyncio.sleep(self.retry)
+                continue
+            tries = 0
+            log.info("Connected to live hub")
+            self.connected = True
+            self.resync()
+            tasks = [asyncio.ensure_future(self._send(writer)), asyncio.ensure_future(self._listen(reader))]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception():
+                        log.warning("Live hub connection lost: %r", t.exception())
+            finally:
+                self.connected = False
+                for t in tasks:
+                    t.cancel()
+                writer.close()
+            await asyncio.sleep(self.retry)
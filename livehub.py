@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import json
+import os
+import time
+from typing import Callable, Dict, Set, Tuple
+
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+
+from livefeed import LiveState, message
+from metrics import REGISTRY, Counter, Gauge, Histogram, metrics_page
+from ringbuffer import LiveHistory
+
+load_dotenv()
+
+CLIENTS = Gauge("scada_live_clients", "Dashboards connected to /live")
+DROPPED = Counter("scada_live_dropped_frames_total", "Frames a slow dashboard lost, replaced by a snapshot")
+PUBLISH_SECONDS = Histogram("scada_live_hub_publish_seconds", "Applying one poller frame and queueing it for every dashboard", ("event",))
+
+
+class LiveClient:
+    """
+    One dashboard websocket and its send queue. A client that falls
+    `depth` frames behind loses them and gets a snapshot instead, so a
+    slow link never holds up the others or grows the hub's memory.
+    """
+
+    def __init__(self, ws: web.WebSocketResponse, depth: int):
+        self.ws = ws
+        self.queue: asyncio.Queue = asyncio.Queue(depth)
+        self.dropped = 0
+
+    def offer(self, line: str, snapshot: Callable[[], str]) -> None:
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += dropped
+            DROPPED.labels().inc(dropped)
+            self.queue.put_nowait(snapshot())
+
+    async def send(self) -> None:
+        while True:
+            await self.ws.send_str(await self.queue.get())
+
+
+class LiveHub:
+    """
+    Fans the pollers' live frames out to the dashboards.
+
+    Pollers connect to the Unix socket and write livefeed messages, one
+    JSON line each; dashboards connect to /live. A delta is parsed once to
+    keep the hub's LiveState, then the same text goes to every client, so
+    nothing is re-encoded per client. A delta that doesn't follow on is
+    answered with "live-resync" and the poller sends a snapshot.
+
+    The frames are also kept in a LiveHistory, so a dashboard that opens
+    can fill its trends from /history instead of starting empty.
+    """
+
+    def __init__(self, depth: int = 64, history: LiveHistory = None):
+        self.depth = depth
+        self.state = LiveState()
+        self.clients: Set[LiveClient] = set()
+        self.history = history or LiveHistory()
+        # encoded /history answers by query, reused for a second
+        self._windows: Dict[Tuple, Tuple[float, bytes]] = {}
+        clients = CLIENTS.labels()
+        REGISTRY.collectors.append(lambda: clients.set(len(self.clients)))
+        self._publish_seconds = {e: PUBLISH_SECONDS.labels(e) for e in ("live-snapshot", "live-delta")}
+
+    def _snapshot(self) -> str:
+        return message("live-snapshot", self.state.snapshot()).decode()
+
+    def broadcast(self, line: str) -> None:
+        for client in self.clients:
+            client.offer(line, self._snapshot)
+
+    def publish(self, line: str) -> bool:
+        """returns: False if the poller has to resend a snapshot"""
+        start = time.perf_counter()
+        event, data = json.loads(line)
+        now = time.time()
+        if event == "live-snapshot":
+            if data["schema"] != self.state.schema:
+                self.history.reset(len(data["channels"]))
+            self.state.load(data)
+            for device, (_, values) in data["devices"].items():
+                self.history.record(device, now, range(len(values)), values)
+            self.broadcast(self._snapshot())
+        elif event == "live-delta":
+            if not self.state.apply(data):
+                return False
+            _, device, _, ids, values = data
+            self.history.record(device, now, ids, values)
+            self.broadcast(line)
+        timer = self._publish_seconds.get(event)
+        if timer is not None:
+            timer.observe(time.perf_counter() - start)
+        return True
+
+    async def poller(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        print("Poller connected")
+        try:
+            while line := await reader.readline():
+                if not self.publish(line.decode()):
+                    writer.write(message("live-resync"))
+        except (ConnectionError, ValueError) as e:
+            print(f"Poller connection dropped: {e!r}")
+        finally:
+            writer.close()
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        client = LiveClient(ws, self.depth)
+        if self.state.schema is not None:
+            client.offer(self._snapshot(), self._snapshot)
+        self.clients.add(client)
+        sender = asyncio.ensure_future(client.send())
+        try:
+            async for msg in ws:
+                # the only thing a dashboard sends: it saw a gap in the deltas
+                if msg.type == WSMsgType.TEXT and self.state.schema is not None:
+                    client.offer(self._snapshot(), self._snapshot)
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            # collect its end, or a send that failed on the closing socket is logged as never retrieved
+            with contextlib.suppress(asyncio.CancelledError, ConnectionError):
+                await sender
+        return ws
+
+    async def history_window(self, request: web.Request) -> web.Response:
+        """
+        /history?minutes=15&points=300[&device=...]: the channels and, per
+        device, at most `points` time-binned rows from the last `minutes`.
+        """
+        try:
+            minutes = min(float(request.query.get("minutes", self.history.minutes)), self.history.minutes)
+            points = max(1, min(int(request.query.get("points", "300")), 2000))
+        except ValueError:
+            raise web.HTTPBadRequest(text="minutes and points have to be numbers")
+        device = request.query.get("device")
+        key = (self.state.schema, minutes, points, device)
+        now = time.time()
+        cached = self._windows.get(key)
+        if cached is None or now - cached[0] > 1:
+            body = json.dumps({
+                "schema": self.state.schema,
+                "channels": self.state.channels,
+                "devices": self.history.window(now - minutes * 60, points, device),
+            }, separators=(",", ":")).encode()
+            self._windows = {k: v for k, v in self._windows.items() if now - v[0] <= 1}
+            cached = self._windows[key] = (now, body)
+        # the dashboard is served from the web app's port, so this is cross-origin
+        return web.Response(body=cached[1], content_type="application/json",
+                            headers={"Access-Control-Allow-Origin": "*"})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/live", self.websocket)
+        app.router.add_get("/history", self.history_window)
+        app.router.add_get("/metrics", metrics_page)
+        return app
+
+
+async def main():
+    history = LiveHistory(
+        minutes=float(os.getenv("LIVEHUB_HISTORY_MINUTES", "15")),
+        rate=float(os.getenv("LIVEHUB_HISTORY_RATE", "2")),
+    )
+    hub = LiveHub(depth=int(os.getenv("LIVEHUB_QUEUE", "64")), history=history)
+    path = os.getenv("LIVEHUB_SOCKET", "/tmp/scadaonpi-live.sock")
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(hub.poller, path)
+    runner = web.AppRunner(hub.app())
+    await runner.setup()
+    port = int(os.getenv("LIVEHUB_PORT", "3001"))
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    print(f"Live hub on :{port}/live, pollers on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
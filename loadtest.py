@@ -0,0 +1,145 @@
+# Load test for the web app and the live hub, run from another machine or
+# next to them on the Pi:
+#
+#   python loadtest.py http http://pi:3000/getsettings -c 50 -d 20
+#   python loadtest.py http http://pi:3000/downloadlog -c 4 --json '{"from": ..., "to": ..., "file": "excel"}'
+#   python loadtest.py ws ws://pi:3001/live -n 500 -d 60
+#
+# http keeps `-c` requests in flight for `-d` seconds and reports requests/s
+# and latency percentiles. ws holds `-n` dashboard sessions open and reports
+# how many stayed connected, frames/s delivered, and how far the slowest
+# client trailed the fastest on each delta. Set AUTH_STUB=allow on the web
+# app to load "/" without the license server. To approximate a Pi on a
+# faster machine, pin the servers to one core (taskset -c 0 python serve.py).
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(result: dict, out: Optional[str]) -> None:
+    for k, v in result.items():
+        print(f"{k:>16}: {round(v, 3) if isinstance(v, float) else v}")
+    if out:
+        with open(out, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+async def http_load(url: str, concurrency: int, duration: float, body: Optional[dict]) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if body is None:
+                    resp = await session.get(url)
+                else:
+                    resp = await session.post(url, json=body)
+                async with resp:
+                    await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                latencies.append(time.perf_counter() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                errors += 1
+
+    started = time.perf_counter()
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "test": "http", "url": url, "concurrency": concurrency, "seconds": elapsed,
+        "requests": len(latencies), "rps": len(latencies) / elapsed, "errors": errors,
+        "statuses": statuses,
+        "p50_ms": (percentile(latencies, 0.50) or 0) * 1e3,
+        "p95_ms": (percentile(latencies, 0.95) or 0) * 1e3,
+        "p99_ms": (percentile(latencies, 0.99) or 0) * 1e3,
+    }
+
+
+async def ws_load(url: str, clients: int, duration: float, ramp: float) -> dict:
+    frames = 0
+    connected = 0
+    dropped = 0
+    # first and last time any client got a delta, by (device, seq)
+    seen: Dict[tuple, List[float]] = {}
+
+    async def client(session: aiohttp.ClientSession, delay: float):
+        nonlocal frames, connected, dropped
+        await asyncio.sleep(delay)
+        try:
+            async with session.ws_connect(url, heartbeat=30) as ws:
+                connected += 1
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        continue
+                    frames += 1
+                    event, data = json.loads(msg.data)
+                    if event == "live-delta":
+                        now = time.perf_counter()
+                        span = seen.setdefault((data[1], data[2]), [now, now])
+                        span[1] = now
+            dropped += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            dropped += 1
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        tasks = [asyncio.ensure_future(client(session, ramp * i / clients)) for i in range(clients)]
+        await asyncio.sleep(ramp)
+        first = frames
+        started = time.perf_counter()
+        await asyncio.sleep(duration)
+        elapsed = time.perf_counter() - started
+        received = frames - first
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    spread = [last - first for first, last in seen.values()]
+    return {
+        "test": "ws", "url": url, "clients": clients, "connected": connected, "dropped": dropped,
+        "seconds": elapsed, "frames": received, "frames_per_s": received / elapsed,
+        "deltas": len(seen),
+        "spread_p50_ms": (percentile(spread, 0.50) or 0) * 1e3,
+        "spread_p99_ms": (percentile(spread, 0.99) or 0) * 1e3,
+        "loadavg": os.getloadavg()[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the web app (http) or the live hub (ws)")
+    parser.add_argument("mode", choices=("http", "ws"))
+    parser.add_argument("url")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="http: requests in flight")
+    parser.add_argument("-n", "--clients", type=int, default=200, help="ws: dashboard sessions")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds to measure")
+    parser.add_argument("--ramp", type=float, default=5, help="ws: seconds to open the sessions over")
+    parser.add_argument("--json", help="http: POST this body instead of a GET")
+    parser.add_argument("--out", help="append the result as a JSON line to this file")
+    args = parser.parse_args()
+
+    if args.mode == "http":
+        body = json.loads(args.json) if args.json else None
+        result = asyncio.run(http_load(args.url, args.concurrency, args.duration, body))
+    else:
+        result = asyncio.run(ws_load(args.url, args.clients, args.duration, args.ramp))
+    report(result, args.out)
+
+
+if __name__ == "__main__":
+    main()
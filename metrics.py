@@ -0,0 +1,174 @@
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+# seconds, from a fast TCP read up to a serial timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registry:
+    """
+    The metrics of one process, rendered in the Prometheus text format.
+    collectors run just before rendering, for values that are cheaper to
+    read when asked for than to keep up to date.
+    """
+
+    def __init__(self):
+        self.metrics: List["_Metric"] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        registry.metrics.append(self)
+
+    def _child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """the series for these label values; keep it rather than looking it up on every update"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._child()
+        return child
+
+    def _samples(self, labels: Tuple[str, ...], child) -> Iterator[str]:
+        yield f"{self.name}{_labels(self.label_names, labels)} {_number(child.value)}"
+
+    def render(self) -> List[str]:
+        if not self._children:
+            # not used by this process (the hub imports the pollers' modules too)
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in list(self._children.items()):
+            lines += self._samples(labels, child)
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: float = 1) -> None:
+        self.value += n
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _child = _Value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _child = _Value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """Fixed buckets, so an observation is a bisect and three additions."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, registry)
+
+    def _child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def _samples(self, labels: Tuple[str, ...], child: _Buckets) -> Iterator[str]:
+        cumulative = 0
+        for bound, n in zip((*self.buckets, float("inf")), child.counts):
+            cumulative += n
+            le = 'le="' + _number(bound) + '"'
+            yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(child.sum)}"
+        yield f"{self.name}_count{_labels(self.label_names, labels)} {child.count}"
+
+
+async def metrics_page(request) -> "web.Response":
+    """aiohttp handler for GET /metrics"""
+    from aiohttp import web
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve(port: int, host: str = "0.0.0.0") -> None:
+    """GET /metrics on `port`, for a process that has no web server of its own"""
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_page)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
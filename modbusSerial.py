@@ -1,42 +1,40 @@
 from pymodbus.client import AsyncModbusSerialClient
 import asyncio
+import logging
 import os
 import asyncpg
 from dotenv import load_dotenv
-import socketio
 import pytz
 from datetime import datetime
-import json
-import RPi.GPIO as GPIO
-
+from db import STORE_ERRORS, fetch_map_version, fetch_settings, fetch_signals, local_pool, remote_pool
+from readplanner import load_signals, plan_groups
+from pollengine import Device, PollEngine, load_devices
+from readings import SampleWriter, ensure_sample_table, migrate_tpmreading
+from historian import Historian
+from spool import Spool
+from rollups import RollupAccumulator, ensure_rollup_tables, rebuild_rollups
+from gpiocapture import EdgeCapture, gpio_backend
+from genhoursfunc import GeneratorHoursAccumulator
+from genstate import GenStateCache, checkpoint_generator_hours, load_generator_hours, watch_generators
+from livefeed import LiveFeed, LivePublisher
+from configwatch import ConfigWatcher
+from transport import ModbusTransport, RetryBudget, client_timeout
+import metrics
 
 load_dotenv()
 
-SERVERURL = 'http://localhost:3000'
-sio = socketio.AsyncClient()
-
-
-@sio.event
-async def connect():
-    print("Connected to WebSocket server")
+# DEBUG adds a line per poll cycle; below the level those cost a comparison
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("modbusSerial")
 
-@sio.event
-async def disconnect():
-    print("Disconnected from WebSocket server")
+# change-only frames for the dashboards, sent to the live hub (livehub.py)
+liveFeed = LiveFeed()
+livePublisher = LivePublisher(liveFeed, os.getenv("LIVEHUB_SOCKET", "/tmp/scadaonpi-live.sock"))
 
-async def getSignals() -> list:
-    connection: asyncpg.Connection = await asyncpg.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        database=os.getenv("DB_NAME"),
-        password=os.getenv("DB_PASSWORD"),
-        user=os.getenv("DB_USER")
-    )
-    rows = await connection.fetch("select * from tpm")
-    await connection.close()
-    return rows
+async def getSignals(remoteConnection: asyncpg.Pool) -> list:
+    return await fetch_signals(remoteConnection)
 
-async def connectClient(storeConnection:asyncpg.Connection) -> AsyncModbusSerialClient:
+async def connectClient(settings: asyncpg.Record) -> AsyncModbusSerialClient:
     """
     Connect to Modbus device via serial/RS485
     Common RS485 parameters:
@@ -47,23 +45,14 @@ async def connectClient(storeConnection:asyncpg.Connection) -> AsyncModbusSerial
     - stopbits: 1 or 2
     - slave: Modbus slave ID (check your device, typically 1)
     """
-    settings = await storeConnection.fetch("select * from settings")
-
-    port = settings[0]['port']
-    baudrate = settings[0]['baudrate']
-    bytesize = settings[0]['bytesize']
-    parity = settings[0]['parity']
-    stopbits = settings[0]['stopbits']
-    timeout = settings[0]['timeout']
-    SLAVE_ID = settings[0]['slaveid']
+    port = settings['port']
+    baudrate = settings['baudrate']
+    bytesize = settings['bytesize']
+    parity = settings['parity']
+    stopbits = settings['stopbits']
+    timeout = settings['timeout']
 
-    print(f"Serial Port Settings:")
-    print(f"  Port: {port}")
-    print(f"  Baudrate: {baudrate}")
-    print(f"  Bytesize: {bytesize}")
-    print(f"  Parity: {parity}")
-    print(f"  Stopbits: {stopbits}")
-    print(f"  Timeout: {timeout}")
+    log.info("Serial port %s: %s baud, %s%s%s, timeout %ss", port, baudrate, bytesize, parity, stopbits, timeout)
 
     client = AsyncModbusSerialClient(
         port=port,
@@ -71,292 +60,176 @@ async def connectClient(storeConnection:asyncpg.Connection) -> AsyncModbusSerial
         bytesize=bytesize,
         parity=parity,
         stopbits=stopbits,
-        timeout=timeout
+        # timeouts, retries and reopening the port are left to the ModbusTransport
+        # around it, which times out first so a silent slave doesn't close the port
+        timeout=client_timeout(timeout),
+        retries=0,
+        reconnect_delay=0,
     )
     await client.connect()
-    return client,SLAVE_ID
-
-def normalizeVoltage(v):
-    VT = 1
-    return str(round(v*VT*0.1, 2))
-
-def normalizeCurrent(c):
-    CT = 1
-    return str(round(c*CT*0.001, 2))
-
-def normalizeFrequency(f):
-    return str(round(f*0.01, 2))
-
-def normalizePowerFactor(pf):
-    return str(round(pf*0.001, 2))
-
-async def main():
-
-    storeConnection: asyncpg.Connection = await asyncpg.connect(
-        host="localhost",
-        port="5432",
-        database=os.getenv("DB_NAME_LOCAL"),
-        password=os.getenv("DB_PASSWORD_LOCAL"),
-        user="devgadbadr"
+    return client
+
+# gpio pin of each generator, None where no input is wired
+GEN_PINS = {"gen1": 17, "gen2": None, "gen3": 22}
+
+async def genLoop(storeConnection: asyncpg.Pool, genValues: dict, genCache: GenStateCache):
+    # edge-triggered: transitions are timestamped when they happen, not at the next poll
+    capture = EdgeCapture(
+        gpio_backend(),
+        [p for p in GEN_PINS.values() if p is not None],
+        debounce=float(os.getenv("GPIO_DEBOUNCE", "0.05")),
+        tz=pytz.timezone("Europe/Istanbul"),
     )
-    
-    client,SLAVE_ID = await connectClient(storeConnection)
-    print("Client connection is "+str(client.connected))
-    signalList = await getSignals()
-    print(f"Total {len(signalList)} signals found")
-    signalValues = {}
-    sio.connect(SERVERURL)
-
-    # Set them as input with internal pull-up resistors
-    pins = [17, 27, 22]
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setwarnings(False)
-    for p in pins:
-        GPIO.setup(p, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    await watch_generators(storeConnection, capture, GEN_PINS, genValues, genCache)
+
+async def genHoursLoop(storeConnection: asyncpg.Pool, genValues: dict, genHours: GeneratorHoursAccumulator):
+    # running totals kept up to date by the gens cache, checkpointed now and then
+    checkpointEvery = float(os.getenv("GENHOURS_CHECKPOINT", "300"))
+    loop = asyncio.get_running_loop()
+    lastCheckpoint = loop.time()
+    while True:
+        genValues['genhours'] = genHours.hours()
+        if loop.time() - lastCheckpoint >= checkpointEvery:
+            try:
+                await checkpoint_generator_hours(storeConnection, genHours)
+            except STORE_ERRORS as e:
+                # the totals stay in memory, the next checkpoint stores them
+                log.warning("Generator hours checkpoint failed: %r", e)
+            lastCheckpoint = loop.time()
+        await asyncio.sleep(2)
 
+async def storeSample(historian: Historian, device: Device, signalValues: dict):
     turkey_tz = pytz.timezone("Europe/Istanbul")
-    while client.connected:
-        # Read gens status 
-        states = {p: GPIO.input(p) for p in pins}
-        print(states)
-
-        gen1CurrentState = states[17] 
-        gen2CurrentState = 0
-        gen3CurrentState = states[22]
-        
-        signalValues['gen1'] = gen1CurrentState
-        signalValues['gen2'] = gen2CurrentState
-        signalValues['gen3'] = gen3CurrentState
-
-        query = """
-        SELECT DISTINCT ON (gen) gen, state, timestamp
-        FROM gens
-        WHERE gen IN ('gen1', 'gen2', 'gen3')
-        ORDER BY gen, timestamp DESC
-        """
-        async with storeConnection.transaction():
-            rows = await storeConnection.fetch(query)
-        
-        ts = datetime.now(turkey_tz)
-        
-        latest = {row['gen']: row for row in rows}
-        gen1last = latest.get('gen1')
-        gen2last = latest.get('gen2')
-        gen3last = latest.get('gen3')
-        gen1state = gen1last[1]
-        gen2state = gen2last[1]
-        gen3state = gen3last[1]
-
-        if gen1CurrentState: #gen 1 off its gpio is 1
-            if gen1state:
-                await storeConnection.execute("insert into gens (status,timestamp,gen,state) values ($1,$2,$3,$4)",'gen 1 off',ts,'gen1',False)
-        else: #gen 1 on its gpio is 0
-            if not gen1state:
-                await storeConnection.execute("insert into gens (status,timestamp,gen,state) values ($1,$2,$3,$4)",'gen 1 on',ts,'gen1',True)
-
-        if gen2CurrentState: #gen 2 off its gpio is 1
-            if gen2state:
-                await storeConnection.execute("insert into gens (status,timestamp,gen,state) values ($1,$2,$3,$4)",'gen 2 off',ts,'gen2',False)
-        else: #gen 2 on its gpio is 0
-            if not gen2state:
-                await storeConnection.execute("insert into gens (status,timestamp,gen,state) values ($1,$2,$3,$4)",'gen 2 on',ts,'gen2',True)
-
-        if gen3CurrentState: #gen 2 off its gpio is 1
-            if gen3state:
-                await storeConnection.execute("insert into gens (status,timestamp,gen,state) values ($1,$2,$3,$4)",'gen 3 off',ts,'gen3',False)
-        else: #gen 2 on its gpio is 0
-            if not gen3state:
-                await storeConnection.execute("insert into gens (status,timestamp,gen,state) values ($1,$2,$3,$4)",'gen 3 on',ts,'gen3',True)
-
-        # Read L1, L2, L3 Voltage
-        rr = await client.read_holding_registers(4000, 3, slave=SLAVE_ID)
-        signalValues['L1 Voltage'] = normalizeVoltage(rr.registers[0]) if rr.registers else ""
-        signalValues['L2 Voltage'] = normalizeVoltage(rr.registers[1]) if rr.registers else ""
-        signalValues['L3 Voltage'] = normalizeVoltage(rr.registers[2]) if rr.registers else ""
+    ts = datetime.now(turkey_tz)
 
-        # Read L1, L2, L3 Current
-        rr = await client.read_holding_registers(4024, 4, slave=SLAVE_ID)
-        signalValues['L1 Current'] = normalizeCurrent(rr.registers[0]) if rr.registers else ""
-        signalValues['L2 Current'] = normalizeCurrent(rr.registers[1]) if rr.registers else ""
-        signalValues['L3 Current'] = normalizeCurrent(rr.registers[2]) if rr.registers else ""
-        signalValues['Neutral Current'] = normalizeCurrent(rr.registers[3]) if rr.registers else ""
+    livePublisher.publish(signalValues)
 
-        # Read Frequency
-        rr = await client.read_holding_registers(4040, 3, slave=SLAVE_ID)
-        signalValues['L1 Frequency'] = normalizeFrequency(rr.registers[0]) if rr.registers else ""
-        signalValues['L2 Frequency'] = normalizeFrequency(rr.registers[1]) if rr.registers else ""
-        signalValues['L3 Frequency'] = normalizeFrequency(rr.registers[2]) if rr.registers else ""
+    # buffered here, written to tpmsample in bulk by the historian task
+    historian.add(device.name, ts, signalValues)
 
-        # Read Power Factor
-        rr = await client.read_holding_registers(4043, 4, slave=SLAVE_ID)
-        signalValues['L1 Power Factor'] = normalizePowerFactor(rr.registers[0]) if rr.registers else ""
-        signalValues['L2 Power Factor'] = normalizePowerFactor(rr.registers[1]) if rr.registers else ""
-        signalValues['L3 Power Factor'] = normalizePowerFactor(rr.registers[2]) if rr.registers else ""
-        signalValues['Total Power Factor'] = normalizePowerFactor(rr.registers[3]) if rr.registers else ""
-
-        # Read Active Power
-        rr = await client.read_holding_registers(4140, 8, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 2:
-            high, low = rr.registers[0], rr.registers[1]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L1 Active Power'] = value
-        if rr.registers and len(rr.registers) >= 4:
-            high, low = rr.registers[2], rr.registers[3]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L2 Active Power'] = value
-        if rr.registers and len(rr.registers) >= 6:
-            high, low = rr.registers[4], rr.registers[5]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L3 Active Power'] = value
-        if rr.registers and len(rr.registers) >= 8:
-            high, low = rr.registers[6], rr.registers[7]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['Total Active Power'] = value
-
-        # Read Reactive Power
-        rr = await client.read_holding_registers(4162, 8, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 2:
-            high, low = rr.registers[0], rr.registers[1]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L1 Reactive Power'] = value
-        if rr.registers and len(rr.registers) >= 4:
-            high, low = rr.registers[2], rr.registers[3]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L2 Reactive Power'] = value
-        if rr.registers and len(rr.registers) >= 6:
-            high, low = rr.registers[4], rr.registers[5]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L3 Reactive Power'] = value
-        if rr.registers and len(rr.registers) >= 8:
-            high, low = rr.registers[6], rr.registers[7]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['Total Reactive Power'] = value
-
-        #  Read Apparent Power
-        rr = await client.read_holding_registers(4184, 8, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 2:
-            high, low = rr.registers[0], rr.registers[1]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L1 Apparent Power'] = value
-        if rr.registers and len(rr.registers) >= 4:
-            high, low = rr.registers[2], rr.registers[3]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L2 Apparent Power'] = value
-        if rr.registers and len(rr.registers) >= 6:
-            high, low = rr.registers[4], rr.registers[5]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['L3 Apparent Power'] = value
-        if rr.registers and len(rr.registers) >= 8:
-            high, low = rr.registers[6], rr.registers[7]
-            value = (high << 16) | low
-        else:
-            value = 0
-        signalValues['Total Apparent Power'] = value
-
-        # Read Total Active Import Energy
-        rr = await client.read_holding_registers(4222, 4, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 4:
-            h3, h2, h1, l = rr.registers[0], rr.registers[1], rr.registers[2], rr.registers[3]
-            energy_wh = (h3 << 48) | (h2 << 32) | (h1 << 16) | l   
-        else:
-            energy_wh = 0
-        signalValues['Total Active Import Energy'] = energy_wh
-
-        # Read Total Active Export Energy
-        rr = await client.read_holding_registers(4238, 4, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 4:
-            h3, h2, h1, l = rr.registers[0], rr.registers[1], rr.registers[2], rr.registers[3]
-            energy_wh = (h3 << 48) | (h2 << 32) | (h1 << 16) | l
-        else:
-            energy_wh = 0
-        signalValues['Total Active Export Energy'] = energy_wh
-
-        # Read Total Inductive Energy
-        rr = await client.read_holding_registers(4254, 4, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 4:
-            h3, h2, h1, l = rr.registers[0], rr.registers[1], rr.registers[2], rr.registers[3]
-            energy_varh = (h3 << 48) | (h2 << 32) | (h1 << 16) | l
-        else:
-            energy_varh = 0
-        signalValues['Total Inductive Energy'] = energy_varh
-
-        # Read Total Capacitive Energy
-        rr = await client.read_holding_registers(4270, 4, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 4:
-            h3, h2, h1, l = rr.registers[0], rr.registers[1], rr.registers[2], rr.registers[3]
-            energy_varh = (h3 << 48) | (h2 << 32) | (h1 << 16) | l
-        else:
-            energy_varh = 0
-        signalValues['Total Capacitive Energy'] = energy_varh
-
-        # Read Total Apparent Energy
-        rr = await client.read_holding_registers(4292, 4, slave=SLAVE_ID)
-        if rr.registers and len(rr.registers) >= 4:
-            h3, h2, h1, l = rr.registers[0], rr.registers[1], rr.registers[2], rr.registers[3]
-            energy_vah = (h3 << 48) | (h2 << 32) | (h1 << 16) | l
-        else:
-            energy_vah = 0
-        signalValues['Total Apparent Energy'] = energy_vah
-
-        # for key, value in signalValues.items():
-        #     print(f"{key}: {value}")
-
-        if sio.connected:
-            await sio.emit("modbus-data", signalValues)
-        else:
-            print("WebSocket not connected No Data Sent... Will Try to Reconnect")
-            try:
-                await sio.connect(SERVERURL)
-            except Exception as e:
-                print("Reconnection failed:", e)
-
-        # Logic to store data to database
-        # It should check last reading against current time, if more than one hour it stores , if not just passes
-        lastReading = await storeConnection.fetchval("select timestamp from tpmreading order by timestamp desc limit 1")
-        print("last reading: ",lastReading)
-
-        payload = json.dumps(signalValues)
-        if not lastReading:
-            await storeConnection.execute("INSERT INTO tpmreading (data, timestamp) VALUES ($1, $2)",payload, ts)
-            print("inserted first readings")
-        else:
-            now = datetime.now(turkey_tz)
-            diff = now - lastReading
-            seconds = diff.total_seconds()
-            print(round(seconds))
-            # log every 10 minutes
-            if seconds >= 60*10:
-                await storeConnection.execute("INSERT INTO tpmreading (data, timestamp) VALUES ($1, $2)",payload, ts)
-                print("inserted a reading: ",now)
-
-        print("-"*20)
-        await asyncio.sleep(2)
+async def main():
+    # a pool, not one connection: every device task and the gens loop use it concurrently
+    storeConnection: asyncpg.Pool = await local_pool()
+    remoteConnection: asyncpg.Pool = await remote_pool()
+    # the map and settings in use from here on; the watcher applies changes to them in place
+    settings = await fetch_settings(storeConnection)
+    mapVersion = await fetch_map_version(remoteConnection)
+    client = await connectClient(settings)
+    SLAVE_ID = settings['slaveid']
+    log.info("Client connection is "+str(client.connected))
+    signalList = await getSignals(remoteConnection)
+    log.info(f"Total {len(signalList)} signals found")
+    signals = load_signals(signalList)
+    liveFeed.set_signals(signals)
+    readPlans = plan_groups(signals, max_gap=int(os.getenv("MODBUS_MAX_GAP", "32")))
+    for pollclass, readPlan in readPlans.items():
+        log.info(f"Reading {pollclass} signals in {len(readPlan)} requests: " + ", ".join(f"{b.start}/{b.count}" for b in readPlan))
+    pollIntervals = {
+        "fast": float(os.getenv("POLL_FAST_INTERVAL", "0.5")),
+        "slow": float(os.getenv("POLL_SLOW_INTERVAL", "30")),
+    }
+
+    # every device on the RS-485 bus shares the one serial client
+    devices = await load_devices(storeConnection, "serial")
+    # without a devices table the one meter's slave id comes from the serial settings
+    slaveFromSettings = not devices
+    if not devices:
+        devices = [Device("tpm", slave=SLAVE_ID)]
+    log.info(f"Polling {len(devices)} devices: " + ", ".join(f"{d.name}/{d.slave}" for d in devices))
+
+    await ensure_sample_table(storeConnection, signals)
+    if not await storeConnection.fetchval("select exists (select 1 from tpmsample)"):
+        copied = await migrate_tpmreading(storeConnection, signals)
+        log.info(f"Copied {copied} readings from tpmreading to tpmsample")
+    await ensure_rollup_tables(storeConnection)
+    if not await storeConnection.fetchval("select exists (select 1 from tpmrollup_1m)"):
+        rolled = await rebuild_rollups(storeConnection, signals, "Europe/Istanbul")
+        log.info(f"Rolled up {rolled} minute buckets from tpmsample")
+    # samples go to disk first, so a slow or restarting Postgres never holds up polling
+    spool = Spool(
+        os.path.join(os.getenv("SPOOL_DIR", "/home/bigled/scadaonpi/spool"), "serial"),
+        max_bytes=int(os.getenv("SPOOL_MAX_MB", "512")) << 20,
+    )
+    historian = Historian(
+        storeConnection,
+        SampleWriter(signals),
+        resolution=float(os.getenv("HISTORIAN_RESOLUTION", "2")),
+        batch_size=int(os.getenv("HISTORIAN_BATCH_SIZE", "500")),
+        flush_interval=float(os.getenv("HISTORIAN_FLUSH_INTERVAL", "5")),
+        rollups=RollupAccumulator(signals, pytz.timezone("Europe/Istanbul")),
+        spool=spool,
+    )
 
+    genCache = await GenStateCache.load(storeConnection)
+    genHours = await load_generator_hours(storeConnection)
+    genCache.listeners.append(genHours.apply)
+    genValues = {"genhours": genHours.hours()}
+
+    async def onSample(device: Device, values: dict):
+        signalValues = {"device": device.name, **genValues, **values}
+        await storeSample(historian, device, signalValues)
+
+    engine = PollEngine(
+        readPlans,
+        onSample,
+        pollIntervals,
+        stale_polls=int(os.getenv("STALE_POLLS", "3")),
+        breaker_threshold=int(os.getenv("BREAKER_FAILURES", "3")),
+        breaker_cooldown=float(os.getenv("BREAKER_COOLDOWN", "10")),
+    )
+    # every device on the bus shares it; a port that can't be opened now is retried in the background
+    engine.add_link(devices[0].link, ModbusTransport(
+        client,
+        name="serial",
+        request_timeout=settings['timeout'],
+        retries=int(os.getenv("MODBUS_RETRIES", "2")),
+        budget=RetryBudget(float(os.getenv("MODBUS_RETRY_RATIO", "0.1"))),
+        backoff_max=float(os.getenv("MODBUS_BACKOFF_MAX", "30")),
+    ))
+    for device in devices:
+        engine.add_device(device)
+
+    async def applyMap(rows):
+        newSignals = load_signals(rows)
+        newPlans = plan_groups(newSignals, max_gap=int(os.getenv("MODBUS_MAX_GAP", "32")))
+        await ensure_sample_table(storeConnection, newSignals)
+        # stores the samples taken with the old map first, raises if it can't
+        await historian.set_signals(newSignals)
+        engine.set_plans(newPlans)
+        liveFeed.set_signals(newSignals)
+        livePublisher.resync()
+        log.info(f"Now reading {len(newSignals)} signals in " + ", ".join(f"{c}: {len(p)}" for c, p in newPlans.items()) + " requests")
+
+    async def applySettings(settings):
+        # the new port is opened before the old one is let go; a read on the old one just fails once
+        transport = engine.links[devices[0].link]
+        newClient = await connectClient(settings)
+        log.info("Client connection is "+str(newClient.connected))
+        transport.replace(newClient)
+        transport.request_timeout = settings['timeout']
+        if slaveFromSettings and settings['slaveid'] != devices[0].slave:
+            devices[0] = devices[0]._replace(slave=settings['slaveid'])
+            engine.set_device(devices[0])
+
+    watcher = ConfigWatcher(
+        storeConnection,
+        remoteConnection,
+        applyMap,
+        applySettings,
+        interval=float(os.getenv("CONFIG_CHECK_INTERVAL", "30")),
+        map_version=mapVersion,
+        settings=settings,
+    )
 
-    await client.close()
-    await sio.disconnect()
-    print("Client Disconnected")
+    await asyncio.gather(
+        genLoop(storeConnection, genValues, genCache),
+        genHoursLoop(storeConnection, genValues, genHours),
+        engine.run(),
+        historian.run(),
+        spool.run(),
+        livePublisher.run(),
+        watcher.run(),
+        metrics.serve(int(os.getenv("METRICS_PORT_SERIAL", "9102"))),
+    )
     
-asyncio.run(main())
\ No newline at end of file
+asyncio.run(main())
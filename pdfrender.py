@@ -0,0 +1,277 @@
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+ISTANBUL = ZoneInfo("Europe/Istanbul")
+PAGE_SIZE = (11.69, 8.27)       # A4 landscape, inches
+# points kept of a plotted series: about one per device pixel of the plot
+# area at 150 dpi, more than a printed page can show
+PLOT_POINTS = 1500
+
+
+def _parse_iso_aware(s) -> datetime:
+    # accepts "...Z" or "+00:00" or naive (assume UTC)
+    if isinstance(s, datetime):
+        dt = s if s.tzinfo else s.replace(tzinfo=timezone.utc)
+    else:
+        if s.endswith("Z"):
+            s = s[:-1] + "+00:00"
+        dt = datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _to_tr_naive(dt: datetime) -> datetime:
+    # to Europe/Istanbul, then strip tzinfo for matplotlib/xlsx friendliness
+    return dt.astimezone(ISTANBUL).replace(tzinfo=None)
+
+
+def _numify(v):
+    if isinstance(v, (int, float)) or v is None:
+        return v
+    if isinstance(v, str):
+        try:
+            return int(v) if v.strip().isdigit() else float(v)
+        except Exception:
+            return v
+    return v
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets: keep `n` points of (x, y), x ascending,
+    picking in every bucket the point that spans the largest triangle with
+    the previously kept point and the average of the next bucket, so peaks
+    and dips survive the decimation.
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return x, y
+    every = (size - 2) / (n - 2)
+    keep = np.empty(n, dtype=np.int64)
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, size)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+_templates = threading.local()
+
+
+def _page(name: str) -> Tuple[Figure, object]:
+    """
+    A figure and axes for one report page, created once per thread and
+    cleared for reuse; no pyplot, so report workers don't share any state.
+    """
+    pages: Dict[str, tuple] = getattr(_templates, "pages", None)
+    if pages is None:
+        pages = _templates.pages = {}
+    if name not in pages:
+        fig = Figure(figsize=PAGE_SIZE)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        pages[name] = (fig, ax)
+    fig, ax = pages[name]
+    ax.clear()
+    return fig, ax
+
+
+def make_charts_pdf(
+    timestamps,                         # list[str|datetime]
+    total_active_power,                 # list[number]
+    output_path,                        # "/home/.../report.pdf"
+    from_iso=None,
+    to_iso=None,
+    last_row=None,                      # {"data": {...}} or {...}
+    genhours=None,                      # {'Generator 1': 5.0, ...}
+    last_ts=None                        # ISO string or datetime for "Last readings at ..."
+):
+    if not (timestamps and total_active_power):
+        raise ValueError("No data provided")
+    if len(timestamps) != len(total_active_power):
+        raise ValueError("timestamps and power must have equal length")
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+    # epoch seconds, oldest first, gaps dropped; then only what the page can show
+    x = np.fromiter((_parse_iso_aware(t).timestamp() for t in timestamps), dtype=float, count=len(timestamps))
+    y = np.array([np.nan if v is None else float(v) for v in total_active_power], dtype=float)
+    order = np.argsort(x, kind="stable")
+    x, y = x[order], y[order]
+    valid = ~np.isnan(y)
+    x, y = lttb(x[valid], y[valid], PLOT_POINTS)
+    ts_tr = [datetime.fromtimestamp(t, ISTANBUL).replace(tzinfo=None) for t in x]
+
+    # subtitle "from .. to .. (Europe/Istanbul)" if provided
+    if from_iso and to_iso:
+        f_tr = _to_tr_naive(_parse_iso_aware(from_iso)).strftime("%Y-%m-%d %H:%M")
+        t_tr = _to_tr_naive(_parse_iso_aware(to_iso  )).strftime("%Y-%m-%d %H:%M")
+        subtitle = f"from {f_tr} to {t_tr} (Europe/Istanbul)"
+    else:
+        subtitle = "Europe/Istanbul"
+
+    with PdfPages(output_path) as pdf:
+        # ---- Page 1: Working hours bar chart ----
+        names = ["Generator 1", "Generator 2", "Generator 3"]
+        gh = genhours or {}
+        values = [_numify(gh.get(name, 0)) for name in names]
+        max_v = max(values) if values else 0
+
+        fig0, ax0 = _page("hours")
+        fig0.suptitle("TPM-04ES Report", fontsize=18, fontweight="bold", y=0.98)
+        ax0.set_title("Generators Working Hours\n" + subtitle, fontsize=13, pad=12)
+
+        ax0.barh(names, values, height=0.45)
+        ax0.set_xlabel("Hours")
+        ax0.set_ylabel("Generator")
+        ax0.grid(True, axis="x", linestyle="--", alpha=0.4)
+        ax0.margins(x=0.10, y=0.20)
+        if max_v > 0:
+            ax0.set_xlim(0, max_v * 1.15)
+        for yy, v in enumerate(values):
+            ax0.text(v, yy, f"  {v:g}", va="center", ha="left")
+
+        fig0.subplots_adjust(left=0.12, right=0.96, top=0.86, bottom=0.10)
+        pdf.savefig(fig0)
+
+        # --- Page 2: Total Active Power ---
+        fig1, ax1 = _page("power")
+        ax1.plot(ts_tr, y)
+        ax1.set_title("Total Active Power\n" + subtitle, fontsize=14, pad=10)
+        ax1.set_xlabel("Time (Europe/Istanbul)")
+        ax1.set_ylabel("Total Active Power (W)")
+        ax1.grid(True, linestyle="--", alpha=0.4)
+        ax1.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d\n%H:%M"))
+        ax1.margins(x=0.03, y=0.10)
+        fig1.subplots_adjust(left=0.10, right=0.97, top=0.89, bottom=0.16)
+        pdf.savefig(fig1)
+
+        # --- Page 3: Last readings table ---
+        data_dict = {}
+        if isinstance(last_row, dict):
+            if "data" in last_row and isinstance(last_row["data"], dict):
+                data_dict = last_row["data"]
+            else:
+                data_dict = last_row  # readings dict directly
+
+        keys = sorted(data_dict.keys()) if data_dict else []
+        table_rows = [[k, _numify(data_dict.get(k))] for k in keys]
+
+        # use passed last_ts for title if provided
+        if last_ts:
+            try:
+                title_ts = _to_tr_naive(_parse_iso_aware(last_ts)).strftime("%Y-%m-%d %H:%M:%S")
+            except Exception:
+                title_ts = str(last_ts)
+        else:
+            title_ts = "unknown"
+
+        fig3, ax3 = _page("table")
+        ax3.axis("off")
+        ax3.set_title(f"Last readings at {title_ts} (Europe/Istanbul)", fontsize=14, pad=16)
+
+        if table_rows:
+            tbl = ax3.table(
+                cellText=table_rows,
+                colLabels=["Reading", "Value"],
+                cellLoc="center",
+                colWidths=[0.55, 0.30],
+                loc="upper center",
+            )
+            tbl.auto_set_font_size(False)
+            tbl.set_fontsize(9)
+            tbl.scale(1.05, 1.12)
+        else:
+            ax3.text(0.5, 0.5, "No readings available", ha="center", va="center", fontsize=12)
+
+        fig3.subplots_adjust(left=0.06, right=0.94, top=0.92, bottom=0.04)
+        pdf.savefig(fig3)
+
+    return output_path
+
+
+def make_series_pdf(output_path, data, spec, from_iso=None, to_iso=None):
+    """
+    Report builder PDF: one page per aggregated series, every device as its
+    own line (bars for counter deltas over few buckets), then a summary table.
+    data / spec: reportbuilder.ReportData / ReportSpec
+    """
+    from reportbuilder import series_label, summarize
+
+    if not len(data.periods):
+        raise ValueError("No data provided")
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+    if from_iso and to_iso:
+        f_tr = _to_tr_naive(_parse_iso_aware(from_iso)).strftime("%Y-%m-%d %H:%M")
+        t_tr = _to_tr_naive(_parse_iso_aware(to_iso)).strftime("%Y-%m-%d %H:%M")
+        subtitle = f"from {f_tr} to {t_tr} (Europe/Istanbul)"
+    else:
+        subtitle = "Europe/Istanbul"
+    bucket_label = f"{spec.bucket // 3600}h" if spec.bucket % 3600 == 0 else f"{spec.bucket // 60}m"
+    epoch = np.fromiter((p.timestamp() for p in data.periods), dtype=float, count=len(data.periods))
+    devices = list(dict.fromkeys(data.devices))
+
+    with PdfPages(output_path) as pdf:
+        for signal, agg in spec.columns:
+            fig, ax = _page("series")
+            fig.suptitle("TPM-04ES Report", fontsize=16, fontweight="bold", y=0.98)
+            ax.set_title(f"{signal.name}, {agg} per {bucket_label}\n" + subtitle, fontsize=13, pad=10)
+            values = data.values[(signal.name, agg)]
+            bars = agg == "delta" and len(epoch) / max(len(devices), 1) <= 120
+            for n, device in enumerate(devices):
+                rows = (data.devices == device) & ~np.isnan(values)
+                x, y = epoch[rows], values[rows]
+                if bars:
+                    width = spec.bucket / 86400 / (len(devices) + 1)
+                    xs = mdates.date2num([datetime.fromtimestamp(t, ISTANBUL).replace(tzinfo=None) for t in x])
+                    ax.bar(xs + n * width, y, width=width, align="edge", label=device)
+                else:
+                    x, y = lttb(x, y, PLOT_POINTS)
+                    ax.plot([datetime.fromtimestamp(t, ISTANBUL).replace(tzinfo=None) for t in x], y, label=device)
+            ax.set_xlabel("Time (Europe/Istanbul)")
+            ax.set_ylabel(series_label(signal, agg))
+            ax.grid(True, linestyle="--", alpha=0.4)
+            ax.xaxis_date()
+            ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d\n%H:%M"))
+            if len(devices) > 1:
+                ax.legend(loc="upper right")
+            fig.subplots_adjust(left=0.10, right=0.97, top=0.86, bottom=0.14)
+            pdf.savefig(fig)
+
+        fig, ax = _page("summary")
+        ax.axis("off")
+        ax.set_title("Summary\n" + subtitle, fontsize=14, pad=16)
+        fmt = lambda v: "" if v is None else f"{v:,.3f}"
+        rows = [[name, agg, device, *(fmt(v) for v in vals)] for name, agg, device, *vals in summarize(data, spec)]
+        tbl = ax.table(
+            cellText=rows,
+            colLabels=["Signal", "Aggregation", "Device", "Total", "Min", "Max", "Mean"],
+            cellLoc="center",
+            colWidths=[0.28, 0.09, 0.09, 0.14, 0.13, 0.13, 0.14],
+            loc="upper center",
+        )
+        tbl.auto_set_font_size(False)
+        tbl.set_fontsize(8)
+        tbl.scale(1.0, 1.1)
+        fig.subplots_adjust(left=0.04, right=0.96, top=0.90, bottom=0.04)
+        pdf.savefig(fig)
+
+    return output_path
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import math
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from pymodbus.exceptions import ModbusException
+
+from readplanner import ReadBlock, read_plan
+from regdecoder import PlanDecoder
+from metrics import Counter, Histogram
+from transport import COMM_ERROR, GOOD, STALE, CircuitBreaker, worst
+
+log = logging.getLogger(__name__)
+
+POLL_SECONDS = Histogram("scada_poll_seconds", "Reading one poll class of one device, all its requests", ("device", "pollclass"))
+SAMPLE_SECONDS = Histogram("scada_sample_seconds", "Handing one sample on: live feed and historian buffer", ("device",))
+POLL_FAILURES = Counter("scada_poll_failures_total", "Polls that got no answer", ("device", "pollclass"))
+POLLS_SKIPPED = Counter("scada_polls_skipped_total", "Polls not sent because the device's circuit was open", ("device",))
+SAMPLES = Counter("scada_samples_total", "Samples by quality", ("device", "quality"))
+
+DEVICES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id serial PRIMARY KEY,
+    name text NOT NULL UNIQUE,
+    host text,
+    port integer,
+    slaveid integer NOT NULL DEFAULT 1,
+    pollinterval real NOT NULL DEFAULT 2,
+    timeout real NOT NULL DEFAULT 5,
+    enabled boolean NOT NULL DEFAULT true
+)
+"""
+
+
+class Device(NamedTuple):
+    name: str
+    slave: int = 1
+    interval: float = 2.0           # seconds between polls of "normal" signals
+    timeout: float = 5.0            # budget for one poll of one class
+    host: Optional[str] = None      # TCP gateway, None for the RS-485 bus
+    port: Optional[int] = None
+
+    @property
+    def link(self) -> Hashable:
+        # devices with the same link share one Modbus client
+        return (self.host, self.port)
+
+
+async def load_devices(conn, transport: str) -> List[Device]:
+    """
+    conn: asyncpg connection or pool on the local database
+    transport: "tcp" for gateway devices, "serial" for devices on the RS-485 bus
+    returns: enabled devices of that transport from the `devices` table
+    """
+    await conn.execute(DEVICES_SCHEMA)
+    rows = await conn.fetch(
+        "select * from devices where enabled and (host is not null) = $1 order by id",
+        transport == "tcp",
+    )
+    return [
+        Device(
+            name=r["name"],
+            slave=r["slaveid"],
+            interval=r["pollinterval"],
+            timeout=r["timeout"],
+            host=r["host"],
+            port=r["port"],
+        )
+        for r in rows
+    ]
+
+
+async def every(interval: float) -> AsyncIterator[float]:
+    """
+    Yield on a fixed grid of deadlines (loop.time() based), so the time
+    spent by the caller between ticks does not push later ticks back.
+    Ticks missed because the caller overran are skipped, not bunched up.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while True:
+        yield deadline
+        deadline += interval
+        now = loop.time()
+        if deadline < now:
+            deadline += math.ceil((now - deadline) / interval) * interval
+        await asyncio.sleep(deadline - now)
+
+
+SampleCallback = Callable[[Device, Dict[str, object]], Awaitable[None]]
+
+
+class PollEngine:
+    """
+    Polls many devices concurrently, one asyncio task per device and poll class.
+
+    Devices that share a link (a TCP gateway or the serial bus) share its
+    client. The client serializes individual requests, so reads of devices
+    on one bus interleave request by request instead of device by device,
+    and a slow meter only ever holds the bus for one transaction.
+
+    Each poll class ("fast", "normal", "slow") has its own read plan and
+    runs on its own deadline clock. "normal" uses the device interval, the
+    others use `intervals`. After every read the callback gets the
+    device's latest value of every signal read so far, and under "quality"
+    the worst quality among them (transport.GOOD / STALE / COMM_ERROR). A
+    signal whose read fails keeps its last good value as stale for
+    `stale_polls` intervals of its class, then goes to None as comm-error;
+    a device that fails `breaker_threshold` polls in a row is only tried
+    every `breaker_cooldown` seconds until it answers again.
+
+    Plans, links and devices can be swapped while it runs (set_plans,
+    add_link, set_device); each group picks the change up at its next poll.
+    """
+
+    def __init__(
+        self,
+        plans: Dict[str, List[ReadBlock]],
+        on_sample: SampleCallback,
+        intervals: Optional[Dict[str, float]] = None,
+        stale_polls: int = 3,
+        breaker_threshold: int = 3,
+        breaker_cooldown: float = 10.0,
+    ):
+        self.plans = plans
+        self.decoders = {c: PlanDecoder(p) for c, p in plans.items()}
+        self.on_sample = on_sample
+        self.intervals = intervals or {}
+        self.links: Dict[Hashable, object] = {}
+        self.devices: List[Device] = []
+        self.values: Dict[str, Dict[str, object]] = {}
+        self.stale_polls = stale_polls
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.quality: Dict[str, Dict[str, str]] = {}
+        self._read_at: Dict[str, Dict[str, float]] = {}
+        self._tasks: Optional[Dict[Tuple[str, str], asyncio.Task]] = None
+        self._failed: Optional[asyncio.Future] = None
+
+    def add_link(self, link: Hashable, client) -> None:
+        """also replaces the client of a link, e.g. after the serial settings changed"""
+        self.links[link] = client
+
+    def set_plans(self, plans: Dict[str, List[ReadBlock]]) -> None:
+        """Switch to the read plans of another register map."""
+        names = {s.name for plan in plans.values() for block in plan for s in block.signals}
+        self.decoders = {c: PlanDecoder(p) for c, p in plans.items()}
+        self.plans = plans
+        for state in (*self.values.values(), *self.quality.values(), *self._read_at.values()):
+            for name in [n for n in state if n not in names]:
+                del state[name]
+        if self._tasks is None:
+            return
+        for key in [k for k in self._tasks if k[1] not in plans]:
+            self._tasks.pop(key).cancel()
+        for device in self.devices:
+            for pollclass in plans:
+                if (device.name, pollclass) not in self._tasks:
+                    self._start(device, pollclass)
+
+    def set_device(self, device: Device) -> None:
+        """Replace the device of the same name, e.g. with a new slave id."""
+        index = next(i for i, d in enumerate(self.devices) if d.name == device.name)
+        if device.link not in self.links:
+            raise KeyError(f"No client for link {device.link} of device {device.name}")
+        self.devices[index] = device
+        if self._tasks is None:
+            return
+        for pollclass in self.plans:
+            task = self._tasks.pop((device.name, pollclass), None)
+            if task is not None:
+                task.cancel()
+            self._start(device, pollclass)
+
+    def add_device(self, device: Device) -> None:
+        if device.link not in self.links:
+            raise KeyError(f"No client for link {device.link} of device {device.name}")
+        self.devices.append(device)
+        self.values[device.name] = {}
+        self.quality[device.name] = {}
+        self._read_at[device.name] = {}
+        self.breakers[device.name] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+
+    def interval(self, device: Device, pollclass: str) -> float:
+        if pollclass == "normal":
+            return device.interval
+        return self.intervals.get(pollclass, device.interval)
+
+    async def poll(self, device: Device, pollclass: str) -> Dict[str, object]:
+        client = self.links[device.link]
+        # taken together, so a plan swapped in mid-read can't meet the old decoder
+        plan, decoder = self.plans[pollclass], self.decoders[pollclass]
+        breaker = self.breakers[device.name]
+        loop = asyncio.get_running_loop()
+        if not breaker.allow(loop.time()):
+            POLLS_SKIPPED.labels(device.name).inc()
+            return decoder.decode([None] * len(plan))
+        start = loop.time()
+        try:
+            results = await asyncio.wait_for(
+                read_plan(client, plan, slave=device.slave), device.timeout
+            )
+        except (asyncio.TimeoutError, ModbusException, OSError) as e:
+            # this device's poll only: the group, and every other device, carry on
+            POLL_FAILURES.labels(device.name, pollclass).inc()
+            log.warning("%s: %s poll failed: %r", device.name, pollclass, e)
+            if breaker.failure(loop.time()):
+                log.warning("%s: %d polls failed, trying it every %ss", device.name, breaker.failures, breaker.cooldown)
+            return decoder.decode([None] * len(plan))
+        POLL_SECONDS.labels(device.name, pollclass).observe(loop.time() - start)
+        # an exception response still means the device is there
+        if breaker.open:
+            log.info("%s: answering again", device.name)
+        breaker.success()
+        return decoder.decode(results)
+
+    def _merge(self, device: Device, pollclass: str, values: Dict[str, object]) -> None:
+        latest, quality, read_at = self.values[device.name], self.quality[device.name], self._read_at[device.name]
+        now = asyncio.get_running_loop().time()
+        hold = self.stale_polls * self.interval(device, pollclass)
+        for name, v in values.items():
+            if v is not None:
+                latest[name], quality[name], read_at[name] = v, GOOD, now
+            elif now - read_at.get(name, -math.inf) <= hold:
+                quality[name] = STALE
+            else:
+                latest[name], quality[name] = None, COMM_ERROR
+
+    async def _run_group(self, device: Device, pollclass: str) -> None:
+        latest = self.values[device.name]
+        handling = SAMPLE_SECONDS.labels(device.name)
+        async for _ in every(self.interval(device, pollclass)):
+            self._merge(device, pollclass, await self.poll(device, pollclass))
+            quality = worst(self.quality[device.name].values())
+            SAMPLES.labels(device.name, quality).inc()
+            with handling.time():
+                await self.on_sample(device, {**latest, "quality": quality})
+            log.debug("%s: %s poll done, %d values, %s", device.name, pollclass, len(latest), quality)
+
+    def _start(self, device: Device, pollclass: str) -> None:
+        task = asyncio.ensure_future(self._run_group(device, pollclass))
+        task.add_done_callback(self._done)
+        self._tasks[(device.name, pollclass)] = task
+
+    def _done(self, task: asyncio.Task) -> None:
+        # a group that fails stops the engine, as it would in a gather
+        if not task.cancelled() and task.exception() is not None and not self._failed.done():
+            self._failed.set_exception(task.exception())
+
+    async def run(self) -> None:
+        if not self.devices:
+            raise RuntimeError("No devices to poll")
+        self._tasks = {}
+        self._failed = asyncio.get_running_loop().create_future()
+        for d in self.devices:
+            for c in self.plans:
+                self._start(d, c)
+        try:
+            await self._failed
+        finally:
+            tasks, self._tasks = self._tasks, None
+            for task in tasks.values():
+                task.cancel()
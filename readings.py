@@ -0,0 +1,143 @@
+import json
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from genstate import OFF_LEVEL
+from readplanner import ReadBlock, Signal
+from regdecoder import BlockDecoder
+
+GENS = ("gen1", "gen2", "gen3")
+
+# one row per device and sample, one typed column per register-map signal
+# (added by ensure_sample_table); tpmsignal is the local copy of the map
+# that tells readers which column holds which parameter
+SAMPLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tpmsample (
+    device text NOT NULL,
+    ts timestamptz NOT NULL,
+    gen1 boolean,
+    gen2 boolean,
+    gen3 boolean,
+    quality text,
+    PRIMARY KEY (device, ts)
+);
+CREATE INDEX IF NOT EXISTS tpmsample_ts_idx ON tpmsample (ts);
+CREATE TABLE IF NOT EXISTS tpmsignal (
+    address integer PRIMARY KEY,
+    col text NOT NULL UNIQUE,
+    parameter text NOT NULL,
+    datatype text NOT NULL,
+    multiplier double precision NOT NULL,
+    unit text NOT NULL
+);
+"""
+
+
+def column(signal: Signal) -> str:
+    return f"s{signal.address}"
+
+
+def column_type(signal: Signal) -> str:
+    # unscaled integers (the energy counters) stay exact, the rest are scaled floats
+    if signal.multiplier == 1 and signal.datatype != "float32":
+        return "bigint"
+    return "double precision"
+
+
+async def ensure_sample_table(conn, signals: Sequence[Signal]) -> None:
+    await conn.execute(SAMPLE_SCHEMA)
+    # worst quality among the row's values, see transport.GOOD / STALE / COMM_ERROR
+    await conn.execute("ALTER TABLE tpmsample ADD COLUMN IF NOT EXISTS quality text")
+    for s in signals:
+        await conn.execute(f"ALTER TABLE tpmsample ADD COLUMN IF NOT EXISTS {column(s)} {column_type(s)}")
+    await conn.executemany("""
+        INSERT INTO tpmsignal (address, col, parameter, datatype, multiplier, unit)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (address) DO UPDATE SET
+            parameter = excluded.parameter,
+            datatype = excluded.datatype,
+            multiplier = excluded.multiplier,
+            unit = excluded.unit
+    """, [(s.address, column(s), s.name, s.datatype, s.multiplier, s.unit) for s in signals])
+
+
+class SampleWriter:
+    """Turns a live payload into a tpmsample row."""
+
+    def __init__(self, signals: Sequence[Signal]):
+        self.signals = list(signals)
+        self.columns = ["device", "ts", *GENS, "quality", *(column(s) for s in self.signals)]
+        self._ints = [column_type(s) == "bigint" for s in self.signals]
+        # stable across restarts: tells rows of this column layout from those of another map
+        self.layout = zlib.crc32(" ".join(self.columns).encode())
+        placeholders = ", ".join(f"${i}" for i in range(1, len(self.columns) + 1))
+        self.insert = (
+            f"INSERT INTO tpmsample ({', '.join(self.columns)}) VALUES ({placeholders}) "
+            "ON CONFLICT (device, ts) DO NOTHING"
+        )
+
+    def row(self, device: str, ts: datetime, values: Dict[str, object]) -> tuple:
+        gens = [None if values.get(g) is None else values[g] != OFF_LEVEL for g in GENS]
+        readings = []
+        for s, is_int in zip(self.signals, self._ints):
+            v = values.get(s.name)
+            readings.append(None if v is None else int(v) if is_int else float(v))
+        return (device, ts, *gens, values.get("quality"), *readings)
+
+    async def write(self, conn, device: str, ts: datetime, values: Dict[str, object]) -> None:
+        await conn.execute(self.insert, *self.row(device, ts, values))
+
+
+def _legacy_registers(signal: Signal, v) -> Optional[List[int]]:
+    # tpmreading stored 16-bit values scaled (signed ones as their unsigned
+    # word), as strings, and 32-bit values as the unsigned, unscaled register
+    # pair; turn them back into register words for the live decoder
+    if v is None or v == "":
+        return None
+    v = float(v)
+    if signal.width == 1:
+        return [round(v / signal.multiplier) & 0xFFFF]
+    raw = int(v) & 0xFFFFFFFF
+    return [raw >> 16, raw & 0xFFFF]
+
+
+async def migrate_tpmreading(conn, signals: Sequence[Signal], batch: int = 5000) -> int:
+    """
+    One-time copy of the JSON rows in tpmreading into tpmsample, decoded
+    with the same sign and scaling rules as live reads.
+    returns: number of rows copied
+    """
+    writer = SampleWriter(signals)
+    decoders = {s.name: BlockDecoder(ReadBlock(s.address, s.width, (s,))) for s in signals
+                if s.width <= 2 and s.datatype != "float32"}
+    copied = 0
+    # keyset on (timestamp, ctid): rows of several devices can share a timestamp
+    last = (None, None)
+    while True:
+        rows = await conn.fetch(
+            "select data, timestamp, ctid from tpmreading "
+            "where $1::timestamptz is null or (timestamp, ctid) > ($1, $2::tid) "
+            "order by timestamp, ctid limit $3",
+            *last, batch,
+        )
+        if not rows:
+            return copied
+        records: List[tuple] = []
+        for r in rows:
+            data = r["data"]
+            payload = json.loads(data) if isinstance(data, str) else dict(data or {})
+            values = {}
+            for s in signals:
+                decoder = decoders.get(s.name)
+                v = payload.get(s.name)
+                if decoder is None:
+                    values[s.name] = None if v is None or v == "" else float(v)
+                else:
+                    registers = _legacy_registers(s, v)
+                    values[s.name] = None if registers is None else decoder.decode(registers)[s.name]
+            values.update({g: payload.get(g) for g in GENS})
+            records.append(writer.row(payload.get("device") or "tpm", r["timestamp"], values))
+        await conn.executemany(writer.insert, records)
+        copied += len(records)
+        last = (rows[-1]["timestamp"], rows[-1]["ctid"])
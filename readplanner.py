@@ -0,0 +1,158 @@
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+# Modbus caps a single read_holding_registers request at 125 registers
+MAX_READ_COUNT = 125
+
+# number of 16-bit registers each datatype occupies
+REGISTER_WIDTH = {
+    "uint16": 1,
+    "int16": 1,
+    "uint32": 2,
+    "int32": 2,
+    "float32": 2,
+    "uint64": 4,
+    "int64": 4,
+}
+
+# poll-rate classes a signal can be assigned to on the tpm table
+POLL_CLASSES = ("fast", "normal", "slow")
+
+# column order of tpmrows.tpm_registers tuples
+_TUPLE_FIELDS = ("enabled", "address", "parameter", "datatype", "readwrite", "multiplier", "unit", "pollclass", "deadband")
+
+
+class Signal(NamedTuple):
+    address: int
+    name: str
+    datatype: str
+    multiplier: float
+    unit: str
+    pollclass: str = "normal"
+    # smallest change pushed to live clients; 0 pushes every change
+    deadband: float = 0.0
+
+    @property
+    def width(self) -> int:
+        return REGISTER_WIDTH[self.datatype]
+
+    @property
+    def end(self) -> int:
+        # first address after this signal
+        return self.address + self.width
+
+
+class ReadBlock(NamedTuple):
+    start: int
+    count: int
+    signals: tuple
+
+    @property
+    def end(self) -> int:
+        return self.start + self.count
+
+
+def load_signals(rows: Iterable[Any]) -> List[Signal]:
+    """
+    rows: `tpm` table records (asyncpg.Record / dict) or tpmrows.tpm_registers tuples
+    returns: enabled, readable signals sorted by address
+    """
+    signals: List[Signal] = []
+    for r in rows:
+        if hasattr(r, "keys"):
+            row = {k: r[k] for k in r.keys()}
+        else:
+            row = dict(zip(_TUPLE_FIELDS, r))
+
+        if not row.get("enabled", True):
+            continue
+        if "R" not in str(row.get("readwrite") or "R").upper():
+            continue
+        datatype = str(row["datatype"]).strip().lower()
+        if datatype not in REGISTER_WIDTH:
+            raise ValueError(f"Unsupported datatype {datatype!r} at address {row['address']}")
+        pollclass = str(row.get("pollclass") or "normal").strip().lower()
+        if pollclass not in POLL_CLASSES:
+            raise ValueError(f"Unknown poll class {pollclass!r} at address {row['address']}")
+
+        signals.append(Signal(
+            address=int(row["address"]),
+            name=str(row["parameter"]),
+            datatype=datatype,
+            # multiplier is stored as text in the tpm table
+            multiplier=float(row.get("multiplier") or 1),
+            unit=str(row.get("unit") or ""),
+            pollclass=pollclass,
+            deadband=float(row.get("deadband") or 0),
+        ))
+
+    signals.sort(key=lambda s: s.address)
+    return signals
+
+
+def plan_reads(
+    signals: Iterable[Signal],
+    max_gap: int = 32,
+    max_count: int = MAX_READ_COUNT,
+) -> List[ReadBlock]:
+    """
+    Merge signals into the fewest holding-register reads.
+
+    Two neighbouring signals share a read when the unused registers between
+    them are at most `max_gap` and the merged read stays within `max_count`.
+    Set `max_gap=0` for devices that reject reads spanning unmapped addresses.
+    """
+    if max_gap < 0:
+        raise ValueError("max_gap must be >= 0")
+    if not 1 <= max_count <= MAX_READ_COUNT:
+        raise ValueError(f"max_count must be between 1 and {MAX_READ_COUNT}")
+
+    blocks: List[ReadBlock] = []
+    start: Optional[int] = None
+    end = 0
+    members: List[Signal] = []
+
+    for s in sorted(signals, key=lambda s: s.address):
+        if s.width > max_count:
+            raise ValueError(f"{s.name} does not fit in a {max_count} register read")
+        if start is not None and s.address - end <= max_gap and max(end, s.end) - start <= max_count:
+            end = max(end, s.end)
+            members.append(s)
+            continue
+        if start is not None:
+            blocks.append(ReadBlock(start, end - start, tuple(members)))
+        start, end, members = s.address, s.end, [s]
+
+    if start is not None:
+        blocks.append(ReadBlock(start, end - start, tuple(members)))
+    return blocks
+
+
+def plan_groups(signals: Iterable[Signal], max_gap: int = 32, max_count: int = MAX_READ_COUNT) -> Dict[str, List[ReadBlock]]:
+    """
+    Plan each poll class separately so slow registers never ride along
+    with fast reads.
+    returns: {pollclass: read plan}, only for classes that have signals
+    """
+    by_class: Dict[str, List[Signal]] = {}
+    for s in signals:
+        by_class.setdefault(s.pollclass, []).append(s)
+    return {
+        c: plan_reads(by_class[c], max_gap, max_count)
+        for c in POLL_CLASSES if c in by_class
+    }
+
+
+async def read_plan(client, plan: List[ReadBlock], **kwargs) -> List[Optional[list]]:
+    """
+    Issue one read_holding_registers per block.
+    kwargs are passed through to the client (e.g. slave=SLAVE_ID).
+    returns: raw registers per block in plan order, None where the read failed
+    """
+    results: List[Optional[list]] = []
+    for block in plan:
+        rr = await client.read_holding_registers(block.start, block.count, **kwargs)
+        if rr.isError() or len(getattr(rr, "registers", [])) < block.count:
+            results.append(None)
+        else:
+            results.append(rr.registers[:block.count])
+    return results
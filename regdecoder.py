@@ -0,0 +1,90 @@
+import math
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence, Union
+
+from readplanner import ReadBlock
+
+Number = Union[int, float]
+
+# big-endian struct codes; multi-register values are sent high word first
+STRUCT_CODES = {
+    "uint16": "H",
+    "int16": "h",
+    "uint32": "I",
+    "int32": "i",
+    "float32": "f",
+    "uint64": "Q",
+    "int64": "q",
+}
+
+_SWAP = sys.byteorder == "little"
+
+
+def _digits(multiplier: float) -> int:
+    # decimals worth keeping after scaling: 0.1 -> 1, 0.001 -> 3, 1 -> 0
+    if multiplier <= 0 or multiplier >= 1:
+        return 0
+    return max(0, math.ceil(-math.log10(multiplier) - 1e-9))
+
+
+class BlockDecoder:
+    """
+    Decodes the registers of one ReadBlock into scaled values.
+
+    The block layout is compiled once into a single struct format where
+    unmapped registers are pad bytes, so one unpack call yields every
+    signal of the block already sign-extended and word-combined.
+    """
+
+    def __init__(self, block: ReadBlock):
+        fmt = [">"]
+        pos = block.start
+        for s in block.signals:
+            if s.address < pos:
+                raise ValueError(f"{s.name} overlaps the previous signal at {s.address}")
+            if s.address > pos:
+                fmt.append(f"{(s.address - pos) * 2}x")
+            fmt.append(STRUCT_CODES[s.datatype])
+            pos = s.end
+        if pos < block.end:
+            fmt.append(f"{(block.end - pos) * 2}x")
+
+        self.block = block
+        self.names = tuple(s.name for s in block.signals)
+        self._struct = struct.Struct("".join(fmt))
+        self._scales = tuple(
+            (None if s.multiplier == 1 else s.multiplier, _digits(s.multiplier))
+            for s in block.signals
+        )
+
+    def decode(self, registers: Sequence[int]) -> Dict[str, Number]:
+        words = array("H", registers)
+        if _SWAP:
+            words.byteswap()
+        raw = self._struct.unpack(words.tobytes())
+        return {
+            name: v if m is None else round(v * m, d)
+            for name, v, (m, d) in zip(self.names, raw, self._scales)
+        }
+
+
+class PlanDecoder:
+    """Decoders for every block of a read plan."""
+
+    def __init__(self, plan: List[ReadBlock]):
+        self.blocks = [BlockDecoder(b) for b in plan]
+
+    def decode(self, results: Sequence[Optional[Sequence[int]]]) -> Dict[str, Optional[Number]]:
+        """
+        results: raw registers per block, in plan order (None for a failed read)
+        returns: {signal name: scaled value}; signals of failed blocks map to None
+        """
+        values: Dict[str, Optional[Number]] = {}
+        for decoder, registers in zip(self.blocks, results):
+            if registers is None:
+                values.update(dict.fromkeys(decoder.names))
+            else:
+                values.update(decoder.decode(registers))
+        return values
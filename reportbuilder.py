@@ -0,0 +1,287 @@
+import re
+from datetime import datetime, timedelta, tzinfo
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+from export import column_widths
+from rollups import TIERS, bucket_start, is_counter
+
+AGGREGATES = ("avg", "min", "max", "p95", "delta")
+
+_BUCKET_RE = re.compile(r"^(\d+)\s*(m|h|d)$")
+_BUCKET_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def parse_bucket(text: str) -> int:
+    """"15m", "8h", "1d" -> seconds"""
+    m = _BUCKET_RE.match(str(text).strip().lower())
+    if not m or int(m.group(1)) == 0:
+        raise ValueError(f"Invalid bucket: {text}")
+    return int(m.group(1)) * _BUCKET_UNITS[m.group(2)]
+
+
+def parse_origin(text: str) -> int:
+    """"06:00" -> seconds after local midnight where buckets (shifts) start"""
+    try:
+        hours, minutes = (int(p) for p in str(text).split(":"))
+    except ValueError:
+        raise ValueError(f"Invalid bucket origin: {text}") from None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid bucket origin: {text}")
+    return hours * 3600 + minutes * 60
+
+
+class ReportSignal(NamedTuple):
+    col: str            # tpmsample column
+    name: str
+    address: int
+    unit: str
+
+
+class ReportSpec(NamedTuple):
+    signals: Sequence[ReportSignal]
+    aggs: Sequence[str]
+    bucket: int                     # seconds
+    origin: int = 0                 # seconds after local midnight
+    device: Optional[str] = None    # None: every device, each on its own
+
+    @property
+    def columns(self) -> List[Tuple[ReportSignal, str]]:
+        # deltas only make sense for the energy counters
+        return [
+            (s, agg) for s in self.signals for agg in self.aggs
+            if agg != "delta" or is_counter(s.unit)
+        ]
+
+
+def make_spec(catalog: Sequence[ReportSignal], signals: Sequence, aggs, bucket: str,
+              origin: str = "00:00", device: Optional[str] = None) -> ReportSpec:
+    """
+    catalog: every known signal (tpmsignal)
+    signals: parameter names or register addresses
+    raises: ValueError for anything unknown
+    """
+    by_name = {s.name: s for s in catalog}
+    by_address = {s.address: s for s in catalog}
+    picked = []
+    for wanted in signals:
+        s = by_address.get(wanted) if isinstance(wanted, int) else by_name.get(wanted)
+        if s is None:
+            raise ValueError(f"Unknown signal: {wanted}")
+        picked.append(s)
+    if not picked:
+        raise ValueError("No signals selected")
+    aggs = [aggs] if isinstance(aggs, str) else list(aggs)
+    for agg in aggs:
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregation: {agg}")
+    return ReportSpec(picked, aggs, parse_bucket(bucket), parse_origin(origin), device)
+
+
+def source_tier(spec: ReportSpec, fromm: datetime, to: datetime, tz: tzinfo) -> Optional[str]:
+    """
+    Coarsest rollup tier whose buckets tile both the report buckets and the
+    range exactly, or None when the raw samples are needed (p95, buckets
+    finer than 1m, or a range that starts or ends mid-minute).
+    """
+    if "p95" in spec.aggs:
+        return None
+    for tier, seconds in reversed(list(TIERS.items())):
+        if (spec.bucket % seconds == 0 and spec.origin % seconds == 0
+                and bucket_start(fromm, seconds, tz) == fromm and bucket_start(to, seconds, tz) == to):
+            return tier
+    return None
+
+
+# report buckets, aligned in local time like the rollup tiers
+_BIN = "date_bin(make_interval(secs => %(bucket)s), {ts} AT TIME ZONE %(zone)s, %(origin)s) AT TIME ZONE %(zone)s"
+
+
+def _raw_query(spec: ReportSpec) -> str:
+    cols = list(dict.fromkeys(s.col for s in spec.signals))
+    counters = list(dict.fromkeys(s.col for s, agg in spec.columns if agg == "delta"))
+    exprs = []
+    for s, agg in spec.columns:
+        exprs.append({
+            "avg": f"avg({s.col})",
+            "min": f"min({s.col})",
+            "max": f"max({s.col})",
+            "p95": f"percentile_cont(0.95) WITHIN GROUP (ORDER BY {s.col})",
+            "delta": f"sum({s.col}_delta)",
+        }[agg] + "::double precision")
+    inside = f"""
+            SELECT device, ts, {", ".join(cols)}
+            FROM tpmsample
+            WHERE ts >= %(from)s AND ts < %(to)s
+              AND (%(device)s::text IS NULL OR device = %(device)s)
+    """
+    if not counters:
+        source = inside
+    else:
+        # counter increments between consecutive readings, a reset counts as 0.
+        # A failed read (NULL) is skipped, so the reading after it carries the
+        # whole gap, and each device starts from its last reading before the
+        # range (a row with a NULL ts), so the step into the range counts too
+        seeds = [
+            f"(SELECT {c} FROM tpmsample p WHERE p.device = d.device AND p.ts < %(from)s "
+            f"AND {c} IS NOT NULL ORDER BY p.ts DESC LIMIT 1)" if c in counters else "NULL"
+            for c in cols
+        ]
+        window = "PARTITION BY device ORDER BY ts NULLS FIRST"
+        # c_n numbers the readings of c; a NULL shares the group of the reading before it
+        numbered = ", ".join(f"count({c}) OVER ({window}) AS {c}_n" for c in counters)
+        held = ", ".join(
+            f"first_value({c}) OVER (PARTITION BY device, {c}_n ORDER BY ts NULLS FIRST) AS {c}_held"
+            for c in counters
+        )
+        deltas = ", ".join(f"greatest({c} - lag({c}_held) OVER ({window}), 0) AS {c}_delta" for c in counters)
+        source = f"""
+            WITH inside AS ({inside}), seeded AS (
+                SELECT * FROM inside
+                UNION ALL
+                SELECT d.device, NULL, {", ".join(seeds)}
+                FROM (SELECT DISTINCT device FROM inside) d
+            ), numbered AS (
+                SELECT *, {numbered} FROM seeded
+            ), held AS (
+                SELECT *, {held} FROM numbered
+            )
+            SELECT *, {deltas} FROM held
+        """
+    return f"""
+        WITH s AS (
+            SELECT *, {_BIN.format(ts="ts")} AS period
+            FROM ({source}) r
+            WHERE ts IS NOT NULL
+        )
+        SELECT period, device, {", ".join(exprs)}
+        FROM s
+        GROUP BY period, device
+        ORDER BY period, device
+    """
+
+
+def _rollup_query(spec: ReportSpec, tier: str) -> str:
+    addresses = ", ".join(str(int(s.address)) for s in dict.fromkeys(spec.signals))
+    exprs = []
+    for s, agg in spec.columns:
+        pick = f"FILTER (WHERE address = {int(s.address)})"
+        exprs.append({
+            "avg": f"sum(sum) {pick} / sum(n) {pick}",
+            "min": f"min(min) {pick}",
+            "max": f"max(max) {pick}",
+            "delta": f"sum(delta) {pick}",
+        }[agg] + "::double precision")
+    # the last bucket before the range (n is NULL) seeds each series, so the
+    # step from its last reading into the first bucket counts
+    return f"""
+        WITH inside AS (
+            SELECT device, bucket, address, n, sum, min, max, first, last
+            FROM tpmrollup_{tier}
+            WHERE bucket >= %(from)s AND bucket < %(to)s
+              AND (%(device)s::text IS NULL OR device = %(device)s)
+              AND address IN ({addresses})
+        ), seeded AS (
+            SELECT * FROM inside
+            UNION ALL
+            SELECT k.device, p.bucket, k.address, NULL, NULL, NULL, NULL, p.last, p.last
+            FROM (SELECT DISTINCT device, address FROM inside) k
+            CROSS JOIN LATERAL (
+                SELECT bucket, last FROM tpmrollup_{tier}
+                WHERE device = k.device AND address = k.address AND bucket < %(from)s
+                ORDER BY bucket DESC LIMIT 1
+            ) p
+        ), r AS (
+            SELECT device, {_BIN.format(ts="bucket")} AS period, address, n, sum, min, max,
+                   greatest(last - lag(last, 1, first) OVER (PARTITION BY device, address ORDER BY bucket), 0) AS delta
+            FROM seeded
+        )
+        SELECT period, device, {", ".join(exprs)}
+        FROM r
+        WHERE n IS NOT NULL
+        GROUP BY period, device
+        ORDER BY period, device
+    """
+
+
+class ReportData(NamedTuple):
+    periods: np.ndarray                         # bucket start per row (datetime)
+    devices: np.ndarray                         # device per row
+    values: Dict[Tuple[str, str], np.ndarray]   # (signal name, agg) -> float per row, nan if empty
+    tier: Optional[str]                         # rollup tier it was computed from, None for raw
+
+
+def fetch_report(cursor, spec: ReportSpec, fromm: datetime, to: datetime, zone: str = "Europe/Istanbul") -> ReportData:
+    """One aggregate query; rows come back already bucketed, one per period and device."""
+    tier = source_tier(spec, fromm, to, ZoneInfo(zone))
+    sql = _rollup_query(spec, tier) if tier else _raw_query(spec)
+    cursor.execute(sql, {
+        "from": fromm, "to": to, "device": spec.device, "zone": zone,
+        "bucket": spec.bucket, "origin": datetime(2000, 1, 1) + timedelta(seconds=spec.origin),
+    })
+    rows = cursor.fetchall()
+    table = np.array(rows, dtype=object).reshape(len(rows), 2 + len(spec.columns))
+    values = {}
+    for i, (s, agg) in enumerate(spec.columns):
+        col = table[:, 2 + i]
+        values[(s.name, agg)] = np.where(col == None, np.nan, col).astype(float)  # noqa: E711
+    return ReportData(table[:, 0], table[:, 1], values, tier)
+
+
+def summarize(data: ReportData, spec: ReportSpec) -> List[list]:
+    """
+    returns: [signal, aggregation, device, total, min, max, mean] per series;
+      total is the summed consumption for "delta", empty otherwise
+    """
+    summary = []
+    for device in dict.fromkeys(data.devices):
+        rows = data.devices == device
+        for s, agg in spec.columns:
+            v = data.values[(s.name, agg)][rows]
+            v = v[~np.isnan(v)]
+            if not len(v):
+                summary.append([s.name, agg, device, None, None, None, None])
+                continue
+            total = float(v.sum()) if agg == "delta" else None
+            summary.append([s.name, agg, device, total, float(v.min()), float(v.max()), float(v.mean())])
+    return summary
+
+
+def series_label(signal: ReportSignal, agg: str) -> str:
+    return f"{signal.name} ({agg}, {signal.unit})"
+
+
+def write_report_xlsx(path: str, data: ReportData, spec: ReportSpec, to_local) -> None:
+    """
+    Two sheets: one row per period and device with every aggregated series,
+    and a summary per series.
+    to_local: datetime -> naive local datetime for the cells
+    """
+    wb = Workbook(write_only=True)
+    header = ["period", "device"] + [series_label(s, agg) for s, agg in spec.columns]
+    columns = [data.values[(s.name, agg)] for s, agg in spec.columns]
+    rows = [
+        [to_local(data.periods[i]), data.devices[i], *(None if np.isnan(c[i]) else float(c[i]) for c in columns)]
+        for i in range(len(data.periods))
+    ]
+    ws = wb.create_sheet("Report")
+    for idx, width in enumerate(column_widths(header, rows[:500]), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+
+    summary_header = ["signal", "aggregation", "device", "total", "min", "max", "mean"]
+    summary = summarize(data, spec)
+    ws = wb.create_sheet("Summary")
+    for idx, width in enumerate(column_widths(summary_header, summary), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+    ws.append(summary_header)
+    for row in summary:
+        ws.append(row)
+    wb.save(path)
+
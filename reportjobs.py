@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+# a builder writes the report to the path it is given
+Builder = Callable[[str], object]
+
+
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+
+def _green() -> bool:
+    """True under gevent (serve.py), where threading means greenlets"""
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def _native(name: str):
+    # threading's own Lock / Event even under gevent: jobs finish on real
+    # threads, and gevent's primitives don't reliably wake a greenlet from one
+    return monkey.get_original("threading", name) if _green() else getattr(threading, name)
+
+
+def _executor(workers: int):
+    # under gevent a PDF or workbook build never yields: give the builds
+    # gevent's pool of real threads so they don't stall every other request
+    if _green():
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+
+
+class ReportJob:
+    def __init__(self, job_id: str, key: str, path: Path):
+        self.id = job_id
+        self.key = key
+        self.path = path
+        self.status = "queued"      # queued, running, done, failed
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.ready = _native("Event")()
+
+    def as_dict(self) -> dict:
+        return {
+            "job": self.id,
+            "status": self.status,
+            "error": self.error,
+            "file": self.path.name if self.status == "done" else None,
+        }
+
+
+def cache_key(params: dict) -> str:
+    """stable hash of the report parameters, including the data watermark"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+
+class ReportJobs:
+    """
+    Builds reports on a small thread pool and keeps the results in
+    `directory` as a cache: a job whose key matches a file that is already
+    there is done immediately, and one matching a job still in flight
+    shares it. evict() keeps the directory under `max_bytes` and drops
+    files older than `max_age` seconds, least recently served first.
+    """
+
+    def __init__(self, directory: str, workers: int = 2, max_bytes: int = 200 << 20, max_age: float = 7 * 86400):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._pool = _executor(workers)
+        self._lock = _native("Lock")()
+        self._jobs: Dict[str, ReportJob] = {}
+        self._inflight: Dict[str, ReportJob] = {}
+
+    def submit(self, key: str, ext: str, build: Builder) -> ReportJob:
+        path = self.dir / f"tpm_report_{key}.{ext}"
+        with self._lock:
+            self._forget_finished()
+            job = self._inflight.get(key)
+            if job is not None:
+                return job
+            job = ReportJob(uuid.uuid4().hex, key, path)
+            self._jobs[job.id] = job
+            if path.exists():
+                # cache hit: touch it so eviction treats it as recently used
+                os.utime(path)
+                job.status, job.finished = "done", time.time()
+                job.ready.set()
+                return job
+            self._inflight[key] = job
+        # outside the lock: gevent's pool makes submit wait while every worker is busy
+        self._pool.submit(self._run, job, build)
+        return job
+
+    def _run(self, job: ReportJob, build: Builder) -> None:
+        job.status = "running"
+        part = job.path.with_name(job.path.name + ".part")
+        try:
+            build(str(part))
+            os.replace(part, job.path)
+            job.status = "done"
+        except Exception as e:
+            job.status, job.error = "failed", repr(e)
+            part.unlink(missing_ok=True)
+            print(f"Report {job.path.name} failed: {e!r}")
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._inflight.pop(job.key, None)
+            job.ready.set()
+        self.evict(keep=job.path)
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        return self._jobs.get(job_id)
+
+    def wait(self, job: ReportJob, timeout: Optional[float] = None) -> ReportJob:
+        if not _green():
+            job.ready.wait(timeout)
+            return job
+        # a greenlet can't block on a real Event without stalling all the others
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not job.ready.is_set() and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.05)
+        return job
+
+    def _forget_finished(self, keep_for: float = 3600) -> None:
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values() if j.finished and now - j.finished > keep_for]:
+            del self._jobs[job_id]
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """returns: number of files removed"""
+        now = time.time()
+        files = []
+        for p in self.dir.iterdir():
+            if not p.is_file() or p.suffix == ".part" or p == keep:
+                continue
+            st = p.stat()
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, p in files:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,107 @@
+import math
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    The last `capacity` rows of a device's channels: a timestamp and one
+    float per channel, in preallocated arrays, so memory never grows.
+    Changes within `min_step` seconds of the newest row's start update
+    that row instead of adding one, which keeps the covered span at least
+    capacity * min_step seconds however often values change.
+    """
+
+    def __init__(self, capacity: int, width: int, min_step: float = 0.0):
+        self.capacity = capacity
+        self.min_step = min_step
+        self.t = np.full(capacity, np.nan)
+        self.v = np.full((capacity, width), np.nan)
+        self.current = np.full(width, np.nan)    # the row being held, updated by channel
+        self._next = 0                          # rows ever written
+        self._opened = -math.inf                # when the newest row was started
+
+    def update(self, ids: Sequence[int], values: Sequence) -> None:
+        for i, v in zip(ids, values):
+            self.current[i] = v if isinstance(v, (int, float)) else np.nan
+
+    def append(self, ts: float) -> None:
+        """stores `current` as the row at `ts`"""
+        if ts - self._opened < self.min_step:
+            slot = (self._next - 1) % self.capacity
+        else:
+            slot = self._next % self.capacity
+            self._next += 1
+            self._opened = ts
+        self.t[slot] = ts
+        self.v[slot] = self.current
+
+    def window(self, since: float) -> Tuple[np.ndarray, np.ndarray]:
+        """rows at or after `since`, oldest first"""
+        count = min(self._next, self.capacity)
+        order = (np.arange(self._next - count, self._next)) % self.capacity
+        t = self.t[order]
+        keep = t >= since
+        return t[keep], self.v[order][keep]
+
+
+def decimate(t: np.ndarray, v: np.ndarray, points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    At most `points` rows: the mean of every channel over equal time bins,
+    timestamped at the bin's last row; empty bins are left out.
+    """
+    if len(t) <= points:
+        return t, v
+    edges = np.linspace(t[0], t[-1], points + 1)
+    bins = np.clip(np.searchsorted(edges, t, side="right") - 1, 0, points - 1)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(t)] - 1
+    valid = ~np.isnan(v)
+    sums = np.add.reduceat(np.where(valid, v, 0.0), starts)
+    counts = np.add.reduceat(valid, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return t[ends], means
+
+
+class LiveHistory:
+    """
+    A RingBuffer per device covering the last `minutes`, at most `rate`
+    rows a second, kept from the same frames the live hub passes on.
+    """
+
+    def __init__(self, minutes: float = 15, rate: float = 2):
+        self.minutes = minutes
+        self.rate = rate
+        self.width = 0
+        self.devices: Dict[str, RingBuffer] = {}
+
+    def reset(self, width: int) -> None:
+        """new schema: the old rows don't line up with the channels any more"""
+        self.width = width
+        self.devices = {}
+
+    def record(self, device: str, ts: float, ids: Sequence[int], values: Sequence) -> None:
+        ring = self.devices.get(device)
+        if ring is None:
+            capacity = max(1, math.ceil(self.minutes * 60 * self.rate))
+            ring = self.devices[device] = RingBuffer(capacity, self.width, 1 / self.rate)
+        ring.update(ids, values)
+        ring.append(ts)
+
+    def window(self, since: float, points: int, device: Optional[str] = None) -> Dict[str, dict]:
+        """
+        returns: {device: {"t": [epoch seconds], "values": [[per row] per channel]}},
+          null where a channel had no number
+        """
+        out = {}
+        for name, ring in self.devices.items():
+            if device is not None and name != device:
+                continue
+            t, v = decimate(*ring.window(since), points)
+            out[name] = {
+                "t": np.round(t, 3).tolist(),
+                "values": [[None if math.isnan(x) else x for x in col] for col in v.T.tolist()],
+            }
+        return out
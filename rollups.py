@@ -0,0 +1,258 @@
+import math
+from datetime import datetime, timezone, tzinfo
+from typing import Dict, Optional, Sequence, Tuple
+
+from readings import GENS, column
+from readplanner import Signal
+
+# rollup tiers and their bucket size in seconds, finest first
+TIERS = {
+    "1m": 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# per tier: one row per device, bucket and signal. avg is sum / n; first and
+# last (with their timestamps, so partial buckets merge correctly) give the
+# counter deltas for the 42xx energy registers
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tpmrollup_{tier} (
+    device text NOT NULL,
+    bucket timestamptz NOT NULL,
+    address integer NOT NULL,
+    n integer NOT NULL,
+    sum double precision NOT NULL,
+    min double precision NOT NULL,
+    max double precision NOT NULL,
+    first double precision NOT NULL,
+    first_ts timestamptz NOT NULL,
+    last double precision NOT NULL,
+    last_ts timestamptz NOT NULL,
+    PRIMARY KEY (device, bucket, address)
+);
+"""
+
+# merge a partial bucket into what is already stored
+UPSERT = """
+INSERT INTO tpmrollup_{tier} AS r (device, bucket, address, n, sum, min, max, first, first_ts, last, last_ts)
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+ON CONFLICT (device, bucket, address) DO UPDATE SET
+    n = r.n + excluded.n,
+    sum = r.sum + excluded.sum,
+    min = least(r.min, excluded.min),
+    max = greatest(r.max, excluded.max),
+    first = CASE WHEN excluded.first_ts < r.first_ts THEN excluded.first ELSE r.first END,
+    first_ts = least(r.first_ts, excluded.first_ts),
+    last = CASE WHEN excluded.last_ts > r.last_ts THEN excluded.last ELSE r.last END,
+    last_ts = greatest(r.last_ts, excluded.last_ts)
+"""
+
+Key = Tuple[str, str, datetime, int]     # tier, device, bucket, address
+
+
+def is_counter(unit: str) -> bool:
+    # energy registers (Wh, Varh, VAh) are running totals
+    return unit.endswith("h")
+
+
+def bucket_start(ts: datetime, seconds: int, tz: tzinfo) -> datetime:
+    # buckets are aligned to local time, so daily buckets start at local midnight
+    offset = ts.astimezone(tz).utcoffset().total_seconds()
+    local = ts.timestamp() + offset
+    return datetime.fromtimestamp(math.floor(local / seconds) * seconds - offset, timezone.utc)
+
+
+def pick_tier(span_seconds: float, max_points: int = 2000) -> Optional[str]:
+    """
+    Finest tier that still draws a range in at most `max_points` buckets.
+    returns: None when raw samples are fine, else the tier name
+    """
+    if span_seconds <= max_points * 2:
+        return None
+    for tier, seconds in TIERS.items():
+        if span_seconds / seconds <= max_points:
+            return tier
+    return "1d"
+
+
+async def ensure_rollup_tables(conn) -> None:
+    for tier in TIERS:
+        await conn.execute(ROLLUP_SCHEMA.format(tier=tier))
+
+
+# for a rebuilt range: what is computed from the samples replaces what was stored
+REPLACE = """
+ON CONFLICT (device, bucket, address) DO UPDATE SET
+    n = excluded.n, sum = excluded.sum, min = excluded.min, max = excluded.max,
+    first = excluded.first, first_ts = excluded.first_ts, last = excluded.last, last_ts = excluded.last_ts
+"""
+
+
+async def rebuild_rollups(conn, signals: Sequence[Signal], zone: str,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+    """
+    Backfill every tier from tpmsample: the 1m tier from the raw rows, each
+    coarser tier from the 1m buckets. Buckets are aligned in `zone` like
+    bucket_start() does.
+    since / until: only rebuild the buckets holding samples of [since, until),
+      from the samples before `until`, replacing the stored rows (rows
+      replayed from the spool after a restart, see Historian)
+    returns: number of 1m rows written
+    """
+    if since is None:
+        conflict, args = "ON CONFLICT DO NOTHING", (zone,)
+    else:
+        conflict, args = REPLACE, (zone, since, until)
+
+    def within(col: str, seconds: int) -> str:
+        if since is None:
+            return ""
+        start = f"date_bin('{seconds} seconds', $2 AT TIME ZONE $1, '2000-01-01') AT TIME ZONE $1"
+        return f"WHERE {col} >= {start} AND {col} < $3"
+
+    pairs = ", ".join(f"({s.address}, {column(s)}::double precision)" for s in signals)
+    status = await conn.execute(f"""
+        INSERT INTO tpmrollup_1m (device, bucket, address, n, sum, min, max, first, first_ts, last, last_ts)
+        SELECT device,
+               date_bin('60 seconds', ts AT TIME ZONE $1, '2000-01-01') AT TIME ZONE $1 AS bucket,
+               v.address, count(*), sum(v.value), min(v.value), max(v.value),
+               (array_agg(v.value ORDER BY ts))[1], min(ts),
+               (array_agg(v.value ORDER BY ts DESC))[1], max(ts)
+        FROM (SELECT * FROM tpmsample {within("ts", 60)}) s
+        CROSS JOIN LATERAL (VALUES {pairs}) AS v(address, value)
+        WHERE v.value IS NOT NULL
+        GROUP BY 1, 2, 3
+        {conflict}
+    """, *args)
+    for tier, seconds in TIERS.items():
+        if tier == "1m":
+            continue
+        await conn.execute(f"""
+            INSERT INTO tpmrollup_{tier} (device, bucket, address, n, sum, min, max, first, first_ts, last, last_ts)
+            SELECT device,
+                   date_bin('{seconds} seconds', bucket AT TIME ZONE $1, '2000-01-01') AT TIME ZONE $1,
+                   address, sum(n), sum(sum), min(min), max(max),
+                   (array_agg(first ORDER BY first_ts))[1], min(first_ts),
+                   (array_agg(last ORDER BY last_ts DESC))[1], max(last_ts)
+            FROM tpmrollup_1m
+            {within("bucket", seconds)}
+            GROUP BY 1, 2, 3
+            {conflict}
+        """, *args)
+    return int(status.split()[-1])
+
+
+class RollupAccumulator:
+    """
+    Keeps min/max/sum/first/last per device, bucket and signal for every
+    tier in memory and merges them into the rollup tables on flush(), so
+    the tables stay current without ever re-reading tpmsample.
+    """
+
+    def __init__(self, signals: Sequence[Signal], tz: tzinfo = timezone.utc):
+        self.tz = tz
+        self._stats: Dict[Key, list] = {}
+        self.set_signals(signals)
+
+    def set_signals(self, signals: Sequence[Signal]) -> None:
+        # buckets are keyed by address, so the ones already kept stay valid
+        self.addresses = [(s.name, s.address) for s in signals]
+
+    def add(self, device: str, ts: datetime, values: Dict[str, object]) -> None:
+        buckets = [(tier, bucket_start(ts, seconds, self.tz)) for tier, seconds in TIERS.items()]
+        for name, address in self.addresses:
+            v = values.get(name)
+            if v is None:
+                continue
+            v = float(v)
+            for tier, bucket in buckets:
+                key = (tier, device, bucket, address)
+                s = self._stats.get(key)
+                if s is None:
+                    self._stats[key] = [1, v, v, v, v, ts, v, ts]
+                    continue
+                s[0] += 1
+                s[1] += v
+                if v < s[2]:
+                    s[2] = v
+                if v > s[3]:
+                    s[3] = v
+                if ts < s[5]:
+                    s[4], s[5] = v, ts
+                if ts >= s[7]:
+                    s[6], s[7] = v, ts
+
+    def _merge_back(self, stats: Dict[Key, list]) -> None:
+        for key, old in stats.items():
+            new = self._stats.get(key)
+            if new is None:
+                self._stats[key] = old
+                continue
+            new[0] += old[0]
+            new[1] += old[1]
+            new[2] = min(new[2], old[2])
+            new[3] = max(new[3], old[3])
+            if old[5] < new[5]:
+                new[4], new[5] = old[4], old[5]
+            if old[7] > new[7]:
+                new[6], new[7] = old[6], old[7]
+
+    async def flush(self, conn) -> int:
+        """
+        Merge the buckets accumulated since the last flush into the tables.
+        returns: number of rows upserted
+        """
+        stats, self._stats = self._stats, {}
+        by_tier: Dict[str, Dict[Key, list]] = {}
+        for key, s in stats.items():
+            by_tier.setdefault(key[0], {})[key] = s
+        written = 0
+        for tier, tier_stats in list(by_tier.items()):
+            rows = [(device, bucket, address, *s) for (_, device, bucket, address), s in tier_stats.items()]
+            try:
+                await conn.executemany(UPSERT.format(tier=tier), rows)
+            except Exception:
+                # keep the tiers that were not written for the next flush
+                for pending in by_tier.values():
+                    self._merge_back(pending)
+                raise
+            del by_tier[tier]
+            written += len(rows)
+        return written
+
+
+def tier_select(tier: str, columns: Sequence[Tuple[str, int, str]]) -> str:
+    """
+    columns: (output column, address, unit) per signal
+    returns: SQL with %(from)s / %(to)s / %(device)s placeholders, laid out
+      like the tpmsample report query (bucket, device, gen1..gen3, one column
+      per signal) plus the per-bucket delta of every counter. Readings are
+      the bucket average, counters their last value, and a generator is on
+      when one of its gen_runs overlaps the bucket.
+    """
+    values, deltas = [], []
+    for col, address, unit in columns:
+        pick = f"FILTER (WHERE address = {int(address)})"
+        if is_counter(unit):
+            values.append(f"max(last) {pick} AS {col}")
+            deltas.append(f"max(delta) {pick} AS {col}_delta")
+        else:
+            values.append(f"max(sum / n) {pick} AS {col}")
+    period = f"tstzrange(bucket, bucket + interval '{TIERS[tier]} seconds')"
+    gens = [
+        f"EXISTS (SELECT 1 FROM gen_runs WHERE gen = '{g}' AND tstzrange(start, \"end\") && {period})"
+        for g in GENS
+    ]
+    return f"""
+        SELECT bucket, device, {", ".join(gens)},
+               {", ".join(values + deltas)}
+        FROM (
+            SELECT *, last - lag(last, 1, first) OVER (PARTITION BY device, address ORDER BY bucket) AS delta
+            FROM tpmrollup_{tier}
+            WHERE bucket BETWEEN %(from)s AND %(to)s
+              AND (%(device)s::text IS NULL OR device = %(device)s)
+        ) r
+        GROUP BY bucket, device
+        ORDER BY bucket DESC
+    """
@@ -0,0 +1,29 @@
+# Production server for the web app: gevent's WSGI server, a greenlet per
+# request, and psycopg2 waiting on the hub instead of blocking, so slow
+# queries and long downloads don't tie up a thread each. Run this on the
+# Pi instead of `python webapp.py`.
+from gevent import monkey
+
+monkey.patch_all()
+
+import psycogreen.gevent
+
+psycogreen.gevent.patch_psycopg()
+
+import os
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from webapp import app
+
+if __name__ == "__main__":
+    port = int(os.getenv("WEB_PORT", "3000"))
+    server = WSGIServer(
+        ("0.0.0.0", port),
+        app,
+        spawn=Pool(int(os.getenv("WEB_CONNECTIONS", "1000"))),
+        log=None,
+    )
+    print(f"Serving on :{port}")
+    server.serve_forever()
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+# every record: payload length, crc32 of the payload, pickled payload
+HEADER = struct.Struct(">II")
+
+Position = Tuple[int, int]      # segment number, byte offset
+
+
+def _scan(path: Path, offset: int) -> Iterator[Tuple[bytes, int]]:
+    """yields (payload, offset after it) until the end or the first torn/corrupt record"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            offset += HEADER.size + length
+            yield payload, offset
+
+
+class Spool:
+    """
+    Append-only on-disk queue between acquisition and the database.
+
+    append() only writes to the current segment file; the data is made
+    durable by run(), which fsyncs every `sync_interval` seconds. A reader
+    takes records from the committed position with read() and moves that
+    position with commit() once they are stored, so after a crash it
+    resumes from the last commit. Fully consumed segments are deleted,
+    and the oldest ones are dropped when the spool grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 << 20,
+        max_bytes: int = 512 << 20,
+        sync_interval: float = 1.0,
+    ):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.dropped_segments = 0
+        self._position = self._load_position()
+        segments = self._segments()
+        self._seq = max(segments[-1] if segments else 0, self._position[0])
+        path = self._path(self._seq)
+        if path.exists():
+            # cut a record torn by a crash, or appends would land behind it
+            start = self._position[1] if self._seq == self._position[0] else 0
+            end = start
+            for _, end in _scan(path, start):
+                pass
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        self._file = open(path, "ab")
+        self._dirty = False
+
+    def _path(self, seq: int) -> Path:
+        return self.dir / f"{seq:020d}.seg"
+
+    def _segments(self) -> List[int]:
+        return sorted(int(p.stem) for p in self.dir.glob("*.seg"))
+
+    def _load_position(self) -> Position:
+        try:
+            seq, offset = (self.dir / "position").read_text().split()
+            return int(seq), int(offset)
+        except (FileNotFoundError, ValueError):
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def append(self, record) -> None:
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        self._file.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._dirty = True
+        if self._file.tell() >= self.segment_bytes:
+            self._roll()
+
+    def _roll(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._seq += 1
+        self._file = open(self._path(self._seq), "ab")
+        self._dirty = False
+        self._trim()
+
+    def _trim(self) -> None:
+        segments = self._segments()
+        size = sum(self._path(s).stat().st_size for s in segments)
+        for seq in segments[:-1]:
+            if size <= self.max_bytes:
+                break
+            size -= self._path(seq).stat().st_size
+            self._path(seq).unlink()
+            self.dropped_segments += 1
+            if self._position[0] <= seq:
+                self._position = (seq + 1, 0)
+
+    def read(self, limit: int) -> Tuple[list, Position]:
+        """
+        Up to `limit` records from the committed position, without moving it.
+        returns: (records, position after the last one) for commit()
+        """
+        self._file.flush()
+        seq, offset = self._position
+        records = []
+        while len(records) < limit:
+            path = self._path(seq)
+            if path.exists():
+                for payload, offset in _scan(path, offset):
+                    records.append(pickle.loads(payload))
+                    if len(records) >= limit:
+                        break
+            if len(records) >= limit or seq >= self._seq:
+                break
+            seq, offset = seq + 1, 0
+        return records, (seq, offset)
+
+    def commit(self, position: Position) -> None:
+        if position == self._position:
+            return
+        tmp = self.dir / "position.tmp"
+        tmp.write_text(f"{position[0]} {position[1]}")
+        os.replace(tmp, self.dir / "position")
+        self._position = position
+        for seq in self._segments():
+            if seq >= position[0]:
+                break
+            self._path(seq).unlink()
+
+    async def sync(self) -> None:
+        if not self._dirty:
+            return
+        self._file.flush()
+        self._dirty = False
+        # fsync a duplicate so a segment roll can close the file meanwhile
+        fd = os.dup(self._file.fileno())
+        try:
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            os.close(fd)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.sync_interval)
+                await self.sync()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import uuid
+from typing import Awaitable, Callable
+
+import asyncpg
+import pytest
+
+# the modules live at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pg():
+    """
+    Runs `test(conn)` on a connection to the local database (TEST_DB_NAME,
+    else DB_NAME_LOCAL) inside a schema of its own, dropped afterwards.
+    Skips when there is no database to use. `pg.params` are the connection
+    arguments, for tests that need a psycopg2 connection too (with
+    options="-c search_path=" + the test's current_schema()).
+    """
+    name = os.getenv("TEST_DB_NAME") or os.getenv("DB_NAME_LOCAL")
+    if not name:
+        pytest.skip("no test database, set TEST_DB_NAME")
+    params = dict(host="localhost", port="5432", user="devgadbadr",
+                  password=os.getenv("DB_PASSWORD_LOCAL"), database=name)
+
+    def run(test: Callable[[asyncpg.Connection], Awaitable[None]]) -> None:
+        async def main():
+            try:
+                conn = await asyncpg.connect(**params)
+            except (OSError, asyncpg.PostgresError) as e:
+                pytest.skip(f"test database not reachable: {e!r}")
+            schema = f"test_{uuid.uuid4().hex}"
+            await conn.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema}")
+            try:
+                await test(conn)
+            finally:
+                await conn.execute(f"DROP SCHEMA {schema} CASCADE")
+                await conn.close()
+
+        asyncio.run(main())
+
+    run.params = params
+    return run
@@ -0,0 +1,40 @@
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Sequence
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+from pymodbus.server import ModbusTcpServer
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def modbus_slaves(registers: Dict[int, Sequence[int]]) -> AsyncIterator[int]:
+    """
+    A Modbus TCP gateway on localhost with a holding register block per
+    slave id, starting at address 0. Any other slave id gets no answer at
+    all, like a meter that is switched off. yields: the port
+    """
+    slaves = {i: ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0, *values]), zero_mode=False)
+              for i, values in registers.items()}
+    port = free_port()
+    server = ModbusTcpServer(ModbusServerContext(slaves=slaves, single=False), address=("127.0.0.1", port),
+                             ignore_missing_slaves=True)
+    task = asyncio.ensure_future(server.serve_forever())
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.02)
+    try:
+        yield port
+    finally:
+        await server.shutdown()
+        task.cancel()
@@ -0,0 +1,73 @@
+import pytest
+
+import appauth
+from appauth import AuthCheck
+
+
+class Server:
+    """the license server: answers, or is unreachable"""
+
+    def __init__(self):
+        self.answer = True
+        self.asked = 0
+
+    def __call__(self):
+        self.asked += 1
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(appauth.time, "monotonic", lambda: now[0])
+    return now
+
+
+def check(server: Server, **kwargs) -> AuthCheck:
+    auth = AuthCheck("http://license.invalid/auth", **kwargs)
+    auth._ask = server
+    return auth
+
+
+def test_answer_is_cached_for_the_ttl(clock):
+    server = Server()
+    auth = check(server, ttl=300)
+    assert auth.allowed() and auth.allowed()
+    assert server.asked == 1
+    server.answer = False
+    clock[0] += 299
+    assert auth.allowed()
+    clock[0] += 2
+    assert not auth.allowed()
+    assert server.asked == 2
+
+
+def test_last_answer_stands_through_an_outage_for_the_grace_period(clock):
+    server = Server()
+    auth = check(server, ttl=300, grace=3600)
+    assert auth.allowed()
+    server.answer = ConnectionError("no route to host")
+    clock[0] += 1800
+    assert auth.allowed()
+    # still asked once per ttl, not on every page load
+    assert auth.allowed() and server.asked == 2
+    clock[0] += 1801
+    assert not auth.allowed()
+    server.answer = True
+    clock[0] += 301
+    assert auth.allowed()
+
+
+def test_never_answered_means_not_allowed(clock):
+    server = Server()
+    server.answer = ConnectionError("no route to host")
+    assert not check(server).allowed()
+
+
+def test_stub_answers_without_asking():
+    server = Server()
+    assert check(server, stub="allow").allowed()
+    assert not check(server, stub=" Deny ").allowed()
+    assert server.asked == 0
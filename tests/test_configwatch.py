@@ -0,0 +1,112 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+from configwatch import ConfigWatcher
+from db import CONFIG_CHANNEL
+
+
+class Remote:
+    """the remote database: the tpm map and its digest"""
+
+    def __init__(self, version="v1"):
+        self.version = version
+        self.rows = [{"address": 4000}]
+
+    async def fetchval(self, sql):
+        return self.version
+
+    async def fetch(self, sql):
+        return list(self.rows)
+
+
+class Local:
+    def __init__(self, settings):
+        self.settings = settings
+
+    async def fetchrow(self, sql):
+        return dict(self.settings)
+
+
+def test_a_change_that_fails_to_apply_is_tried_again():
+    async def main():
+        remote = Remote()
+        applied, failures = [], [RuntimeError("map not usable yet")]
+
+        async def on_map(rows):
+            if failures:
+                raise failures.pop()
+            applied.append(rows)
+
+        watcher = ConfigWatcher(None, remote, on_map, map_version="v1")
+        await watcher.check()
+        assert applied == []
+
+        remote.version = "v2"
+        with pytest.raises(RuntimeError):
+            await watcher.check()
+        assert watcher.map_version == "v1"
+        await watcher.check()
+        assert applied == [[{"address": 4000}]] and watcher.map_version == "v2"
+        await watcher.check()
+        assert len(applied) == 1
+
+    asyncio.run(main())
+
+
+def test_settings_changes_are_applied_once():
+    async def main():
+        local = Local({"id": 1, "baudrate": 9600})
+        seen = []
+
+        async def on_settings(row):
+            seen.append(row["baudrate"])
+
+        async def on_map(rows):
+            pass
+
+        watcher = ConfigWatcher(local, Remote(), on_map, on_settings, map_version="v1",
+                                settings={"id": 1, "baudrate": 9600})
+        await watcher.check()
+        local.settings["baudrate"] = 19200
+        await watcher.check()
+        await watcher.check()
+        assert seen == [19200]
+
+    asyncio.run(main())
+
+
+def test_notify_wakes_the_watcher_and_a_failed_reload_is_retried(pg):
+    async def test(conn):
+        pool = await asyncpg.create_pool(**pg.params, min_size=1, max_size=1)
+        remote = Remote()
+        calls = []
+        reloaded = asyncio.Event()
+
+        async def on_map(rows):
+            calls.append(remote.version)
+            if len(calls) == 1:
+                raise RuntimeError("map not usable yet")
+            reloaded.set()
+
+        watcher = ConfigWatcher(pool, remote, on_map, interval=60, map_version="v1")
+        task = asyncio.create_task(watcher.run())
+        try:
+            await asyncio.sleep(0.2)
+            remote.version = "v2"
+            await conn.execute(f"NOTIFY {CONFIG_CHANNEL}")
+            for _ in range(50):
+                if calls:
+                    break
+                await asyncio.sleep(0.02)
+            assert calls == ["v2"] and watcher.map_version == "v1"
+            await conn.execute(f"NOTIFY {CONFIG_CHANNEL}")
+            await asyncio.wait_for(reloaded.wait(), 2)
+            assert watcher.map_version == "v2"
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await pool.close()
+
+    pg(test)
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+from db import WaitingPool, pooled_cursor
+
+
+def test_each_request_borrows_its_own_connection(pg):
+    async def test(conn):
+        pool = ThreadedConnectionPool(1, 2, **pg.params)
+        try:
+            backends = []
+            inside = threading.Barrier(2, timeout=5)
+
+            def request():
+                with pooled_cursor(pool) as cursor:
+                    cursor.execute("SELECT pg_backend_pid()")
+                    backends.append(cursor.fetchone()[0])
+                    inside.wait()
+
+            threads = [threading.Thread(target=request) for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert len(set(backends)) == 2
+
+            # both went back: borrowing them again doesn't exceed the pool
+            with pooled_cursor(pool) as a, pooled_cursor(pool) as b:
+                a.execute("SELECT 1")
+                b.execute("SELECT 1")
+        finally:
+            pool.closeall()
+
+    pg(test)
+
+
+def test_a_connection_that_broke_is_not_reused(pg):
+    async def test(conn):
+        pool = ThreadedConnectionPool(1, 1, **pg.params)
+        try:
+            try:
+                with pooled_cursor(pool) as cursor:
+                    cursor.execute("SELECT pg_backend_pid()")
+                    broken = cursor.fetchone()[0]
+                    cursor.connection.close()
+                    cursor.execute("SELECT 1")
+            except psycopg2.InterfaceError:
+                pass
+            with pooled_cursor(pool) as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                assert cursor.fetchone()[0] != broken
+        finally:
+            pool.closeall()
+
+    pg(test)
+
+
+class CountingPool:
+    def __init__(self):
+        self.out = 0
+        self.fail = False
+
+    def getconn(self):
+        if self.fail:
+            raise PoolError("connection pool exhausted")
+        self.out += 1
+        return object()
+
+    def putconn(self, conn, close=False):
+        self.out -= 1
+
+
+def test_a_request_waits_for_a_connection_instead_of_failing():
+    pool = WaitingPool(CountingPool(), size=1, timeout=5)
+    conn = pool.getconn()
+    threading.Timer(0.1, pool.putconn, (conn,)).start()
+    start = time.monotonic()
+    pool.getconn()
+    assert 0.05 < time.monotonic() - start < 5
+
+
+def test_the_wait_is_bounded_and_a_failed_borrow_frees_its_slot():
+    inner = CountingPool()
+    pool = WaitingPool(inner, size=1, timeout=0.05)
+    inner.fail = True
+    with pytest.raises(PoolError):
+        pool.getconn()
+    inner.fail = False
+    pool.getconn()
+    with pytest.raises(PoolError, match="No database connection free"):
+        pool.getconn()
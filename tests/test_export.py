@@ -0,0 +1,12 @@
+import sys
+
+import pytest
+
+from export import write_parquet
+
+
+def test_parquet_without_pyarrow_says_what_is_missing(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", None)
+    with pytest.raises(ImportError, match="needs pyarrow"):
+        write_parquet(str(tmp_path / "r.parquet"), ["timestamp"], iter([]))
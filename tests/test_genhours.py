@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+from genhoursfunc import GeneratorHoursAccumulator, calculate_generator_hours
+
+T0 = datetime(2025, 10, 5, 9, 0, tzinfo=timezone.utc)
+
+
+def at(minutes: float) -> datetime:
+    return T0 + timedelta(minutes=minutes)
+
+
+def test_other_generators_events_may_arrive_out_of_order():
+    acc = GeneratorHoursAccumulator()
+    # gen1's debounce settled first, though gen2 switched earlier
+    acc.apply("gen1", True, at(10))
+    acc.apply("gen2", True, at(5))
+    acc.apply("gen1", False, at(70))
+    acc.apply("gen2", False, at(35))
+    assert acc.seconds(at(100)) == {"gen1": 3600.0, "gen2": 1800.0}
+
+
+def test_older_event_of_the_same_generator_is_ignored():
+    acc = GeneratorHoursAccumulator()
+    acc.apply("gen1", True, at(10))
+    acc.apply("gen1", False, at(40))
+    acc.apply("gen1", True, at(20))
+    assert acc.seconds(at(100)) == {"gen1": 1800.0}
+    assert acc.last_event == {"gen1": at(40)}
+
+
+def test_open_run_counts_until_now_and_matches_the_full_recalculation():
+    rows = [
+        {"timestamp": at(0), "gen": "gen1", "state": True},
+        {"timestamp": at(30), "gen": "gen1", "state": "true"},
+        {"timestamp": at(90), "gen": "gen1", "state": False},
+        {"timestamp": at(95), "gen": "gen3", "state": 0},
+        {"timestamp": at(100), "gen": "gen3", "state": 1},
+    ]
+    acc = GeneratorHoursAccumulator()
+    acc.rebuild(rows)
+    now = datetime.now(timezone.utc)
+    assert acc.hours(now) == calculate_generator_hours(rows)
+    assert acc.hours(at(220))["Generator 3"] == "2:00"
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from genstate import GENS_SCHEMA, GenStateCache, watch_generators
+from gpiocapture import EdgeCapture, FakePinSource
+
+T0 = datetime(2025, 10, 5, 9, 0, tzinfo=timezone.utc)
+
+
+def test_transitions_open_and_close_runs(pg):
+    async def test(conn):
+        await conn.execute(GENS_SCHEMA)
+        cache = await GenStateCache.load(conn)
+        assert await cache.record(conn, "gen1", True, T0)
+        assert not await cache.record(conn, "gen1", True, T0 + timedelta(minutes=1))
+        assert await cache.record(conn, "gen1", False, T0 + timedelta(minutes=30))
+        runs = await conn.fetch('select gen, start, "end" from gen_runs')
+        assert [tuple(r) for r in runs] == [("gen1", T0, T0 + timedelta(minutes=30))]
+        assert await conn.fetchval("select count(*) from gens") == 2
+
+    pg(test)
+
+
+def test_off_stamped_before_the_run_start_closes_it_empty(pg):
+    async def test(conn):
+        await conn.execute(GENS_SCHEMA)
+        cache = await GenStateCache.load(conn)
+        await cache.record(conn, "gen2", True, T0)
+        # the clock stepped back between the two edges
+        assert await cache.record(conn, "gen2", False, T0 - timedelta(seconds=5))
+        run = await conn.fetchrow('select start, "end" from gen_runs where gen = $1', "gen2")
+        assert run["start"] == run["end"] == T0
+        # and the generator can start a new run afterwards
+        assert await cache.record(conn, "gen2", True, T0 + timedelta(minutes=1))
+        assert await conn.fetchval('select count(*) from gen_runs where "end" is null') == 1
+
+    pg(test)
+
+
+class FlakyPool:
+    """stands in for the asyncpg pool: refuses the first `down` statements like a restarting server"""
+
+    def __init__(self, down: int):
+        self.down = down
+        self.rows = []
+
+    async def execute(self, sql, *args):
+        if self.down:
+            self.down -= 1
+            raise ConnectionRefusedError("database restarting")
+        self.rows.append(args)
+
+
+def test_transitions_wait_out_a_database_outage():
+    pool = FlakyPool(down=3)
+    pins = FakePinSource({17: 1})
+    cache = GenStateCache({"gen1": False})
+    hours = []
+    cache.listeners.append(lambda gen, on, ts: hours.append((gen, on)))
+    gen_values = {}
+
+    async def run():
+        capture = EdgeCapture(pins, [17], debounce=0.01)
+        watcher = asyncio.ensure_future(
+            watch_generators(pool, capture, {"gen1": 17}, gen_values, cache, backoff=0.02, backoff_max=0.05)
+        )
+        await asyncio.sleep(0.02)
+        pins.set(17, 0)
+        await asyncio.sleep(0.05)
+        pins.set(17, 1)
+        for _ in range(100):
+            if len(pool.rows) == 2:
+                break
+            await asyncio.sleep(0.02)
+        watcher.cancel()
+        # nothing stored while it was down, the edges seen meanwhile were kept
+        assert [(r[0], r[2], r[3]) for r in pool.rows] == [("gen 1 on", "gen1", True), ("gen 1 off", "gen1", False)]
+        assert pool.rows[0][1] < pool.rows[1][1]
+
+    asyncio.run(run())
+    assert gen_values == {"gen1": 1}
+    assert cache.states == {"gen1": False} and not cache.pending
+    assert hours == [("gen1", True), ("gen1", False)]
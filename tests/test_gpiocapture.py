@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from gpiocapture import EdgeCapture, FakePinSource, PinEvent, gpio_backend
+
+
+async def _next(capture: EdgeCapture, timeout: float = 1.0) -> PinEvent:
+    return await asyncio.wait_for(capture.events().__anext__(), timeout)
+
+
+def test_bouncing_edges_give_one_event_stamped_at_the_first_edge():
+    async def run():
+        pins = FakePinSource({17: 1})
+        capture = EdgeCapture(pins, [17], debounce=0.05)
+        await capture.start()
+        before = datetime.now(timezone.utc)
+        pins.set(17, 0)
+        after = datetime.now(timezone.utc)
+        for level in (1, 0, 1, 0):
+            await asyncio.sleep(0.005)
+            pins.set(17, level)
+        event = await _next(capture)
+        settled = datetime.now(timezone.utc)
+        assert event.pin == 17 and event.level == 0
+        # the first edge's time, not the time it settled
+        assert before <= event.timestamp <= after
+        assert (settled - event.timestamp).total_seconds() >= 0.05
+        assert capture._queue.empty()
+        capture.close()
+
+    asyncio.run(run())
+
+
+def test_bounce_that_settles_back_is_not_a_transition():
+    async def run():
+        pins = FakePinSource({22: 1})
+        capture = EdgeCapture(pins, [22], debounce=0.03)
+        await capture.start()
+        pins.set(22, 0)
+        pins.set(22, 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await _next(capture, timeout=0.1)
+        assert capture.level(22) == 1
+        capture.close()
+
+    asyncio.run(run())
+
+
+def test_edges_from_another_thread_reach_the_loop():
+    async def run():
+        pins = FakePinSource({17: 1, 27: 1})
+        capture = EdgeCapture(pins, [17, 27], debounce=0.02)
+        await capture.start()
+        # like RPi.GPIO's callback thread
+        interrupt = threading.Thread(target=lambda: (pins.set(27, 0), pins.set(17, 0)))
+        interrupt.start()
+        interrupt.join()
+        first, second = await _next(capture), await _next(capture)
+        assert {(first.pin, first.level), (second.pin, second.level)} == {(17, 0), (27, 0)}
+        assert capture.level(17) == capture.level(27) == 0
+        capture.close()
+
+    asyncio.run(run())
+
+
+def test_separate_pins_settle_on_their_own_timers():
+    async def run():
+        pins = FakePinSource({17: 1, 27: 1})
+        capture = EdgeCapture(pins, [17, 27], debounce=0.05)
+        await capture.start()
+        pins.set(17, 0)
+        await asyncio.sleep(0.02)
+        pins.set(27, 0)
+        # 17 keeps bouncing, so 27 settles first though its edge came later
+        for level in (1, 0, 1, 0):
+            await asyncio.sleep(0.02)
+            pins.set(17, level)
+        first, second = await _next(capture), await _next(capture)
+        assert (first.pin, second.pin) == (27, 17)
+        assert second.timestamp < first.timestamp
+        capture.close()
+
+    asyncio.run(run())
+
+
+def test_backend_by_name():
+    assert isinstance(gpio_backend("fake"), FakePinSource)
+    with pytest.raises(ValueError):
+        gpio_backend("nope")
@@ -0,0 +1,134 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from historian import Historian
+from readings import SampleWriter, ensure_sample_table
+from readplanner import Signal
+from rollups import RollupAccumulator, ensure_rollup_tables
+from spool import Spool
+
+VOLTAGE = Signal(3000, "v", "int16", 0.1, "V")
+CURRENT = Signal(3010, "a", "uint16", 0.001, "A")
+T0 = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+class CopyConn:
+    """Records COPYs; fails the next `fail` of them"""
+
+    def __init__(self, fail: int = 0):
+        self.copied = []
+        self.fail = fail
+
+    async def copy_records_to_table(self, table, records, columns):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("connection lost")
+        self.copied.extend(records)
+
+
+def test_resolution_keeps_one_sample_per_device_and_interval():
+    historian = Historian(CopyConn(), SampleWriter([VOLTAGE]), resolution=10)
+    kept = [historian.add(device, T0 + timedelta(seconds=s), {"v": 230.0})
+            for s in (0, 4, 9, 10, 15, 21) for device in ("tpm1", "tpm2")]
+    assert kept == [True, True, False, False, False, False, True, True, False, False, True, True]
+    assert asyncio.run(historian.flush()) == 6
+
+
+def test_full_batch_is_written_before_the_flush_interval():
+    async def main():
+        conn = CopyConn()
+        historian = Historian(conn, SampleWriter([VOLTAGE]), batch_size=3, flush_interval=60)
+        task = asyncio.create_task(historian.run())
+        for s in range(3):
+            historian.add("tpm1", T0 + timedelta(seconds=s), {"v": 230.0 + s})
+        await asyncio.sleep(0.05)
+        assert [r[-1] for r in conn.copied] == [230.0, 231.0, 232.0]
+        historian.add("tpm1", T0 + timedelta(seconds=3), {"v": 233.0})
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the rest is written on the way out
+        assert len(conn.copied) == 4
+
+    asyncio.run(main())
+
+
+def test_failed_copy_keeps_the_newest_rows_up_to_max_buffer():
+    async def main():
+        conn = CopyConn(fail=1)
+        historian = Historian(conn, SampleWriter([VOLTAGE]), max_buffer=3)
+        for s in range(2):
+            historian.add("tpm1", T0 + timedelta(seconds=s), {"v": float(s)})
+        with pytest.raises(OSError):
+            await historian.flush()
+        for s in range(2, 4):
+            historian.add("tpm1", T0 + timedelta(seconds=s), {"v": float(s)})
+        with pytest.raises(OSError):
+            conn.fail = 1
+            await historian.flush()
+        assert historian.dropped == 1
+        assert await historian.flush() == 3
+        assert [r[-1] for r in conn.copied] == [1.0, 2.0, 3.0]
+
+    asyncio.run(main())
+
+
+def test_flush_copies_into_tpmsample(pg):
+    async def test(conn):
+        await ensure_sample_table(conn, [VOLTAGE])
+        historian = Historian(conn, SampleWriter([VOLTAGE]))
+        historian.add("tpm1", T0, {"v": 229.5, "gen1": 0, "quality": "GOOD"})
+        historian.add("tpm1", T0 + timedelta(seconds=1), {"v": None})
+        assert await historian.flush() == 2
+        rows = await conn.fetch("SELECT ts, gen1, s3000 FROM tpmsample ORDER BY ts")
+        assert [tuple(r) for r in rows] == [(T0, True, 229.5), (T0 + timedelta(seconds=1), None, None)]
+
+    pg(test)
+
+
+def test_spooled_rows_of_another_map_are_dropped(tmp_path):
+    old = SampleWriter([VOLTAGE, CURRENT])
+    new = SampleWriter([CURRENT, VOLTAGE])      # same width, other columns
+    spool = Spool(str(tmp_path))
+    spool.append((old.layout, old.row("tpm1", T0, {"v": 230.0, "a": 5.0})))
+    spool.append((new.layout, new.row("tpm1", T0, {"v": 231.0, "a": 6.0})))
+    conn = CopyConn()
+    historian = Historian(conn, new, spool=spool)
+    assert asyncio.run(historian.flush()) == 1
+    assert historian.dropped == 1
+    assert conn.copied == [new.row("tpm1", T0, {"v": 231.0, "a": 6.0})]
+
+
+def test_rows_replayed_after_a_restart_are_rolled_up(pg, tmp_path):
+    async def test(conn):
+        await ensure_sample_table(conn, [VOLTAGE])
+        await ensure_rollup_tables(conn)
+        writer = SampleWriter([VOLTAGE])
+        # the previous run stored one sample and rolled it up, then spooled
+        # two more of the same minute and stopped before storing them
+        await conn.execute(writer.insert, *writer.row("tpm1", T0, {"v": 220.0}))
+        stale = RollupAccumulator([VOLTAGE])
+        stale.add("tpm1", T0, {"v": 220.0})
+        await stale.flush(conn)
+        spool = Spool(str(tmp_path))
+        for s, v in ((10, 230.0), (20, 240.0)):
+            spool.append((writer.layout, writer.row("tpm1", T0 + timedelta(seconds=s), {"v": v})))
+
+        historian = Historian(conn, writer, rollups=RollupAccumulator([VOLTAGE]), spool=spool)
+        now = datetime.now(timezone.utc)
+        historian.add("tpm1", now, {"v": 250.0})
+        assert await historian.flush() == 3
+        for tier in ("1m", "1h", "1d"):
+            row = await conn.fetchrow(f"SELECT n, sum, min, max FROM tpmrollup_{tier} WHERE bucket <= $1", T0)
+            assert tuple(row) == (3, 690.0, 220.0, 240.0), tier
+        # samples of this run only go through the accumulator
+        assert await conn.fetchval("SELECT n FROM tpmrollup_1m WHERE bucket > $1", T0) == 1
+
+        # the rebuild happens once
+        await conn.execute("UPDATE tpmrollup_1m SET n = 99 WHERE bucket <= $1", T0)
+        await historian.flush()
+        assert await conn.fetchval("SELECT n FROM tpmrollup_1m WHERE bucket <= $1", T0) == 99
+
+    pg(test)
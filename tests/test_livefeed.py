@@ -0,0 +1,67 @@
+from livefeed import LiveFeed, LiveState, channels
+from readplanner import Signal
+
+SIGNALS = [
+    Signal(4002, "L3 Voltage", "uint16", 0.1, "V", deadband=0.5),
+    Signal(4000, "L1 Voltage", "uint16", 0.1, "V", deadband=0.5),
+    Signal(4040, "Frequency", "uint16", 0.01, "Hz"),
+]
+
+
+def ids(feed: LiveFeed, *names: str) -> list:
+    return [[c.name for c in feed.channels].index(n) for n in names]
+
+
+def test_channels_are_the_signals_by_address_then_generators_and_quality():
+    names = [c.name for c in channels(SIGNALS)]
+    assert names[:3] == ["L1 Voltage", "L3 Voltage", "Frequency"]
+    assert names[3:6] == ["gen1", "gen2", "gen3"]
+    assert names[-1] == "quality"
+
+
+def test_deltas_carry_only_what_moved_past_its_deadband():
+    feed = LiveFeed(SIGNALS)
+    first = feed.update({"device": "tpm1", "L1 Voltage": 230.0, "L3 Voltage": 231.0, "Frequency": 50.0})
+    assert first[:3] == [feed.schema, "tpm1", 1]
+    assert sorted(first[3]) == ids(feed, "L1 Voltage", "L3 Voltage", "Frequency")
+
+    # 0.4 V is inside the deadband; any frequency change goes out
+    assert feed.update({"device": "tpm1", "L1 Voltage": 230.4, "L3 Voltage": 231.0, "Frequency": 50.0}) is None
+    delta = feed.update({"device": "tpm1", "L1 Voltage": 230.4, "L3 Voltage": 231.0, "Frequency": 50.01})
+    assert delta == [feed.schema, "tpm1", 2, ids(feed, "Frequency"), [50.01]]
+
+    # compared with the value sent, so slow drift gets out once it adds up
+    delta = feed.update({"device": "tpm1", "L1 Voltage": 230.5, "L3 Voltage": 231.0, "Frequency": 50.01})
+    assert delta == [feed.schema, "tpm1", 3, ids(feed, "L1 Voltage"), [230.5]]
+
+    # a failed read is always news
+    delta = feed.update({"device": "tpm1", "L1 Voltage": None, "L3 Voltage": 231.0, "Frequency": 50.01})
+    assert delta[3:] == [ids(feed, "L1 Voltage"), [None]]
+
+
+def test_a_state_fed_snapshot_then_deltas_matches_the_feed():
+    feed = LiveFeed(SIGNALS)
+    state = LiveState()
+    feed.update({"device": "tpm1", "L1 Voltage": 230.0})
+    state.load(feed.snapshot())
+    for v in (231.0, 232.0):
+        assert state.apply(feed.update({"device": "tpm1", "L1 Voltage": v}))
+    assert state.snapshot() == feed.snapshot()
+    # a new device starts at seq 1
+    assert state.apply(feed.update({"device": "tpm2", "Frequency": 49.9}))
+    assert state.snapshot()["devices"]["tpm2"][0] == 1
+
+
+def test_a_gap_or_another_schema_needs_a_snapshot():
+    feed = LiveFeed(SIGNALS)
+    state = LiveState()
+    state.load(feed.snapshot())
+    feed.update({"device": "tpm1", "L1 Voltage": 230.0})
+    lost = feed.update({"device": "tpm1", "L1 Voltage": 231.0})
+    assert not state.apply(lost)
+
+    old = feed.schema
+    feed.set_signals(SIGNALS[:2])
+    assert feed.schema != old
+    assert not LiveState().apply(feed.update({"device": "tpm1", "L1 Voltage": 230.0}))
+    assert feed.snapshot()["devices"]["tpm1"][0] == 1
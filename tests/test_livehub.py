@@ -0,0 +1,106 @@
+import asyncio
+import gc
+import json
+
+import aiohttp
+from aiohttp import web
+
+from livefeed import LiveFeed, message
+from livehub import LiveClient, LiveHub
+from readplanner import Signal
+from simulated import free_port
+
+SIGNALS = [Signal(4000, "L1 Voltage", "uint16", 0.1, "V")]
+
+
+def test_a_client_that_falls_behind_gets_a_snapshot_instead():
+    client = LiveClient(None, depth=3)
+    for i in range(3):
+        client.offer(f"delta {i}", lambda: "snapshot")
+    client.offer("delta 3", lambda: "snapshot")
+    assert client.dropped == 3
+    assert client.queue.qsize() == 1 and client.queue.get_nowait() == "snapshot"
+
+
+def test_dashboards_get_a_snapshot_then_the_deltas():
+    async def main():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        feed = LiveFeed(SIGNALS)
+        hub = LiveHub()
+        feed.update({"device": "tpm1", "L1 Voltage": 230.0})
+        assert hub.publish(message("live-snapshot", feed.snapshot()).decode())
+
+        runner = web.AppRunner(hub.app())
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(f"http://127.0.0.1:{port}/live") as ws:
+                    event, data = json.loads(await ws.receive_str())
+                    assert event == "live-snapshot" and data["devices"]["tpm1"][0] == 1
+                    assert data["devices"]["tpm1"][1][0] == 230.0
+
+                    delta = message("live-delta", feed.update({"device": "tpm1", "L1 Voltage": 231.0})).decode()
+                    assert hub.publish(delta)
+                    assert await ws.receive_str() == delta
+                    # a delta that doesn't follow on is refused, the poller resends a snapshot
+                    feed.update({"device": "tpm1", "L1 Voltage": 232.0})
+                    lost = message("live-delta", feed.update({"device": "tpm1", "L1 Voltage": 233.0})).decode()
+                    assert not hub.publish(lost)
+
+                    # a dashboard that saw a gap asks, and gets a snapshot
+                    await ws.send_str("resync")
+                    event, data = json.loads(await ws.receive_str())
+                    assert event == "live-snapshot" and data["devices"]["tpm1"][0] == 2
+                    assert data["devices"]["tpm1"][1][0] == 231.0
+                for _ in range(50):
+                    if not hub.clients:
+                        break
+                    await asyncio.sleep(0.01)
+                assert not hub.clients
+        finally:
+            await runner.cleanup()
+        gc.collect()
+        assert errors == []
+
+    asyncio.run(main())
+
+
+def test_a_send_failing_on_a_closing_socket_ends_the_session_quietly():
+    async def main():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        feed = LiveFeed(SIGNALS)
+        hub = LiveHub()
+        hub.publish(message("live-snapshot", feed.snapshot()).decode())
+        runner = web.AppRunner(hub.app())
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(f"http://127.0.0.1:{port}/live") as ws:
+                    await ws.receive_str()
+                    client, = hub.clients
+
+                    async def reset(line):
+                        raise ConnectionResetError("Cannot write to closing transport")
+
+                    client.ws.send_str = reset
+                    # the first goes out on the send already waiting for it, the second fails
+                    for v in (231.0, 232.0):
+                        hub.publish(message("live-delta", feed.update({"device": "tpm1", "L1 Voltage": v})).decode())
+                    await asyncio.sleep(0.05)
+            for _ in range(50):
+                if not hub.clients:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await runner.cleanup()
+        gc.collect()
+        await asyncio.sleep(0)
+        assert errors == []
+
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+import numpy as np
+
+from pdfrender import lttb
+
+
+def test_short_series_and_tiny_targets_come_back_untouched():
+    x = np.arange(10.0)
+    y = np.sin(x)
+    for n in (10, 50, 2):
+        kx, ky = lttb(x, y, n)
+        assert kx is x and ky is y
+
+
+def test_keeps_n_points_in_order_with_both_ends():
+    x = np.arange(10_000.0)
+    y = np.random.default_rng(1).normal(size=x.size)
+    kx, ky = lttb(x, y, 500)
+    assert len(kx) == len(ky) == 500
+    assert kx[0] == 0 and kx[-1] == x[-1]
+    assert np.all(np.diff(kx) > 0)
+    # every kept point is a real sample
+    assert np.array_equal(ky, y[kx.astype(int)])
+
+
+def test_single_sample_spikes_survive():
+    x = np.arange(5000.0)
+    y = np.zeros_like(x)
+    y[1234], y[3456] = 400.0, -250.0
+    kx, ky = lttb(x, y, 100)
+    assert 1234 in kx and 3456 in kx
+    assert ky.max() == 400.0 and ky.min() == -250.0
+
+
+def test_one_point_per_bucket():
+    x = np.arange(1002.0)
+    y = np.cos(x / 50)
+    n = 102
+    kx, _ = lttb(x, y, n)
+    every = (x.size - 2) / (n - 2)
+    inner = kx[1:-1]
+    buckets = ((inner - 1) // every).astype(int)
+    assert list(buckets) == list(range(n - 2))
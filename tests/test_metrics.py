@@ -0,0 +1,70 @@
+import asyncio
+
+import aiohttp
+
+from metrics import Counter, Gauge, Histogram, Registry, serve
+from simulated import free_port
+
+
+def test_text_exposition_format():
+    registry = Registry()
+    frames = Counter("frames_total", "Frames sent", ("event",), registry=registry)
+    clients = Gauge("clients", "Connected clients", registry=registry)
+    latency = Histogram("read_seconds", "One read", ("link",), buckets=(0.1, 0.5), registry=registry)
+    Counter("unused_total", "Never updated", registry=registry)
+    registry.collectors.append(lambda: clients.labels().set(3))
+
+    frames.labels("live-delta").inc()
+    frames.labels("live-delta").inc(2)
+    frames.labels('say "hi"\n').inc()
+    child = latency.labels("tcp")
+    for v in (0.05, 0.1, 0.3, 2.0):
+        child.observe(v)
+
+    assert registry.render() == "\n".join([
+        "# HELP frames_total Frames sent",
+        "# TYPE frames_total counter",
+        'frames_total{event="live-delta"} 3',
+        'frames_total{event="say \\"hi\\"\\n"} 1',
+        "# HELP clients Connected clients",
+        "# TYPE clients gauge",
+        "clients 3",
+        "# HELP read_seconds One read",
+        "# TYPE read_seconds histogram",
+        'read_seconds_bucket{link="tcp",le="0.1"} 2',
+        'read_seconds_bucket{link="tcp",le="0.5"} 3',
+        'read_seconds_bucket{link="tcp",le="+Inf"} 4',
+        'read_seconds_sum{link="tcp"} 2.45',
+        'read_seconds_count{link="tcp"} 4',
+    ]) + "\n"
+
+
+def test_histogram_timer_observes_the_block():
+    histogram = Histogram("block_seconds", "A block", registry=Registry())
+    child = histogram.labels()
+    with child.time():
+        pass
+    assert child.count == 1 and 0 <= child.sum < 0.1
+
+
+def test_metrics_are_served_over_http():
+    async def main():
+        Counter("served_total", "Served by the test").labels().inc()
+        port = free_port()
+        server = asyncio.create_task(serve(port, "127.0.0.1"))
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(50):
+                    try:
+                        async with session.get(f"http://127.0.0.1:{port}/metrics") as r:
+                            assert r.status == 200
+                            assert r.content_type == "text/plain"
+                            assert "served_total 1\n" in await r.text()
+                            return
+                    except aiohttp.ClientConnectionError:
+                        await asyncio.sleep(0.02)
+                raise AssertionError("metrics server never came up")
+        finally:
+            server.cancel()
+
+    asyncio.run(main())
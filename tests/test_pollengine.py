@@ -0,0 +1,45 @@
+import asyncio
+from typing import Dict, List
+
+from pymodbus.client import AsyncModbusTcpClient
+
+from pollengine import Device, PollEngine
+from readplanner import Signal, plan_groups
+from simulated import modbus_slaves
+from transport import COMM_ERROR, GOOD, ModbusTransport, client_timeout
+
+SIGNALS = [
+    Signal(0, "Voltage", "uint16", 0.1, "V", "fast"),
+    Signal(1, "Current", "uint16", 0.01, "A", "fast"),
+    Signal(2, "Energy", "uint32", 1, "kWh"),
+]
+
+
+def test_silent_meter_does_not_take_the_others_down():
+    samples: Dict[str, List[dict]] = {"live": [], "dead": []}
+
+    async def on_sample(device: Device, values: dict):
+        samples[device.name].append(values)
+
+    async def run():
+        async with modbus_slaves({1: [2301, 512, 1, 4464]}) as port:
+            client = AsyncModbusTcpClient("127.0.0.1", port=port, timeout=client_timeout(0.1), retries=0, reconnect_delay=0)
+            await client.connect()
+            engine = PollEngine(plan_groups(SIGNALS), on_sample, {"fast": 0.1}, stale_polls=1,
+                                breaker_threshold=2, breaker_cooldown=0.5)
+            engine.add_link(("127.0.0.1", port), ModbusTransport(client, request_timeout=0.1, retries=1))
+            engine.add_device(Device("live", slave=1, interval=0.2, timeout=1, host="127.0.0.1", port=port))
+            engine.add_device(Device("dead", slave=7, interval=0.2, timeout=1, host="127.0.0.1", port=port))
+            try:
+                await asyncio.wait_for(engine.run(), 1.5)
+            except asyncio.TimeoutError:
+                pass
+            assert client.connected
+            assert engine.breakers["dead"].open
+            client.close()
+
+    asyncio.run(run())
+    assert len(samples["live"]) >= 8
+    assert all(s["quality"] == GOOD for s in samples["live"])
+    assert samples["live"][-1] == {"Voltage": 230.1, "Current": 5.12, "Energy": 70000, "quality": GOOD}
+    assert samples["dead"][-1] == {"Voltage": None, "Current": None, "Energy": None, "quality": COMM_ERROR}
@@ -0,0 +1,40 @@
+import json
+from datetime import datetime, timezone
+
+from readings import ensure_sample_table, migrate_tpmreading
+from readplanner import Signal
+
+SIGNALS = [
+    Signal(4000, "L1 Voltage", "uint16", 0.1, "V"),
+    Signal(4043, "L1 Power Factor", "int16", 0.001, ""),
+    Signal(4140, "L1 Active Power", "int32", 0.1, "W"),
+    Signal(4200, "Total Energy", "uint32", 1, "Wh"),
+]
+T0 = datetime(2025, 10, 5, 21, 0, tzinfo=timezone.utc)
+
+
+def test_migration_pages_through_shared_timestamps_and_decodes_like_live_reads(pg):
+    async def test(conn):
+        await conn.execute("CREATE TABLE tpmreading (data json, timestamp timestamptz)")
+        legacy = {
+            "L1 Voltage": "230.5",
+            "L1 Power Factor": "65.04",         # int16 -496 stored as its unsigned word
+            "L1 Active Power": 2 ** 32 - 1000,  # int32 -1000 as the unsigned register pair
+            "Total Energy": 70000,
+        }
+        # five devices on one timestamp, read two rows at a time
+        await conn.executemany(
+            "INSERT INTO tpmreading (data, timestamp) VALUES ($1, $2)",
+            [(json.dumps({**legacy, "device": f"tpm{i}"}), T0) for i in range(5)]
+            + [(json.dumps({"L1 Voltage": "", "device": "tpm0"}), T0.replace(minute=1))],
+        )
+        await ensure_sample_table(conn, SIGNALS)
+
+        assert await migrate_tpmreading(conn, SIGNALS, batch=2) == 6
+        rows = await conn.fetch("SELECT * FROM tpmsample ORDER BY ts, device")
+        assert [r["device"] for r in rows] == ["tpm0", "tpm1", "tpm2", "tpm3", "tpm4", "tpm0"]
+        first = rows[0]
+        assert (first["s4000"], first["s4043"], first["s4140"], first["s4200"]) == (230.5, -0.496, -100.0, 70000)
+        assert rows[-1]["s4000"] is None
+
+    pg(test)
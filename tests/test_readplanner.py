@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from readplanner import MAX_READ_COUNT, ReadBlock, Signal, load_signals, plan_groups, plan_reads, read_plan
+from tpmrows import tpm_registers
+
+
+def sig(address: int, datatype: str = "uint16", pollclass: str = "normal") -> Signal:
+    return Signal(address, f"s{address}", datatype, 1, "", pollclass)
+
+
+def spans(plan):
+    return [(b.start, b.count) for b in plan]
+
+
+def test_neighbours_within_the_gap_share_a_read():
+    signals = [sig(10), sig(12, "uint32"), sig(20), sig(60)]
+    plan = plan_reads(signals, max_gap=6)
+    assert spans(plan) == [(10, 11), (60, 1)]
+    assert [s.address for s in plan[0].signals] == [10, 12, 20]
+    # 6 unused registers between 12..13 and 20
+    assert spans(plan_reads(signals, max_gap=5)) == [(10, 4), (20, 1), (60, 1)]
+
+
+def test_no_gap_keeps_reads_on_mapped_registers():
+    assert spans(plan_reads([sig(1), sig(2), sig(4)], max_gap=0)) == [(1, 2), (4, 1)]
+
+
+def test_reads_are_split_at_the_register_limit():
+    plan = plan_reads([sig(a) for a in range(0, 300)], max_gap=32)
+    assert all(b.count <= MAX_READ_COUNT for b in plan)
+    assert spans(plan) == [(0, 125), (125, 125), (250, 50)]
+    # a wide signal is never cut in two
+    plan = plan_reads([sig(0), sig(123, "uint32"), sig(125)], max_count=124)
+    assert spans(plan) == [(0, 1), (123, 3)]
+
+
+def test_bad_limits_are_rejected():
+    with pytest.raises(ValueError):
+        plan_reads([sig(0)], max_gap=-1)
+    with pytest.raises(ValueError):
+        plan_reads([sig(0, "uint64")], max_count=3)
+
+
+def test_poll_classes_are_planned_apart():
+    plans = plan_groups([sig(1, pollclass="fast"), sig(2, pollclass="slow"), sig(3, pollclass="fast")])
+    assert list(plans) == ["fast", "slow"]
+    assert spans(plans["fast"]) == [(1, 3)] and spans(plans["slow"]) == [(2, 1)]
+
+
+def test_map_rows_become_sorted_readable_signals():
+    rows = [
+        {"enabled": True, "address": 20, "parameter": "b", "datatype": "INT16 ", "readwrite": "RW",
+         "multiplier": "0.1", "unit": "V", "pollclass": None, "deadband": None},
+        {"enabled": False, "address": 5, "parameter": "off", "datatype": "uint16", "readwrite": "R"},
+        {"enabled": True, "address": 7, "parameter": "w", "datatype": "uint16", "readwrite": "W"},
+        {"enabled": True, "address": 10, "parameter": "a", "datatype": "uint32", "readwrite": "R",
+         "multiplier": None, "unit": None, "pollclass": "Fast", "deadband": "2"},
+    ]
+    assert load_signals(rows) == [
+        Signal(10, "a", "uint32", 1.0, "", "fast", 2.0),
+        Signal(20, "b", "int16", 0.1, "V", "normal", 0.0),
+    ]
+    with pytest.raises(ValueError):
+        load_signals([{"address": 1, "parameter": "x", "datatype": "float16"}])
+    assert len(load_signals(tpm_registers)) == len([r for r in tpm_registers if r[0]])
+
+
+def test_failed_blocks_read_as_none():
+    class Reply:
+        def __init__(self, registers, error=False):
+            self.registers, self.error = registers, error
+
+        def isError(self):
+            return self.error
+
+    class Client:
+        async def read_holding_registers(self, address, count, slave):
+            assert slave == 3
+            return {0: Reply([1, 2]), 10: Reply([], error=True), 20: Reply([9])}[address]
+
+    plan = [ReadBlock(0, 2, ()), ReadBlock(10, 1, ()), ReadBlock(20, 2, ())]
+    # a short reply counts as failed too
+    assert asyncio.run(read_plan(Client(), plan, slave=3)) == [[1, 2], None, None]
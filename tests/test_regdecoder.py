@@ -0,0 +1,49 @@
+import struct
+
+import pytest
+
+from readplanner import ReadBlock, Signal, plan_reads
+from regdecoder import BlockDecoder, PlanDecoder
+
+
+def words(fmt: str, *values) -> list:
+    raw = struct.pack(">" + fmt, *values)
+    return list(struct.unpack(f">{len(raw) // 2}H", raw))
+
+
+def test_types_signs_word_order_and_scaling():
+    signals = [
+        Signal(0, "volts", "uint16", 0.1, "V"),
+        Signal(1, "pf", "int16", 0.001, ""),
+        Signal(4, "energy", "uint32", 1, "kWh"),
+        Signal(6, "power", "int32", 0.01, "kW"),
+        Signal(8, "temp", "float32", 1, "C"),
+        Signal(10, "total", "int64", 1, "Wh"),
+    ]
+    block, = plan_reads(signals)
+    registers = words("Hh4xIifq", 2304, -985, 70000, -123456, 21.5, -(2 ** 40))
+    assert BlockDecoder(block).decode(registers) == {
+        "volts": 230.4,
+        "pf": -0.985,
+        "energy": 70000,
+        "power": -1234.56,
+        "temp": 21.5,
+        "total": -(2 ** 40),
+    }
+
+
+def test_scaled_values_are_rounded_to_the_multiplier():
+    block = ReadBlock(0, 1, (Signal(0, "i", "uint16", 0.001, "A"),))
+    value = BlockDecoder(block).decode([1234])["i"]
+    assert value == 1.234 and repr(value) == "1.234"
+
+
+def test_overlapping_signals_are_rejected():
+    block = ReadBlock(0, 2, (Signal(0, "a", "uint32", 1, ""), Signal(1, "b", "uint16", 1, "")))
+    with pytest.raises(ValueError):
+        BlockDecoder(block)
+
+
+def test_failed_block_maps_its_signals_to_none():
+    plan = plan_reads([Signal(0, "a", "uint16", 1, ""), Signal(100, "b", "uint16", 0.1, "")], max_gap=0)
+    assert PlanDecoder(plan).decode([None, [25]]) == {"a": None, "b": 2.5}
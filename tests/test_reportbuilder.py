@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import psycopg2
+import pytest
+
+from readings import ensure_sample_table
+from readplanner import Signal
+from reportbuilder import ReportData, ReportSignal, fetch_report, make_spec, source_tier, summarize
+from rollups import ensure_rollup_tables, rebuild_rollups
+
+ISTANBUL = ZoneInfo("Europe/Istanbul")
+CATALOG = [
+    ReportSignal("s4000", "L1 Voltage", 4000, "V"),
+    ReportSignal("s4200", "Total Energy", 4200, "kWh"),
+]
+ENERGY = Signal(4200, "Total Energy", "uint32", 1, "kWh")
+T0 = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def test_make_spec_resolves_names_and_addresses():
+    spec = make_spec(CATALOG, ["L1 Voltage", 4200], ["avg", "delta"], "8h", "06:00", "tpm1")
+    assert [s.col for s in spec.signals] == ["s4000", "s4200"]
+    assert (spec.bucket, spec.origin, spec.device) == (8 * 3600, 6 * 3600, "tpm1")
+    # no delta of a voltage
+    assert [(s.col, agg) for s, agg in spec.columns] == [("s4000", "avg"), ("s4200", "avg"), ("s4200", "delta")]
+
+
+@pytest.mark.parametrize("signals, aggs, bucket, origin", [
+    (["Frequency"], "avg", "1h", "00:00"),
+    ([4001], "avg", "1h", "00:00"),
+    ([], "avg", "1h", "00:00"),
+    (["L1 Voltage"], "median", "1h", "00:00"),
+    (["L1 Voltage"], "avg", "0m", "00:00"),
+    (["L1 Voltage"], "avg", "1w", "00:00"),
+    (["L1 Voltage"], "avg", "1h", "24:00"),
+])
+def test_make_spec_rejects_unknown_input(signals, aggs, bucket, origin):
+    with pytest.raises(ValueError):
+        make_spec(CATALOG, signals, aggs, bucket, origin)
+
+
+def test_source_tier_is_the_coarsest_that_tiles_buckets_and_range():
+    day = datetime(2026, 1, 1, tzinfo=ISTANBUL)
+    daily = make_spec(CATALOG, [4000], "avg", "1d")
+    assert source_tier(daily, day, day + timedelta(days=7), ISTANBUL) == "1d"
+    # shifts starting 06:00 fit hourly buckets, not daily ones
+    shifts = make_spec(CATALOG, [4000], "avg", "8h", "06:00")
+    assert source_tier(shifts, day, day + timedelta(days=7), ISTANBUL) == "1h"
+    assert source_tier(daily, day + timedelta(minutes=15), day + timedelta(days=7), ISTANBUL) == "15m"
+    assert source_tier(daily, day + timedelta(seconds=5), day + timedelta(days=7), ISTANBUL) is None
+    assert source_tier(make_spec(CATALOG, [4000], "p95", "1d"), day, day + timedelta(days=7), ISTANBUL) is None
+
+
+def test_summarize_totals_deltas_and_skips_empty_buckets():
+    spec = make_spec(CATALOG, [4000, 4200], ["max", "delta"], "1h")
+    nan = np.nan
+    data = ReportData(
+        periods=np.array([T0, T0, T0 + timedelta(hours=1), T0 + timedelta(hours=1)], dtype=object),
+        devices=np.array(["tpm1", "tpm2", "tpm1", "tpm2"], dtype=object),
+        values={
+            ("L1 Voltage", "max"): np.array([231.0, nan, 235.0, nan]),
+            ("Total Energy", "max"): np.array([110.0, 50.0, 130.0, 60.0]),
+            ("Total Energy", "delta"): np.array([10.0, 5.0, 20.0, nan]),
+        },
+        tier=None,
+    )
+    summary = summarize(data, spec)
+    assert summary == [
+        ["L1 Voltage", "max", "tpm1", None, 231.0, 235.0, 233.0],
+        ["Total Energy", "max", "tpm1", None, 110.0, 130.0, 120.0],
+        ["Total Energy", "delta", "tpm1", 30.0, 10.0, 20.0, 15.0],
+        ["L1 Voltage", "max", "tpm2", None, None, None, None],
+        ["Total Energy", "max", "tpm2", None, 50.0, 60.0, 55.0],
+        ["Total Energy", "delta", "tpm2", 5.0, 5.0, 5.0, 5.0],
+    ]
+
+
+def test_energy_counts_across_the_range_start_and_comm_gaps(pg):
+    async def test(conn):
+        await ensure_sample_table(conn, [ENERGY])
+        await ensure_rollup_tables(conn)
+        # a reading before the range, then a gap of failed reads inside it
+        readings = [(-10, 100), (10, 110), (30, None), (50, None), (70, 118), (90, 130), (150, 131)]
+        await conn.executemany(
+            "INSERT INTO tpmsample (device, ts, s4200) VALUES ('tpm1', $1, $2)",
+            [(T0 + timedelta(seconds=s), v) for s, v in readings],
+        )
+        await rebuild_rollups(conn, [ENERGY], "Europe/Istanbul")
+        schema = await conn.fetchval("SELECT current_schema()")
+
+        db = psycopg2.connect(**pg.params, options=f"-c search_path={schema}")
+        try:
+            with db.cursor() as cursor:
+                def total(aggs, fromm, to):
+                    spec = make_spec(CATALOG, [4200], aggs, "1m")
+                    data = fetch_report(cursor, spec, fromm, to)
+                    delta, = [row[3] for row in summarize(data, spec) if row[1] == "delta"]
+                    return data.tier, delta
+
+                # minute-aligned: from the rollups; p95 forces the raw samples
+                assert total(["delta"], T0, T0 + timedelta(minutes=3)) == ("1m", 31.0)
+                assert total(["delta", "p95"], T0, T0 + timedelta(minutes=3)) == (None, 31.0)
+                assert total(["delta"], T0 + timedelta(seconds=5), T0 + timedelta(minutes=3)) == (None, 31.0)
+                assert total(["delta"], T0 + timedelta(minutes=1), T0 + timedelta(minutes=3)) == ("1m", 21.0)
+        finally:
+            db.close()
+
+    pg(test)
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+
+from reportjobs import ReportJobs, cache_key
+
+
+def write(text: str):
+    def build(path: str) -> None:
+        with open(path, "w") as f:
+            f.write(text)
+    return build
+
+
+def test_cache_key_ignores_parameter_order():
+    assert cache_key({"from": 1, "to": 2}) == cache_key({"to": 2, "from": 1})
+    assert cache_key({"from": 1, "to": 2}) != cache_key({"from": 1, "to": 3})
+
+
+def test_a_report_already_built_is_served_from_the_cache(tmp_path):
+    jobs = ReportJobs(str(tmp_path))
+    first = jobs.wait(jobs.submit("k1", "pdf", write("report")), 5)
+    assert first.status == "done" and first.path.read_text() == "report"
+
+    def fail(path):
+        raise AssertionError("built twice")
+
+    again = jobs.submit("k1", "pdf", fail)
+    assert again.status == "done" and again.id != first.id
+    assert jobs.get(again.id) is again
+
+
+def test_requests_for_a_report_in_flight_share_its_job(tmp_path):
+    jobs = ReportJobs(str(tmp_path))
+    release = threading.Event()
+    builds = []
+
+    def slow(path):
+        builds.append(path)
+        release.wait(5)
+        write("report")(path)
+
+    job = jobs.submit("k1", "xlsx", slow)
+    assert jobs.submit("k1", "xlsx", slow) is job
+    release.set()
+    assert jobs.wait(job, 5).status == "done"
+    assert len(builds) == 1
+
+
+def test_a_failed_build_leaves_no_file(tmp_path):
+    jobs = ReportJobs(str(tmp_path))
+
+    def broken(path):
+        write("half")(path)
+        raise ValueError("No readings in the selected range")
+
+    job = jobs.wait(jobs.submit("k1", "pdf", broken), 5)
+    assert job.status == "failed" and "No readings" in job.error
+    assert list(tmp_path.iterdir()) == []
+    # not cached: the next request builds it again
+    assert jobs.wait(jobs.submit("k1", "pdf", write("report")), 5).status == "done"
+
+
+def test_eviction_drops_old_files_then_the_least_recently_served(tmp_path):
+    jobs = ReportJobs(str(tmp_path), max_bytes=250, max_age=3600)
+    now = time.time()
+    for name, age in (("old", 7200), ("a", 300), ("b", 200), ("c", 100)):
+        p = tmp_path / f"tpm_report_{name}.pdf"
+        p.write_bytes(b"x" * 100)
+        os.utime(p, (now - age, now - age))
+    (tmp_path / "tpm_report_d.pdf.part").write_bytes(b"x" * 1000)
+
+    # "old" is past max_age, then "a" goes to get under max_bytes
+    assert jobs.evict() == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "tpm_report_b.pdf", "tpm_report_c.pdf", "tpm_report_d.pdf.part",
+    ]
+
+    # serving "b" from the cache makes "c" the least recently used
+    jobs.submit("b", "pdf", write("unused"))
+    (tmp_path / "tpm_report_e.pdf").write_bytes(b"x" * 100)
+    assert jobs.evict() == 1
+    assert not (tmp_path / "tpm_report_c.pdf").exists()
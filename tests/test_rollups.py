@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from genstate import GENRUNS_SCHEMA, OFF_LEVEL
+from readings import SampleWriter, ensure_sample_table
+from readplanner import Signal
+from rollups import (RollupAccumulator, bucket_start, ensure_rollup_tables, pick_tier,
+                     rebuild_rollups, tier_select)
+
+CAIRO = ZoneInfo("Africa/Cairo")
+VOLTAGE = Signal(3000, "v", "int16", 0.1, "V")
+ENERGY = Signal(4200, "kwh", "uint32", 1, "kWh")
+T0 = datetime(2026, 1, 1, 10, 0, 5, tzinfo=timezone.utc)
+
+
+class RecordingConn:
+    def __init__(self, fail_on=None):
+        self.rows = {}
+        self.fail_on = fail_on
+
+    async def executemany(self, sql, rows):
+        tier = sql.split("tpmrollup_")[1].split()[0]
+        if tier == self.fail_on:
+            raise OSError("connection lost")
+        self.rows.setdefault(tier, []).extend(rows)
+
+
+def test_daily_buckets_start_at_local_midnight():
+    ts = datetime(2026, 1, 1, 21, 30, tzinfo=timezone.utc)     # 23:30 in Cairo
+    assert bucket_start(ts, 86400, CAIRO) == datetime(2025, 12, 31, 22, 0, tzinfo=timezone.utc)
+    assert bucket_start(ts + timedelta(hours=1), 86400, CAIRO) == datetime(2026, 1, 1, 22, 0, tzinfo=timezone.utc)
+    assert bucket_start(T0, 60, CAIRO) == T0.replace(second=0)
+
+
+def test_pick_tier_keeps_raw_samples_for_short_ranges():
+    assert pick_tier(3600) is None
+    assert pick_tier(86400) == "1m"
+    assert pick_tier(30 * 86400) == "1h"
+    assert pick_tier(20 * 365 * 86400) == "1d"
+
+
+def test_bucket_keeps_count_sum_extremes_and_ordered_first_last():
+    acc = RollupAccumulator([VOLTAGE, ENERGY])
+    # out of order on purpose: first/last follow ts, not arrival
+    acc.add("tpm1", T0 + timedelta(seconds=20), {"v": 231.0, "kwh": 12})
+    acc.add("tpm1", T0, {"v": 229.0, "kwh": 10})
+    acc.add("tpm1", T0 + timedelta(seconds=10), {"v": 235.0, "kwh": None})
+    conn = RecordingConn()
+    written = asyncio.run(acc.flush(conn))
+
+    assert written == 8     # two signals in each of four tiers
+    by_address = {row[2]: row[3:] for row in conn.rows["1m"]}
+    assert by_address[3000] == (3, 695.0, 229.0, 235.0, 229.0, T0, 231.0, T0 + timedelta(seconds=20))
+    assert by_address[4200] == (2, 22.0, 10.0, 12.0, 10.0, T0, 12.0, T0 + timedelta(seconds=20))
+    assert asyncio.run(acc.flush(conn)) == 0
+
+
+def test_failed_flush_keeps_unwritten_buckets_merged_with_new_samples():
+    acc = RollupAccumulator([VOLTAGE])
+    acc.add("tpm1", T0, {"v": 230.0})
+    with pytest.raises(OSError):
+        asyncio.run(acc.flush(RecordingConn(fail_on="1h")))
+    acc.add("tpm1", T0 + timedelta(seconds=30), {"v": 240.0})
+
+    conn = RecordingConn()
+    asyncio.run(acc.flush(conn))
+    hourly, = conn.rows["1h"]
+    assert hourly[3:] == (2, 470.0, 230.0, 240.0, 230.0, T0, 240.0, T0 + timedelta(seconds=30))
+
+
+def test_signals_dropped_from_the_map_stop_accumulating():
+    acc = RollupAccumulator([VOLTAGE, ENERGY])
+    acc.add("tpm1", T0, {"v": 230.0, "kwh": 10})
+    acc.set_signals([VOLTAGE])
+    acc.add("tpm1", T0 + timedelta(seconds=1), {"v": 232.0, "kwh": 11})
+    conn = RecordingConn()
+    asyncio.run(acc.flush(conn))
+    by_address = {row[2]: row[3] for row in conn.rows["1m"]}
+    assert by_address == {3000: 2, 4200: 1}
+
+
+def test_flushes_merge_into_the_stored_bucket(pg):
+    async def test(conn):
+        await ensure_rollup_tables(conn)
+        acc = RollupAccumulator([VOLTAGE], CAIRO)
+        acc.add("tpm1", T0 + timedelta(seconds=10), {"v": 230.0})
+        await acc.flush(conn)
+        acc.add("tpm1", T0, {"v": 220.0})
+        acc.add("tpm1", T0 + timedelta(seconds=20), {"v": 240.0})
+        await acc.flush(conn)
+        row = await conn.fetchrow("SELECT n, sum, min, max, first, last FROM tpmrollup_1m")
+        assert tuple(row) == (3, 690.0, 220.0, 240.0, 220.0, 240.0)
+
+    pg(test)
+
+
+def test_tier_report_shows_the_generators_the_raw_samples_show(pg):
+    async def test(conn):
+        await ensure_sample_table(conn, [VOLTAGE])
+        await ensure_rollup_tables(conn)
+        await conn.execute(GENRUNS_SCHEMA)
+        start = T0.replace(second=0)
+        # gen1 runs 00:05 - 00:20 into the hour, sampled once a minute
+        await conn.execute("INSERT INTO gen_runs (gen, start, \"end\") VALUES ('gen1', $1, $2)",
+                           start + timedelta(minutes=5), start + timedelta(minutes=20))
+        writer = SampleWriter([VOLTAGE])
+        rows = []
+        for minute in range(60):
+            on = 5 <= minute < 20
+            values = {"v": 230.0, "gen1": 1 - OFF_LEVEL if on else OFF_LEVEL, "gen2": OFF_LEVEL, "gen3": OFF_LEVEL}
+            rows.append(writer.row("tpm1", start + timedelta(minutes=minute), values))
+        await conn.executemany(writer.insert, rows)
+        await rebuild_rollups(conn, [VOLTAGE], "UTC")
+
+        sql = tier_select("15m", [("v", VOLTAGE.address, VOLTAGE.unit)])
+        for name, n in (("from", 1), ("to", 2), ("device", 3)):
+            sql = sql.replace(f"%({name})s", f"${n}")
+        tier = await conn.fetch(sql, start, start + timedelta(hours=1), None)
+        raw = await conn.fetch("""
+            SELECT date_bin('15 minutes', ts, $1) AS bucket, bool_or(gen1), bool_or(gen2), bool_or(gen3)
+            FROM tpmsample GROUP BY 1 ORDER BY 1 DESC
+        """, start)
+        assert [tuple(r)[:5] for r in tier] == [(r[0], "tpm1", r[1], r[2], r[3]) for r in raw]
+        assert [r[2] for r in tier] == [False, False, True, True]
+
+    pg(test)
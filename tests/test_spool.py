@@ -0,0 +1,76 @@
+from spool import HEADER, Spool
+
+
+def drain(spool: Spool) -> list:
+    records, position = spool.read(1000)
+    spool.commit(position)
+    return records
+
+
+def test_records_stay_until_committed_and_survive_a_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    for i in range(5):
+        spool.append(("tpm", i))
+    records, position = spool.read(3)
+    assert records == [("tpm", 0), ("tpm", 1), ("tpm", 2)]
+    # not committed: read again from the same place
+    assert spool.read(3)[0] == records
+    spool.commit(position)
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    assert drain(spool) == [("tpm", 3), ("tpm", 4)]
+    assert spool.read(10)[0] == []
+
+
+def test_torn_tail_is_cut_and_appends_follow_the_last_good_record(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append("a")
+    spool.append("b")
+    spool.close()
+    segment, = tmp_path.glob("*.seg")
+    # a crash in the middle of a write: a header promising more than was written
+    with open(segment, "ab") as f:
+        f.write(HEADER.pack(100, 0) + b"partial")
+
+    spool = Spool(str(tmp_path))
+    spool.append("c")
+    assert drain(spool) == ["a", "b", "c"]
+
+
+def test_record_failing_its_crc_ends_the_readable_part(tmp_path):
+    spool = Spool(str(tmp_path))
+    for r in ("a", "b", "c"):
+        spool.append(r)
+    spool.close()
+    segment, = tmp_path.glob("*.seg")
+    data = bytearray(segment.read_bytes())
+    data[-1] ^= 0xFF
+    segment.write_bytes(bytes(data))
+
+    spool = Spool(str(tmp_path))
+    spool.append("d")
+    assert drain(spool) == ["a", "b", "d"]
+
+
+def test_consumed_segments_are_deleted_and_reading_crosses_them(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64)
+    for i in range(20):
+        spool.append(i)
+    assert len(list(tmp_path.glob("*.seg"))) > 3
+    records, position = spool.read(15)
+    assert records == list(range(15))
+    spool.commit(position)
+    assert len(list(tmp_path.glob("*.seg"))) <= 3
+    spool.close()
+    assert drain(Spool(str(tmp_path), segment_bytes=64)) == list(range(15, 20))
+
+
+def test_oldest_segments_are_dropped_past_the_size_limit(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64, max_bytes=200)
+    for i in range(40):
+        spool.append(i)
+    assert spool.dropped_segments > 0
+    records = drain(spool)
+    # the newest records are kept, in order, with the oldest gone
+    assert records == list(range(records[0], 40)) and records[0] > 0
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from pymodbus.client import AsyncModbusTcpClient
+
+from simulated import modbus_slaves
+from transport import COMM_ERROR, FAILURES, RECONNECTS, CircuitBreaker, ModbusTransport, RetryBudget, client_timeout, worst
+
+
+async def _transport(port: int, **kwargs) -> ModbusTransport:
+    kwargs.setdefault("request_timeout", 0.2)
+    client = AsyncModbusTcpClient("127.0.0.1", port=port, timeout=client_timeout(kwargs["request_timeout"]),
+                                  retries=0, reconnect_delay=0)
+    await client.connect()
+    return ModbusTransport(client, name=f"test:{port}", **kwargs)
+
+
+def test_silent_slave_leaves_the_link_to_the_others():
+    async def run():
+        async with modbus_slaves({1: [10, 20, 30]}) as port:
+            transport = await _transport(port, retries=1)
+            reconnects = RECONNECTS.labels(transport.name).value
+            with pytest.raises(asyncio.TimeoutError):
+                await transport.read_holding_registers(0, 3, slave=7)
+            assert transport.connected
+            rr = await transport.read_holding_registers(0, 3, slave=1)
+            assert rr.registers == [10, 20, 30]
+            assert RECONNECTS.labels(transport.name).value == reconnects
+            # the abandoned requests aren't kept waiting for a reply
+            assert not transport.client.transaction.transactions
+            transport.close()
+
+    asyncio.run(run())
+
+
+def test_timeouts_are_retried_within_the_budget():
+    async def run():
+        async with modbus_slaves({1: [1]}) as port:
+            transport = await _transport(port, retries=2, budget=RetryBudget(ratio=0, cap=1))
+            failures = FAILURES.labels(transport.name, "timeout")
+            before = failures.value
+            with pytest.raises(asyncio.TimeoutError):
+                await transport.read_holding_registers(0, 1, slave=7)
+            # the first try and the one retry the budget had a token for
+            assert failures.value - before == 2
+            before = failures.value
+            with pytest.raises(asyncio.TimeoutError):
+                await transport.read_holding_registers(0, 1, slave=7)
+            assert failures.value - before == 1
+            transport.close()
+
+    asyncio.run(run())
+
+
+def test_link_that_answers_nothing_is_reopened():
+    async def run():
+        async with modbus_slaves({1: [5]}) as port:
+            transport = await _transport(port, retries=0, silent_after=0.1, backoff=0.01)
+            reconnects = RECONNECTS.labels(transport.name)
+            before = reconnects.value
+            await asyncio.sleep(0.15)
+            with pytest.raises(asyncio.TimeoutError):
+                await transport.read_holding_registers(0, 1, slave=7)
+            for _ in range(100):
+                if reconnects.value > before:
+                    break
+                await asyncio.sleep(0.02)
+            assert reconnects.value == before + 1
+            rr = await transport.read_holding_registers(0, 1, slave=1)
+            assert rr.registers == [5]
+            transport.close()
+
+    asyncio.run(run())
+
+
+def test_breaker_opens_after_threshold_and_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=2, cooldown=10)
+    assert not breaker.failure(0)
+    assert breaker.failure(1)
+    assert not breaker.allow(5)
+    assert breaker.allow(12)
+    assert not breaker.allow(12.5)
+    breaker.success()
+    assert not breaker.open and breaker.allow(13)
+
+
+def test_worst_quality():
+    assert worst([]) == "good"
+    assert worst(["good", "comm-error", "stale"]) == COMM_ERROR
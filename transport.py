@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Optional
+
+from pymodbus.exceptions import ConnectionException, ModbusException
+
+from metrics import Counter, Histogram
+
+log = logging.getLogger(__name__)
+
+REQUEST_SECONDS = Histogram("scada_modbus_request_seconds", "One Modbus transaction, every try counted", ("link", "result"))
+RETRIES = Counter("scada_modbus_retries_total", "Modbus requests sent again after a failed try", ("link",))
+# reason: "timeout" (no answer in time, a silent meter) or "error" (an exception or protocol error)
+FAILURES = Counter("scada_modbus_failures_total", "Modbus tries that got no usable answer", ("link", "reason"))
+RECONNECTS = Counter("scada_modbus_reconnects_total", "Links reopened after they dropped", ("link",))
+
+# quality of a sample or signal value
+GOOD = "good"                   # read by the latest poll
+STALE = "stale"                 # that read failed, this is the last good value, held a little while
+COMM_ERROR = "comm-error"       # no good read for too long, no value
+
+QUALITY_ORDER = (GOOD, STALE, COMM_ERROR)
+
+
+def worst(qualities) -> str:
+    return max(qualities, key=QUALITY_ORDER.index, default=GOOD)
+
+
+def client_timeout(request_timeout: float) -> float:
+    """
+    The pymodbus client's own timeout for a ModbusTransport with this
+    request_timeout. It has to be the longer one: when the client's runs
+    out it closes the link, which cuts off every other device on it.
+    """
+    return request_timeout * 2 + 1
+
+
+class RetryBudget:
+    """
+    Retries as a share of requests: every request adds `ratio` of a token,
+    every retry takes a whole one, up to `cap` saved. A link that fails
+    all the time ends up retrying `ratio` as often as it requests, instead
+    of multiplying its load on a bus that is already in trouble.
+    """
+
+    def __init__(self, ratio: float = 0.1, cap: float = 10.0):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = cap
+
+    def deposit(self) -> None:
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Per device: after `threshold` failed polls in a row, stop asking it for
+    `cooldown` seconds, then let one poll through to try. On a shared bus
+    that keeps a dead meter from spending every other device's time on its
+    timeouts.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 10.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self, now: float) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._trial or now - self.opened_at < self.cooldown:
+            return False
+        self._trial = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def failure(self, now: float) -> bool:
+        """returns: True if this failure opened the circuit"""
+        self.failures += 1
+        was_open = self.opened_at is not None
+        self._trial = False
+        if was_open or self.failures >= self.threshold:
+            self.opened_at = now
+        return not was_open and self.opened_at is not None
+
+
+class ModbusTransport:
+    """
+    One pymodbus client (a TCP gateway or the serial bus) as PollEngine
+    uses it, with the failure handling the bare client lacks.
+
+    Every request has its own deadline, `request_timeout`, and is retried
+    up to `retries` times while the RetryBudget allows. A request that
+    runs out of time is one silent slave, the link stays open for the
+    other devices on it; only when nothing at all has answered for
+    `silent_after` seconds is the link taken for dead and reopened.
+    A lost connection is reopened in the background with jittered
+    exponential backoff, starting at `backoff` seconds and growing to
+    `backoff_max`; until then requests fail at once instead of waiting on
+    a dead link. The client should be made with retries=0,
+    reconnect_delay=0 and timeout=client_timeout(request_timeout), so
+    this is the only layer timing out, retrying and reconnecting.
+    """
+
+    def __init__(
+        self,
+        client,
+        name: str = "",
+        request_timeout: float = 1.0,
+        retries: int = 2,
+        budget: Optional[RetryBudget] = None,
+        backoff: float = 0.5,
+        backoff_max: float = 30.0,
+        silent_after: float = 30.0,
+    ):
+        self.client = client
+        self.name = name
+        self.request_timeout = request_timeout
+        self.retries = retries
+        self.budget = budget or RetryBudget()
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.silent_after = silent_after
+        self._answered = time.monotonic()
+        self._reconnecting: Optional[asyncio.Task] = None
+        self._ok = REQUEST_SECONDS.labels(name, "ok")
+        self._failed = REQUEST_SECONDS.labels(name, "failed")
+        self._retries = RETRIES.labels(name)
+        self._timeouts = FAILURES.labels(name, "timeout")
+        self._errors = FAILURES.labels(name, "error")
+        self._reconnects = RECONNECTS.labels(name)
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.client.connected)
+
+    async def read_holding_registers(self, address: int, count: int = 1, **kwargs):
+        """the client's read, raises ModbusException / asyncio.TimeoutError when every try failed"""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.connected:
+                self.reconnect()
+                raise ConnectionException(f"{self.name} is not connected")
+            start = time.perf_counter()
+            try:
+                rr = await asyncio.wait_for(
+                    self.client.read_holding_registers(address, count, **kwargs),
+                    self.request_timeout,
+                )
+                self._ok.observe(time.perf_counter() - start)
+                self._answered = time.monotonic()
+                return rr
+            except asyncio.TimeoutError:
+                self._failed.observe(time.perf_counter() - start)
+                self._timeouts.inc()
+                self._forget_abandoned()
+                if time.monotonic() - self._answered > self.silent_after:
+                    log.warning("%s: nothing answered for %ss, reopening the link", self.name, self.silent_after)
+                    self.client.close()
+                    self.reconnect()
+                    raise
+                if attempt >= self.retries or not self.budget.withdraw():
+                    raise
+            except ModbusException:
+                self._failed.observe(time.perf_counter() - start)
+                self._errors.inc()
+                if not self.connected:
+                    self.reconnect()
+                    raise
+                if attempt >= self.retries or not self.budget.withdraw():
+                    raise
+            attempt += 1
+            self._retries.inc()
+
+    def _forget_abandoned(self) -> None:
+        # the client keeps a cancelled request's future until a reply with its
+        # transaction id comes, and a silent slave never sends one
+        pending = self.client.transaction.transactions
+        for tid in [tid for tid, future in pending.items() if future.done()]:
+            del pending[tid]
+
+    def reconnect(self) -> None:
+        if self._reconnecting is None or self._reconnecting.done():
+            self._reconnecting = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        attempt = 0
+        while not self.connected:
+            # "full jitter": links that dropped together don't all come back at once
+            await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff * math.pow(2, attempt))))
+            attempt += 1
+            try:
+                self.client.close()
+                await self.client.connect()
+            except Exception as e:
+                log.warning("%s: reconnect failed: %r", self.name, e)
+        self._answered = time.monotonic()
+        self._reconnects.inc()
+        log.info("%s: reconnected after %d tries", self.name, attempt)
+
+    def replace(self, client) -> None:
+        """Switch to another client, e.g. reopened with new serial settings."""
+        old, self.client = self.client, client
+        self._answered = time.monotonic()
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        old.close()
+
+    def close(self) -> None:
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        self.client.close()
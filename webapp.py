@@ -1,207 +1,56 @@
-from flask import Flask,render_template,send_file,request,jsonify
-from flask_socketio import SocketIO, emit
-import psycopg2
+from flask import Flask,render_template,send_file,request,jsonify,Response
 from dotenv import load_dotenv
-from openpyxl import Workbook
-import json 
 from datetime import datetime,timezone
 from zoneinfo import ZoneInfo
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.dates as mdates
 import os
-from collections import defaultdict
-import re 
-from pathlib import Path
+import importlib.util
 from urllib.parse import quote
-import requests
+from appauth import AuthCheck
+from db import CONFIG_CHANNEL, pooled_cursor, web_pool
+from pdfrender import make_charts_pdf, make_series_pdf
+from reportbuilder import ReportSignal, fetch_report, make_spec, write_report_xlsx
+from export import chunks, csv_lines, write_parquet, write_xlsx
+from reportjobs import ReportJobs, cache_key
+from rollups import TIERS, is_counter, pick_tier, tier_select
 
 load_dotenv()
 
 ISTANBUL = ZoneInfo("Europe/Istanbul")
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-connection = psycopg2.connect(
-    host="localhost",
-    port="5432",
-    database=os.getenv("DB_NAME_LOCAL"),
-    password=os.getenv("DB_PASSWORD_LOCAL"),
-    user="devgadbadr"
+
+# one connection per request, so concurrent downloads don't share a cursor
+pool = web_pool()
+
+# asked once per AUTH_TTL, not on every page load
+auth = AuthCheck(
+    os.getenv("AUTH_URL", "https://devgadbadr.com/scadapiauth/auth"),
+    ttl=float(os.getenv("AUTH_TTL", "300")),
+    grace=float(os.getenv("AUTH_GRACE", "86400")),
+    stub=os.getenv("AUTH_STUB", ""),
 )
-connection.autocommit = True
-cursor = connection.cursor()
 
-def calculate_gen_hours(rows, end_at=None):
+def calculate_gen_hours(fromm, to):
     """
-    rows: iterable of (status, timestamp)
+    Hours each generator ran inside [fromm, to], from the gen_runs intervals
+    the poller maintains. Runs are clipped to the window, so a run already
+    going at `fromm` counts from `fromm` and one still open counts until now.
     returns: {"Generator 1": 5.0, "Generator 2": 3.0, ...}  (hours)
     """
-    GEN_RE = re.compile(r"gen\s*(\d+)\s+(on|off)", re.IGNORECASE)
-    last_on = {}
-    totals = defaultdict(float)
-    if end_at is None:
-        end_at = datetime.now(timezone.utc)
-
-    for status, ts in sorted(rows, key=lambda r: r[1]):
-        m = GEN_RE.search(str(status))
-        if not m:
-            continue
-        gen_id = int(m.group(1))
-        state = m.group(2).lower()
-
-        if state == "on":
-            last_on[gen_id] = ts
-        elif state == "off" and gen_id in last_on:
-            delta = (ts - last_on[gen_id]).total_seconds()
-            if delta > 0:
-                totals[gen_id] += delta
-            last_on.pop(gen_id, None)
-
-    # close any open ON periods
-    for gen_id, on_ts in last_on.items():
-        delta = (end_at - on_ts).total_seconds()
-        if delta > 0:
-            totals[gen_id] += delta
-
-    return {f"Generator {gid}": round(sec / 3600, 3) for gid, sec in totals.items()}
-
-def _parse_iso_aware(s: str) -> datetime:
-    # accepts "...Z" or "+00:00" or naive (assume UTC)
-    if isinstance(s, datetime):
-        dt = s if s.tzinfo else s.replace(tzinfo=timezone.utc)
-    else:
-        if s.endswith("Z"):
-            s = s[:-1] + "+00:00"
-        dt = datetime.fromisoformat(s)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-    return dt
-
-def _to_tr_naive(dt: datetime) -> datetime:
-    # to Europe/Istanbul, then strip tzinfo for matplotlib/xlsx friendliness
-    return dt.astimezone(ISTANBUL).replace(tzinfo=None)
-
-def _numify(v):
-    if isinstance(v, (int, float)) or v is None:
-        return v
-    if isinstance(v, str):
-        try:
-            return int(v) if v.strip().isdigit() else float(v)
-        except Exception:
-            return v
-    return v
-
-def make_charts_pdf(
-    timestamps,                         # list[str|datetime]
-    total_active_power,                 # list[number]
-    output_path,                        # "/home/.../report.pdf"
-    from_iso=None,
-    to_iso=None,
-    last_row=None,                      # {"data": {...}} or {...}
-    genhours=None,                      # {'Generator 1': 5.0, ...}
-    last_ts=None                        # ISO string or datetime for "Last readings at ..."
-):
-    if not (timestamps and total_active_power):
-        raise ValueError("No data provided")
-    if len(timestamps) != len(total_active_power):
-        raise ValueError("timestamps and power must have equal length")
-
-    Path(os.path.dirname(output_path) or ".").mkdir(parents=True, exist_ok=True)
-
-    ts_tr = [_to_tr_naive(_parse_iso_aware(t)) for t in timestamps]
-
-    # subtitle "from .. to .. (Europe/Istanbul)" if provided
-    if from_iso and to_iso:
-        f_tr = _to_tr_naive(_parse_iso_aware(from_iso)).strftime("%Y-%m-%d %H:%M")
-        t_tr = _to_tr_naive(_parse_iso_aware(to_iso  )).strftime("%Y-%m-%d %H:%M")
-        subtitle = f"from {f_tr} to {t_tr} (Europe/Istanbul)"
-    else:
-        subtitle = "Europe/Istanbul"
-
-    with PdfPages(output_path) as pdf:
-        # ---- Page 1: Working hours bar chart ----
-        order = ["Generator 1", "Generator 2", "Generator 3"]
-        gh = genhours or {}
-        values = [_numify(gh.get(name, 0)) for name in order]
-        max_v = max(values) if values else 0
-
-        fig0, ax0 = plt.subplots(figsize=(11.69, 8.27))
-        fig0.suptitle("TPM-04ES Report", fontsize=18, fontweight="bold", y=0.98)
-        ax0.set_title("Generators Working Hours\n" + subtitle, fontsize=13, pad=12)
-
-        ax0.barh(order, values, height=0.45)
-        ax0.set_xlabel("Hours")
-        ax0.set_ylabel("Generator")
-        ax0.grid(True, axis="x", linestyle="--", alpha=0.4)
-        ax0.margins(x=0.10, y=0.20)
-        if max_v > 0:
-            ax0.set_xlim(0, max_v * 1.15)
-        for y, v in enumerate(values):
-            ax0.text(v, y, f"  {v:g}", va="center", ha="left")
-
-        fig0.subplots_adjust(left=0.12, right=0.96, top=0.90, bottom=0.12)
-        plt.tight_layout(pad=1.2, rect=[0, 0, 1, 0.95])
-        pdf.savefig(fig0); plt.close(fig0)
-
-        # --- Page 2: Total Active Power ---
-        fig1, ax1 = plt.subplots(figsize=(11.69, 8.27))
-        ax1.plot(ts_tr, total_active_power)
-        ax1.set_title("Total Active Power\n" + subtitle, fontsize=14, pad=10)
-        ax1.set_xlabel("Time (Europe/Istanbul)")
-        ax1.set_ylabel("Total Active Power (W)")
-        ax1.grid(True, linestyle="--", alpha=0.4)
-        ax1.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d\n%H:%M"))
-        fig1.autofmt_xdate()
-        ax1.margins(x=0.03, y=0.10)
-        fig1.subplots_adjust(left=0.10, right=0.97, top=0.90, bottom=0.18)
-        plt.tight_layout(pad=1.2)
-        pdf.savefig(fig1); plt.close(fig1)
-
-        # --- Page 3: Last readings table ---
-        data_dict = {}
-        if isinstance(last_row, dict):
-            if "data" in last_row and isinstance(last_row["data"], dict):
-                data_dict = last_row["data"]
-            else:
-                data_dict = last_row  # readings dict directly
-
-        keys = sorted(data_dict.keys()) if data_dict else []
-        table_rows = [[k, _numify(data_dict.get(k))] for k in keys]
-
-        # use passed last_ts for title if provided
-        if last_ts:
-            try:
-                title_ts = _to_tr_naive(_parse_iso_aware(last_ts)).strftime("%Y-%m-%d %H:%M:%S")
-            except Exception:
-                title_ts = str(last_ts)
-        else:
-            title_ts = "unknown"
-
-        fig3, ax3 = plt.subplots(figsize=(11.69, 8.27))
-        ax3.axis("off")
-        ax3.set_title(f"Last readings at {title_ts} (Europe/Istanbul)", fontsize=14, pad=16)
-
-        if table_rows:
-            tbl = ax3.table(
-                cellText=table_rows,
-                colLabels=["Reading", "Value"],
-                cellLoc="center",
-                colWidths=[0.55, 0.30],
-                loc="upper center",
-            )
-            tbl.auto_set_font_size(False)
-            tbl.set_fontsize(9)
-            tbl.scale(1.05, 1.12)
-        else:
-            ax3.text(0.5, 0.5, "No readings available", ha="center", va="center", fontsize=12)
-
-        fig3.subplots_adjust(left=0.06, right=0.94, top=0.92, bottom=0.08)
-        plt.tight_layout(pad=1.0)
-        pdf.savefig(fig3); plt.close(fig3)
-
-    return output_path
-
+    with pooled_cursor(pool) as cursor:
+        cursor.execute("""
+            SELECT gen,
+                   sum(greatest(extract(epoch FROM
+                       least(coalesce("end", now()), %(to)s) - greatest(start, %(from)s)), 0))
+            FROM gen_runs
+            WHERE tstzrange(start, "end") && tstzrange(%(from)s, %(to)s)
+            GROUP BY gen
+        """, {"from": fromm, "to": to})
+        runs = cursor.fetchall()
+    totals = {}
+    for gen, sec in runs:
+        gen_id = gen.replace("gen", "").strip() or gen
+        totals[f"Generator {gen_id}"] = round(float(sec) / 3600, 3)
+    return totals
 
 def parse_iso_to_utc(iso_str: str) -> datetime:
     # "Z" means UTC; make it ISO8601-friendly for fromisoformat
@@ -222,23 +71,18 @@ def to_excel_naive(dt: datetime, zone: ZoneInfo = ISTANBUL) -> datetime:
 
 @app.route("/")
 def main():
-    
-    res = requests.get("https://devgadbadr.com/scadapiauth/auth")
-    try:
-        resJson = res.json()
-        print(resJson)
-        if resJson['authenticated']:
-            return render_template("index.html")
-        else:
-            return 'You App is Disabled, Contact Developer Gad Badr'
-    except:
+    if auth.allowed():
+        # live values come from the live hub (livehub.py), not from this app
+        return render_template("index.html", live_port=os.getenv("LIVEHUB_PORT", "3001"))
+    else:
         return 'You App is Disabled, Contact Developer Gad Badr'
     
 @app.route("/getsettings")
 def getsettings():
-    cursor.execute("SELECT * FROM settings")
-    row = cursor.fetchone()
-    colnames = [desc[0] for desc in cursor.description]
+    with pooled_cursor(pool) as cursor:
+        cursor.execute("SELECT * FROM settings")
+        row = cursor.fetchone()
+        colnames = [desc[0] for desc in cursor.description]
     settings = dict(zip(colnames, row))
     return jsonify({"settings":settings})
 
@@ -263,138 +107,274 @@ def saveserial():
                 timeout = %s
             WHERE id = 1
             """
-    cursor.execute(query, params)
+    with pooled_cursor(pool) as cursor:
+        cursor.execute(query, params)
+        # the serial poller reopens the port with these right away
+        cursor.execute("SELECT pg_notify(%s, 'settings')", (CONFIG_CHANNEL,))
     return jsonify({"msg":"Saved"})
 
-@app.route("/downloadlog",methods=["POST"])
-def donwload_log():
-    print("body is:",request.get_json())
-    datafilter = request.get_json()
-    # cursor.execute("select * from tpmreading order by timestamp desc")
-    fromm = parse_iso_to_utc(datafilter['from'])
-    to = parse_iso_to_utc(datafilter['to'])
-    cursor.execute("""
-        SELECT *
-        FROM tpmreading
-        WHERE "timestamp" BETWEEN %s AND %s
-        ORDER BY "timestamp" DESC
-    """, (fromm, to))
-    data = cursor.fetchall()
-
-    cursor.execute("""
-        SELECT status, "timestamp"
-        FROM gens
-        WHERE "timestamp" BETWEEN %s AND %s
-        ORDER BY "timestamp" DESC
-    """, (fromm, to))
-    gensdata = cursor.fetchall()
-
-    genhours = calculate_gen_hours(gensdata)
-    print(genhours)
+def signal_columns():
+    """[(tpmsample column, parameter name, address, unit)] in register-map order"""
+    with pooled_cursor(pool) as cursor:
+        cursor.execute("SELECT col, parameter, address, unit FROM tpmsignal ORDER BY address")
+        return cursor.fetchall()
 
+def report_query(fromm, to, device, tier, columns):
+    """
+    columns: signal_columns()
+    returns: (sql, params, names) for rows laid out as
+      (timestamp, device, gen1, gen2, gen3, *names), newest first
+    """
+    names = [name for _, name, _, _ in columns]
+    if tier:
+        sql = tier_select(tier, [(col, address, unit) for col, _, address, unit in columns])
+        names += [f"{name} delta" for _, name, _, unit in columns if is_counter(unit)]
+        return sql, {"from": fromm, "to": to, "device": device}, names
+    sql = f"""
+        SELECT ts, device, gen1, gen2, gen3, {", ".join(col for col, _, _, _ in columns)}
+        FROM tpmsample
+        WHERE ts BETWEEN %s AND %s AND (%s::text IS NULL OR device = %s)
+        ORDER BY ts DESC
+    """
+    return sql, (fromm, to, device, device), names
+
+def _gens(row):
+    # generator columns: 1 = on, 0 = off
+    return [None if g is None else int(g) for g in row[2:5]]
+
+def build_excel(path, sql, params, header):
+    # streamed through a server-side cursor, one chunk in memory at a time
+    with pooled_cursor(pool, name="report") as cursor:
+        cursor.execute(sql, params)
+        count = write_xlsx(path, "TPM Report", header, (
+            [[to_excel_naive(r[0]), r[1], *_gens(r), *r[5:]] for r in chunk] for chunk in chunks(cursor)
+        ))
+    print(f"✅ Exported {count} rows → {path}")
+
+def build_parquet(path, sql, params, header):
+    with pooled_cursor(pool, name="report") as cursor:
+        cursor.execute(sql, params)
+        count = write_parquet(path, header, chunks(cursor))
+    print(f"✅ Exported {count} rows → {path}")
+
+def build_pdf(path, sql, params, names, fromm, to):
+    with pooled_cursor(pool) as cursor:
+        cursor.execute(sql, params)
+        data = cursor.fetchall()
+    if not data:
+        raise ValueError("No readings in the selected range")
+    genhours = calculate_gen_hours(fromm, to)
+    print(genhours)
     readings_rows = [
-        {"timestamp": row[2], "data": dict(row[1])} for row in data
+        {"timestamp": row[0], "data": dict(zip(names, row[5:]))} for row in data
     ]
+    timestamps = [x[0] for x in data]
+    powerIdx = 5 + names.index("Total Active Power")
+    activePowers = [row[powerIdx] for row in data]
+    make_charts_pdf(timestamps,activePowers,path,fromm,to,readings_rows[0]['data'],genhours,readings_rows[0]['timestamp'])
+    print(f"✅ PDF saved: {path}")
+
+REPORT_TYPES = {
+    # file type: (extension, mimetype)
+    "excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "pdf": ("pdf", "application/pdf"),
+    "parquet": ("parquet", "application/octet-stream"),
+}
+
+jobs = ReportJobs(
+    os.getenv("REPORTS_DIR", "/home/bigled/scadaonpi/reports"),
+    workers=int(os.getenv("REPORT_WORKERS", "2")),
+    max_bytes=int(os.getenv("REPORTS_MAX_MB", "200")) << 20,
+    max_age=float(os.getenv("REPORTS_MAX_AGE_DAYS", "7")) * 86400,
+)
 
-    # Collect all JSON keys across all rows
-    all_keys = []
-    seen = set()
-    seen.add('genhours')
-    for r in data:
-        payload = r[1]
-        if isinstance(payload, str):
-            payload = json.loads(payload)
-        if isinstance(payload, dict):
-            for k in payload.keys():
-                if k not in seen:
-                    seen.add(k)
-                    all_keys.append(k)
-    print(all_keys)
-    # Build workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "TPM Report"
-    header = ["timestamp"] + all_keys
-    ws.append(header)
-
-     # Write data rows
-    for r in data:
-        payload = r[1]
-        if isinstance(payload, str):
-            payload = json.loads(payload)
-        payload = payload or {}
-
-        row = [to_excel_naive(r[2])]
-        for k in all_keys:
-            v = payload.get(k)
-            # try to coerce numeric strings to numbers
-            if isinstance(v, str):
-                try:
-                    if v.strip().isdigit():
-                        v = int(v)
-                    else:
-                        v = float(v)
-                except Exception:
-                    pass
-            if 'gen' in k:
-                if isinstance(v,int):
-                    if v:
-                        v= 0
-                    else:
-                        v = 1
-            row.append(v)
-        ws.append(row)
-
-    # (nice) auto width
-    for col_idx, col_name in enumerate(header, start=1):
-        max_len = len(str(col_name))
-        for r in range(2, ws.max_row + 1):
-            cell_val = ws.cell(row=r, column=col_idx).value
-            max_len = max(max_len, len(str(cell_val)) if cell_val is not None else 0)
-        ws.column_dimensions[ws.cell(row=1, column=col_idx).column_letter].width = min(max_len + 2, 40)
-
-    now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    timestamps = [x[2] for x in data]
-    activePowers = []
-    activeEnergies = []
-    for row in data:
-        dataDict = row[1]
-        activePower = dataDict["Total Active Power"]
-        activeEnergy =  dataDict["Total Active Import Energy"]
-        activePowers.append(activePower)
-        activeEnergies.append(activeEnergy)
-
-    if datafilter['file'] == 'excel':
-        xlsx_path = f"/home/bigled/scadaonpi/reports/tpm_report_{now}.xlsx"
-        wb.save(xlsx_path)
-        print(f"✅ Exported {len(data)} rows → {xlsx_path}")
-        return send_file(xlsx_path, as_attachment=True, download_name=f"tpm_report_{now}.xlsx", max_age=0)
-    elif datafilter['file'] == 'pdf':
-        pdfOutput = f"/home/bigled/scadaonpi/reports/tpm_report_{now}.pdf"
-        make_charts_pdf(timestamps,activePowers,pdfOutput,fromm,to,readings_rows[0]['data'],genhours,readings_rows[0]['timestamp'])
-        print(f"✅ PDF saved: {pdfOutput}")
-        filename = Path(pdfOutput).name
-        rv = send_file(
-            pdfOutput,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/pdf",
-            conditional=False,          # <- important: avoids 304/Range → 0 B
-            max_age=0
-        )
-        # Strongly disable caches and help IDM/browser naming
-        rv.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        rv.headers["Pragma"] = "no-cache"
-        rv.headers["Expires"] = "0"
-        # Supply both filename and filename* (UTF-8) explicitly
-        rv.headers["Content-Disposition"] = (
-            f"attachment; filename={filename}; filename*=UTF-8''{quote(filename)}"
+def data_watermark(fromm, to, with_runs):
+    """
+    Changes whenever the data behind a report over [fromm, to] does: the
+    newest sample in the range and, for the generator hours, the newest
+    run boundary inside it (now() while a run is still open and `to` has
+    not passed yet).
+    """
+    with pooled_cursor(pool) as cursor:
+        cursor.execute("""
+            SELECT (SELECT max(ts) FROM tpmsample WHERE ts BETWEEN %(from)s AND %(to)s),
+                   CASE WHEN %(runs)s THEN
+                       (SELECT max(least(coalesce("end", now()), %(to)s)) FROM gen_runs
+                        WHERE tstzrange(start, "end") && tstzrange(%(from)s, %(to)s))
+                   END
+        """, {"from": fromm, "to": to, "runs": with_runs})
+        return [str(v) for v in cursor.fetchone()]
+
+def report_range(datafilter):
+    """
+    returns: (fromm, to, device, tier) of a report request body; tier is
+      None for raw samples
+    """
+    fromm = parse_iso_to_utc(datafilter['from'])
+    to = parse_iso_to_utc(datafilter['to'])
+    device = datafilter.get('device')   # None: every device
+    # long ranges come from the rollup tier with a bounded number of buckets;
+    # "tier": "raw" forces the raw samples
+    tier = datafilter.get('tier') or pick_tier((to - fromm).total_seconds())
+    if tier == 'raw':
+        tier = None
+    elif tier is not None and tier not in TIERS:
+        raise ValueError(f"Unknown tier: {tier}")
+    return fromm, to, device, tier
+
+def submit_report(datafilter):
+    """
+    returns: the ReportJob for a /downloadlog-style request body, or an
+      error response tuple
+    """
+    fileType = datafilter['file']       # excel, pdf or parquet
+    if fileType not in REPORT_TYPES:
+        return jsonify({"error": f"Unknown file type: {fileType}"}), 400
+    if fileType == 'parquet' and importlib.util.find_spec("pyarrow") is None:
+        return jsonify({"error": "Parquet export needs pyarrow installed"}), 400
+    try:
+        fromm, to, device, tier = report_range(datafilter)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if datafilter.get('signals'):
+        return submit_series_report(datafilter, fileType, fromm, to, device)
+    sql, params, names = report_query(fromm, to, device, tier, signal_columns())
+    header = ["timestamp", "device", "gen1", "gen2", "gen3"] + names
+
+    # identical requests over unchanged data share one file
+    key = cache_key({
+        "from": fromm, "to": to, "device": device, "tier": tier, "file": fileType,
+        "columns": names, "watermark": data_watermark(fromm, to, fileType == 'pdf'),
+    })
+    if fileType == 'pdf':
+        build = lambda path: build_pdf(path, sql, params, names, fromm, to)
+    elif fileType == 'excel':
+        build = lambda path: build_excel(path, sql, params, header)
+    else:
+        build = lambda path: build_parquet(path, sql, params, header)
+    return jobs.submit(key, REPORT_TYPES[fileType][0], build)
+
+# more buckets than this is a raw export, not a report
+MAX_REPORT_BUCKETS = 50_000
+
+def build_series(path, fileType, spec, fromm, to):
+    with pooled_cursor(pool) as cursor:
+        data = fetch_report(cursor, spec, fromm, to)
+    print(f"{len(data.periods)} rows from {data.tier or 'raw samples'}")
+    if fileType == 'pdf':
+        make_series_pdf(path, data, spec, fromm, to)
+        print(f"✅ PDF saved: {path}")
+    else:
+        write_report_xlsx(path, data, spec, to_excel_naive)
+        print(f"✅ Exported {len(data.periods)} rows → {path}")
+
+def submit_series_report(datafilter, fileType, fromm, to, device):
+    """
+    Report builder: "signals" (names or addresses) aggregated with "agg"
+    (avg, min, max, p95, delta; one or a list) per "bucket" ("15m", "8h",
+    "1d", ...) starting at "origin" ("06:00" for shifts).
+    """
+    if fileType == 'parquet':
+        return jsonify({"error": "Aggregated reports are PDF or Excel"}), 400
+    try:
+        spec = make_spec(
+            [ReportSignal(*c) for c in signal_columns()],
+            datafilter['signals'],
+            datafilter.get('agg', 'avg'),
+            datafilter.get('bucket', '1h'),
+            datafilter.get('origin', '00:00'),
+            device,
         )
-        return rv
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if (to - fromm).total_seconds() / spec.bucket > MAX_REPORT_BUCKETS:
+        return jsonify({"error": "Too many buckets, choose a larger bucket"}), 400
+    key = cache_key({
+        "from": fromm, "to": to, "device": device, "file": fileType,
+        "signals": [s.address for s in spec.signals], "aggs": spec.aggs,
+        "bucket": spec.bucket, "origin": spec.origin,
+        "watermark": data_watermark(fromm, to, False),
+    })
+    return jobs.submit(key, REPORT_TYPES[fileType][0], lambda path: build_series(path, fileType, spec, fromm, to))
+
+def send_report(job):
+    ext = job.path.suffix.lstrip(".")
+    mimetype = next(m for e, m in REPORT_TYPES.values() if e == ext)
+    filename = f"tpm_report_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.{ext}"
+    rv = send_file(
+        job.path,
+        as_attachment=True,
+        download_name=filename,
+        mimetype=mimetype,
+        conditional=False,          # <- important: avoids 304/Range → 0 B
+        max_age=0
+    )
+    # Strongly disable caches and help IDM/browser naming
+    rv.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+    rv.headers["Pragma"] = "no-cache"
+    rv.headers["Expires"] = "0"
+    # Supply both filename and filename* (UTF-8) explicitly
+    rv.headers["Content-Disposition"] = (
+        f"attachment; filename={filename}; filename*=UTF-8''{quote(filename)}"
+    )
+    return rv
+
+@app.route("/reports",methods=["POST"])
+def submit_report_job():
+    job = submit_report(request.get_json())
+    if isinstance(job, tuple):
+        return job
+    return jsonify(job.as_dict()), 202
+
+@app.route("/reports/<job_id>")
+def report_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.as_dict())
+
+@app.route("/reports/<job_id>/download")
+def download_report_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status != "done":
+        return jsonify(job.as_dict()), 409
+    return send_report(job)
 
-@socketio.on("modbus-data")
-def dataReceived(payload):
-    emit("modbus-data",payload,broadcast=True)
+@app.route("/downloadlog",methods=["POST"])
+def donwload_log():
+    print("body is:",request.get_json())
+    datafilter = request.get_json()
+    if datafilter['file'] == 'csv':
+        # streamed straight from a server-side cursor, never stored
+        try:
+            fromm, to, device, tier = report_range(datafilter)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        sql, params, names = report_query(fromm, to, device, tier, signal_columns())
+        header = ["timestamp", "device", "gen1", "gen2", "gen3"] + names
+        def generate():
+            with pooled_cursor(pool, name="report") as cursor:
+                cursor.execute(sql, params)
+                yield from csv_lines(header, (
+                    [[r[0].isoformat(), r[1], *_gens(r), *r[5:]] for r in chunk] for chunk in chunks(cursor)
+                ))
+        now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        return Response(generate(), mimetype="text/csv", headers={
+            "Content-Disposition": f"attachment; filename=tpm_report_{now}.csv",
+            "Cache-Control": "no-store",
+        })
+
+    # same job queue and cache as /reports, waited for in this request
+    job = submit_report(datafilter)
+    if isinstance(job, tuple):
+        return job
+    jobs.wait(job)
+    if job.status != "done":
+        return jsonify(job.as_dict()), 500
+    return send_report(job)
 
 if __name__ == "__main__":
-    socketio.run(app, host="0.0.0.0", port=3000,allow_unsafe_werkzeug=True)
+    # development server; serve.py is the one to run on the Pi
+    app.run(host="0.0.0.0", port=3000, threaded=True)